@@ -0,0 +1,196 @@
+# backend/adaptive_limits.py
+import math
+import threading
+import time
+from dataclasses import replace
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import redis
+
+if TYPE_CHECKING:
+    from policy_resolver import EffectiveLimit
+
+
+# One AIMD step of an adaptive group. The group's hash holds the scale applied
+# to its policies' configured limits and the time of the last change; at most
+# one change per interval, so a burst of reports counts as one signal. A scale
+# back at 1 deletes the hash, and an idle one expires (back to full limits).
+# KEYS  = group key
+# ARGV  = now_ms, unhealthy (1/0), decrease factor, increase step, min scale, interval_ms, idle_ms
+# Reply = {scale (string), action: -1 decreased, 1 increased, 0 unchanged}
+_FEEDBACK_LUA = """
+local now = tonumber(ARGV[1])
+local state = redis.call('HMGET', KEYS[1], 'scale', 'at')
+local scale = tonumber(state[1]) or 1
+local at = tonumber(state[2]) or 0
+local action = 0
+if now - at >= tonumber(ARGV[6]) then
+  if ARGV[2] == '1' then
+    scale = math.max(tonumber(ARGV[5]), scale * tonumber(ARGV[3]))
+    action = -1
+  elseif scale < 1 then
+    scale = math.min(1, scale + tonumber(ARGV[4]))
+    action = 1
+  end
+end
+if action ~= 0 then
+  if scale >= 1 then
+    redis.call('DEL', KEYS[1])
+  else
+    redis.call('HSET', KEYS[1], 'scale', tostring(scale), 'at', now)
+    redis.call('PEXPIRE', KEYS[1], ARGV[7])
+  end
+end
+return {tostring(scale), action}
+"""
+
+DECREASED = "decreased"
+INCREASED = "increased"
+UNCHANGED = "unchanged"
+_ACTIONS = {-1: DECREASED, 1: INCREASED, 0: UNCHANGED}
+
+
+def group_key(group: str) -> str:
+    return f"rl:adaptive:{group}"
+
+
+class AdaptiveLimits:
+    """
+    AIMD load shedding for policies with an adaptive_group.
+
+    Downstream services report a latency / error signal per group through
+    feedback(). A report over `latency_threshold_ms` or
+    `error_rate_threshold` multiplies the group's scale by `decrease` (not
+    below `min_scale`); a healthy one adds `increase` (up to 1). Policies of
+    the group are enforced at max(1, floor(limit * scale)).
+
+    The scale lives in Redis, so every node applies the same one. Checks
+    read a local copy that a daemon thread refreshes every
+    `refresh_seconds` for the groups this node has seen, so they add no
+    Redis call; a node picks up another node's change within that interval.
+    A report adds its group to the local copy only while fewer than
+    `max_groups` are tracked (checks always add theirs), so reports for
+    groups no policy uses cannot grow it without bound.
+    """
+
+    def __init__(
+        self,
+        redis_client: redis.Redis,
+        latency_threshold_ms: float = 1000.0,
+        error_rate_threshold: float = 0.05,
+        decrease: float = 0.7,
+        increase: float = 0.05,
+        min_scale: float = 0.1,
+        interval_seconds: float = 1.0,
+        idle_seconds: float = 3600.0,
+        refresh_seconds: float = 1.0,
+        max_groups: int = 1024,
+    ):
+        self.redis = redis_client
+        self.latency_threshold_ms = latency_threshold_ms
+        self.error_rate_threshold = error_rate_threshold
+        self.decrease = decrease
+        self.increase = increase
+        self.min_scale = min_scale
+        self.interval_ms = int(interval_seconds * 1000)
+        self.idle_ms = int(idle_seconds * 1000)
+        self.refresh_seconds = refresh_seconds
+        self.max_groups = max_groups
+        self._feedback = self.redis.register_script(_FEEDBACK_LUA)
+        self._scales: Dict[str, float] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.decreases = 0
+        self.increases = 0
+        self.refresh_errors = 0
+        self.last_error: Optional[str] = None
+
+    def scale(self, group: str) -> float:
+        return self._scales.get(group, 1.0)
+
+    def scales(self) -> Dict[str, float]:
+        return dict(self._scales)
+
+    def apply(self, limits: List["EffectiveLimit"]) -> List["EffectiveLimit"]:
+        """The request's limits with adaptive ones scaled (copies; cached limits are shared)."""
+        if not any(lim.adaptive_group for lim in limits):
+            return limits
+        applied = []
+        for lim in limits:
+            if lim.adaptive_group:
+                scale = self._scales.setdefault(lim.adaptive_group, 1.0)
+                if scale < 1.0:
+                    lim = replace(
+                        lim, limit=max(1, math.floor(lim.limit * scale)), configured_limit=lim.limit
+                    )
+            applied.append(lim)
+        return applied
+
+    def unhealthy(self, latency_ms: Optional[float], error_rate: Optional[float]) -> bool:
+        return (latency_ms is not None and latency_ms > self.latency_threshold_ms) or (
+            error_rate is not None and error_rate > self.error_rate_threshold
+        )
+
+    def feedback(self, group: str, unhealthy: bool) -> Tuple[float, str]:
+        """Apply one report to `group`; returns (new scale, action)."""
+        reply = self._feedback(
+            keys=[group_key(group)],
+            args=[
+                int(time.time() * 1000),
+                1 if unhealthy else 0,
+                self.decrease,
+                self.increase,
+                self.min_scale,
+                self.interval_ms,
+                self.idle_ms,
+            ],
+        )
+        scale, action = float(reply[0]), _ACTIONS[int(reply[1])]
+        if action == DECREASED:
+            self.decreases += 1
+        elif action == INCREASED:
+            self.increases += 1
+        if group in self._scales or len(self._scales) < self.max_groups:
+            self._scales[group] = scale
+        return scale, action
+
+    def refresh(self) -> None:
+        """Reload the scale of every group seen so far from Redis."""
+        groups = list(self._scales)
+        if not groups:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for group in groups:
+            pipe.hget(group_key(group), "scale")
+        for group, scale in zip(groups, pipe.execute()):
+            self._scales[group] = float(scale) if scale is not None else 1.0
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "scales": self.scales(),
+            "decreases": self.decreases,
+            "increases": self.increases,
+            "refreshErrors": self.refresh_errors,
+            "lastError": self.last_error,
+        }
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.refresh_seconds):
+            try:
+                self.refresh()
+                self.last_error = None
+            except redis.RedisError as e:  # keep the last known scales; retry next tick
+                self.refresh_errors += 1
+                self.last_error = str(e)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="adaptive-limits-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.refresh_seconds + 1)
+            self._thread = None
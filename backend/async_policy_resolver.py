@@ -0,0 +1,99 @@
+# backend/async_policy_resolver.py
+import asyncio
+from typing import List, Optional
+
+import asyncpg
+
+from models import RateLimitRequest
+from policy_resolver import (
+    POLICIES_SQL,
+    RESOLVE_SQL,
+    RATE,
+    BasePolicyResolver,
+    EffectiveLimit,
+)
+import request_timing
+from ttl_cache import TTLCache
+
+
+class AsyncPolicyResolver(BasePolicyResolver):
+    """
+    asyncio PolicyResolver backed by an asyncpg connection pool.
+
+    Runs the same statements as PolicyResolver; asyncpg prepares and caches
+    them per connection automatically. The pool is created lazily on first
+    use so the resolver can be constructed outside a running event loop.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        identity_cache: Optional[TTLCache] = None,
+        min_size: int = 1,
+        max_size: int = 10,
+        command_timeout: float = 5.0,
+    ):
+        super().__init__(identity_cache)
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.command_timeout = command_timeout
+        self._pool: Optional[asyncpg.Pool] = None
+        self._pool_lock = asyncio.Lock()
+
+    async def _get_pool(self) -> asyncpg.Pool:
+        if self._pool is None:
+            async with self._pool_lock:
+                if self._pool is None:
+                    self._pool = await asyncpg.create_pool(
+                        self.dsn,
+                        min_size=self.min_size,
+                        max_size=self.max_size,
+                        command_timeout=self.command_timeout,
+                    )
+        return self._pool
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def _get_applicable_policies(
+        self,
+        tenant_id: Optional[int],
+        user_id: Optional[int],
+        api_key_id: Optional[int],
+        model_id: Optional[int],
+        model_tier_id: Optional[int],
+    ) -> List[dict]:
+        pool = await self._get_pool()
+        rows = await pool.fetch(
+            POLICIES_SQL, tenant_id, user_id, api_key_id, model_id, model_tier_id
+        )
+        return [dict(r) for r in rows]
+
+    async def _resolve_in_one_round_trip(self, body: RateLimitRequest) -> List[dict]:
+        pool = await self._get_pool()
+        rows = [dict(r) for r in await pool.fetch(RESOLVE_SQL, *self._resolve_params(body))]
+
+        # The statement always returns at least one row carrying the resolved ids
+        self._remember_identities(body, rows[0])
+
+        # LEFT JOIN: a row without a policy id means no policy matched
+        return [r for r in rows if r["id"] is not None]
+
+    async def resolve(self, body: RateLimitRequest, limit_type: str = RATE) -> List[EffectiveLimit]:
+        """Async counterpart of PolicyResolver.resolve."""
+        ids = self._cached_identities(body)
+        if ids is not None:
+            policies = self._indexed_policies(ids)
+            if policies is None:
+                policies = await self._get_applicable_policies(**ids)
+                request_timing.note("resolve-source", "policy-query")
+            else:
+                request_timing.note("resolve-source", "index")
+        else:
+            policies = await self._resolve_in_one_round_trip(body)
+            request_timing.note("resolve-source", "round-trip")
+
+        return self._to_effective_limits(policies, limit_type)
@@ -0,0 +1,237 @@
+# backend/async_rate_limiter.py
+import asyncio
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence, Tuple
+
+import redis
+import redis.asyncio
+
+from rate_limiter import (
+    _ADJUST_LUA,
+    _MULTI_CHECK_LUA,
+    _UNDO_LUA,
+    SLIDING_COUNTER,
+    Decision,
+    _adjust_args,
+    _decisions_from_reply,
+    _merge_slot_replies,
+    _multi_check_args,
+    _new_member,
+    _peek_decisions,
+    _plan_slot_calls,
+    _queue_peek,
+    _reset_from_entries,
+    _slot_call_args,
+    _undo_args,
+    pick_shard,
+    shard_keys,
+)
+
+if TYPE_CHECKING:
+    from policy_resolver import EffectiveLimit
+
+
+class AsyncSlidingWindowRateLimiterTx:
+    """
+    asyncio counterpart of SlidingWindowRateLimiterTx, using redis.asyncio.
+
+    Same contract and Redis data layout as the sync engine, so sync and
+    async workers can share keys.
+    """
+
+    def __init__(self, redis_client: redis.asyncio.Redis, cluster: bool = False):
+        self.redis = redis_client
+        self.cluster = cluster
+        self._multi_check = self.redis.register_script(_MULTI_CHECK_LUA)
+        self._adjust = None  # registered on first use (see adjust)
+        if cluster:
+            self._undo = self.redis.register_script(_UNDO_LUA)
+
+        # Single event loop, so plain counters suffice
+        self.watch_retries = 0
+        self.contention_fallbacks = 0
+        self.retry_observer: Optional[Callable[[int], None]] = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "watchRetries": self.watch_retries,
+            "contentionFallbacks": self.contention_fallbacks,
+        }
+
+    async def check_and_consume(
+        self,
+        key: str,
+        window_seconds: int,
+        limit: int,
+        max_retries: int = 5,
+    ) -> Tuple[bool, int]:
+        """
+        Returns (allowed, current_count_after_operation).
+
+        If high contention prevents a commit after `max_retries`,
+        returns (False, -1) as a conservative fallback.
+        """
+        allowed, count, _ = await self.check_and_consume_detailed(
+            key, window_seconds, limit, max_retries
+        )
+        return allowed, count
+
+    async def check_and_consume_detailed(
+        self,
+        key: str,
+        window_seconds: int,
+        limit: int,
+        max_retries: int = 5,
+    ) -> Decision:
+        """check_and_consume, also returning the reset time (see the sync engine)."""
+        window_ms = window_seconds * 1000
+
+        for attempt in range(max_retries):
+            now_ms = int(time.time() * 1000)
+            window_start_ms = now_ms - window_ms
+            ttl_seconds = window_seconds * 2
+
+            async with self.redis.pipeline(transaction=True) as pipe:
+                try:
+                    await pipe.watch(key)
+
+                    await pipe.zremrangebyscore(key, 0, window_start_ms)
+                    current = int(await pipe.zcard(key))
+
+                    if current >= limit:
+                        rank = current - limit
+                        blocking = await pipe.zrange(key, rank, rank, withscores=True)
+                        await pipe.unwatch()
+                        self._observe_retries(attempt)
+                        return Decision(False, current, _reset_from_entries(blocking, window_ms))
+
+                    pipe.multi()
+                    pipe.zadd(key, {_new_member(): now_ms})
+                    pipe.expire(key, ttl_seconds)
+                    pipe.zrange(key, 0, 0, withscores=True)
+                    results = await pipe.execute()
+
+                    self._observe_retries(attempt)
+                    return Decision(True, current + 1, _reset_from_entries(results[-1], window_ms))
+
+                except redis.WatchError:
+                    self.watch_retries += 1
+                    continue
+
+        self.contention_fallbacks += 1
+        self._observe_retries(max_retries)
+        return Decision(False, -1)
+
+    def _observe_retries(self, retries: int) -> None:
+        if self.retry_observer is not None:
+            self.retry_observer(retries)
+
+    async def check_and_consume_sharded(
+        self,
+        key: str,
+        window_seconds: int,
+        limit: int,
+        shards: int,
+    ) -> Decision:
+        """Sliding log striped over `shards` sub-keys (see the sync engine)."""
+        keys = shard_keys(key, shards)
+        window_ms = window_seconds * 1000
+        now_ms = int(time.time() * 1000)
+        window_start_ms = now_ms - window_ms
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for k in keys:
+                pipe.zremrangebyscore(k, 0, window_start_ms)
+                pipe.zcard(k)
+                pipe.zrange(k, 0, 0, withscores=True)
+            results = await pipe.execute()
+        current = sum(int(c) for c in results[1::3])
+        oldest = [entry for entries in results[2::3] for entry in entries]
+        reset_ms = _reset_from_entries(sorted(oldest, key=lambda e: e[1])[:1], window_ms)
+
+        if current >= limit:
+            return Decision(False, current, reset_ms)
+
+        target = keys[pick_shard(len(keys))]
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(target, {_new_member(): now_ms})
+            pipe.expire(target, window_seconds * 2)
+            await pipe.execute()
+        return Decision(True, current + 1, reset_ms or now_ms + window_ms)
+
+    async def check_and_consume_each(self, limits: Sequence["EffectiveLimit"]) -> List[Decision]:
+        """
+        Run one WATCH transaction per policy, concurrently.
+
+        Each key is an independent transaction, so running them at the same
+        time gives the same result as running them one after another.
+        SLIDING_COUNTER and COST policies are a single script call each;
+        sharded sliding logs go through check_and_consume_sharded.
+        """
+
+        async def check(lim: "EffectiveLimit") -> Decision:
+            if lim.algorithm == SLIDING_COUNTER or lim.limit_unit == "COST":
+                return (await self.check_and_consume_many([lim]))[0]
+            if lim.shards > 1:
+                return await self.check_and_consume_sharded(
+                    lim.key, lim.window_seconds, lim.limit, lim.shards
+                )
+            return await self.check_and_consume_detailed(lim.key, lim.window_seconds, lim.limit)
+
+        return list(await asyncio.gather(*(check(lim) for lim in limits)))
+
+    async def peek(self, limits: Sequence["EffectiveLimit"]) -> List[Decision]:
+        """Current usage of each policy without consuming (see the sync engine)."""
+        if not limits:
+            return []
+        now_ms = int(time.time() * 1000)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            _queue_peek(pipe, limits, now_ms)
+            results = await pipe.execute()
+        return _peek_decisions(limits, results, now_ms)
+
+    async def check_and_consume_many(self, limits: Sequence["EffectiveLimit"]) -> List[Decision]:
+        """All keys of one request in a single atomic script call (see the sync engine)."""
+        if not limits:
+            return []
+        return (await self.check_and_consume_batch([limits]))[0]
+
+    async def check_and_consume_batch(
+        self, groups: Sequence[Sequence["EffectiveLimit"]]
+    ) -> List[List[Decision]]:
+        """Several requests in one script call, or one call per slot on a cluster (see the sync engine)."""
+        if not any(groups):
+            return [[] for _ in groups]
+
+        now_ms = int(time.time() * 1000)
+        if not self.cluster:
+            keys, args = _multi_check_args(groups, now_ms)
+            reply = await self._multi_check(keys=keys, args=args)
+            return _decisions_from_reply(groups, reply)
+
+        members = [_new_member() for _ in groups]
+        calls, scales = _plan_slot_calls(groups)
+
+        async def run(call):
+            keys, args = _slot_call_args(call, members, now_ms)
+            return await self._multi_check(keys=keys, args=args)
+
+        replies = await asyncio.gather(*(run(call) for call in calls))
+        decisions, undo = _merge_slot_replies(groups, calls, replies, scales)
+        for call, subs in undo:
+            keys, args = _undo_args(call, subs, members, now_ms)
+            await self._undo(keys=keys, args=args)
+        return decisions
+
+    async def adjust(
+        self, limits: Sequence["EffectiveLimit"], delta: int, charged_at_ms: Optional[int] = None
+    ) -> None:
+        """Add `delta` units to COST policies after the fact (see the sync engine)."""
+        if not limits or not delta:
+            return
+        if self._adjust is None:
+            self._adjust = self.redis.register_script(_ADJUST_LUA)
+        now_ms = int(time.time() * 1000)
+        for part in [limits] if not self.cluster else [[lim] for lim in limits]:
+            keys, args = _adjust_args(part, delta, now_ms, charged_at_ms)
+            await self._adjust(keys=keys, args=args)
@@ -0,0 +1,183 @@
+# backend/audit_log.py
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+import msgpack
+
+# File layout: a stream of msgpack objects. The first is a header map
+# ({"format", "sampleRate", "denySampleRate"}), each following one a
+# decision record:
+#
+#   [ts_ms, endpoint, allowed, cause, [[key, count, limit, allowed], ...]]
+#
+# one entry per evaluated policy. Files are named decisions-<epoch ms>.msgpack,
+# so they sort in write order.
+FORMAT = "rl-audit/1"
+
+
+class DecisionAuditLog:
+    """
+    Record of allow/deny decisions, written off the request path.
+
+    record() samples the decision (`sample_rate` for allowed ones,
+    `deny_sample_rate` for denied ones), then appends a reference to it to a
+    queue of at most `queue_size` entries; when the queue is full the
+    decision is dropped and counted. A daemon thread drains the queue every
+    `flush_seconds` (or as soon as `batch_size` entries are waiting), encodes
+    them and appends them to the current file, which is rotated at
+    `max_file_bytes`; only the newest `max_files` files are kept.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        sample_rate: float = 1.0,
+        deny_sample_rate: float = 1.0,
+        queue_size: int = 100_000,
+        batch_size: int = 1000,
+        flush_seconds: float = 1.0,
+        max_file_bytes: int = 64 * 1024 * 1024,
+        max_files: int = 24,
+        random_fn: Callable[[], float] = random.random,
+    ):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.deny_sample_rate = deny_sample_rate
+        self.queue_size = queue_size
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max(1, max_files)
+        self._random = random_fn
+        self._lock = threading.Lock()
+        self._pending: List[tuple] = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._file_bytes = 0
+        self._stamp = 0
+        self._packer = msgpack.Packer(use_bin_type=True)
+        self.records = 0
+        self.dropped = 0
+        self.files = 0
+        self.write_errors = 0
+        self.last_error: Optional[str] = None
+
+    def record(self, endpoint: str, evaluated, result) -> None:
+        """Queue one decision: the evaluated policies and the response built from them."""
+        rate = self.sample_rate if result.allowed else self.deny_sample_rate
+        if rate < 1.0 and self._random() >= rate:
+            return
+        entry = (int(time.time() * 1000), endpoint, evaluated, result)
+        with self._lock:
+            if len(self._pending) >= self.queue_size:
+                self.dropped += 1
+                return
+            self._pending.append(entry)
+            if len(self._pending) == self.batch_size:
+                self._wake.set()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "records": self.records,
+            "dropped": self.dropped,
+            "queued": len(self._pending),
+            "files": self.files,
+            "writeErrors": self.write_errors,
+            "lastError": self.last_error,
+        }
+
+    def flush(self) -> None:
+        """Write everything queued so far (called by the worker; also usable directly)."""
+        with self._lock:
+            batch, self._pending = self._pending, []
+            self._wake.clear()
+        if not batch:
+            return
+        data = b"".join(self._packer.pack(self._encode(entry)) for entry in batch)
+        try:
+            if self._file is None or self._file_bytes >= self.max_file_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._file.flush()
+            self._file_bytes += len(data)
+            self.records += len(batch)
+        except OSError as e:  # drop the batch, keep serving; retried with the next one
+            self.write_errors += 1
+            self.last_error = str(e)
+            self._close_file()
+
+    @staticmethod
+    def _encode(entry: tuple) -> list:
+        ts_ms, endpoint, evaluated, result = entry
+        return [
+            ts_ms,
+            endpoint,
+            result.allowed,
+            result.cause,
+            [[e["policy"].key, e["count"], e["policy"].limit, e["allowed"]] for e in evaluated],
+        ]
+
+    def _rotate(self) -> None:
+        self._close_file()
+        os.makedirs(self.directory, exist_ok=True)
+        # Unique even when rotating twice within a millisecond
+        self._stamp = max(int(time.time() * 1000), self._stamp + 1)
+        self._file = open(os.path.join(self.directory, f"decisions-{self._stamp}.msgpack"), "ab")
+        header = {"format": FORMAT, "sampleRate": self.sample_rate, "denySampleRate": self.deny_sample_rate}
+        self._file_bytes = self._file.write(self._packer.pack(header))
+        self.files += 1
+        for old in audit_files(self.directory)[: -self.max_files]:
+            os.remove(old)
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_seconds)
+            self.flush()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="decision-audit-log", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the worker, write what is still queued and close the file."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_seconds + 5)
+            self._thread = None
+        self.flush()
+        self._close_file()
+
+
+def audit_files(directory: str) -> List[str]:
+    """Audit files in `directory`, oldest first."""
+    names = sorted(
+        (n for n in os.listdir(directory) if n.startswith("decisions-") and n.endswith(".msgpack")),
+        key=lambda n: int(n[len("decisions-"):-len(".msgpack")]),
+    )
+    return [os.path.join(directory, n) for n in names]
+
+
+def read_audit_file(path: str) -> Iterator[list]:
+    """Decision records of one audit file (the header is checked and skipped)."""
+    with open(path, "rb") as f:
+        unpacker = msgpack.Unpacker(f, raw=False)
+        header = next(unpacker, None)
+        if not isinstance(header, dict) or header.get("format") != FORMAT:
+            raise ValueError(f"{path} is not a decision audit file")
+        yield from unpacker
@@ -0,0 +1,490 @@
+# backend/benchmarks/bench_check.py
+"""
+Load / contention benchmark for the rate-limit check path.
+
+Targets:
+  engine  drive the limiter engines directly (no HTTP, no Postgres)
+  app     the FastAPI app in-process via TestClient; the policy resolver is
+          replaced by the synthetic workload, so Postgres is not needed
+  http    POST to a running /rate-limit/check (real Redis + Postgres)
+
+Redis (engine/app targets):
+  --redis-url URL   an existing Redis
+  --spawn-redis     a throwaway redis-server on a free port (needs redis-server on PATH)
+  --fake-redis      in-process fakeredis (pip install "fakeredis[lua]"); functional
+                    comparisons only, its timings say nothing about a real server
+
+Examples (from backend/):
+  python benchmarks/bench_check.py --spawn-redis --engine tx --concurrency 32 --keys 1 --output tx.json
+  python benchmarks/bench_check.py --spawn-redis --engine script --concurrency 32 --keys 1 \\
+      --output script.json --compare tx.json
+  python benchmarks/bench_check.py --engine memory --concurrency 8 --keys 1000
+"""
+import argparse
+import asyncio
+import bisect
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis  # noqa: E402
+import redis.asyncio  # noqa: E402
+
+from async_rate_limiter import AsyncSlidingWindowRateLimiterTx  # noqa: E402
+from memory_rate_limiter import InMemoryRateLimiter  # noqa: E402
+from policy_resolver import EffectiveLimit  # noqa: E402
+from rate_limiter import (  # noqa: E402
+    SLIDING_COUNTER,
+    SLIDING_LOG,
+    Decision,
+    SlidingWindowCounterRateLimiter,
+    SlidingWindowRateLimiterTx,
+)
+
+# Outcome of one check: "allowed", "denied" or "fallback" (a (False, -1) contention give-up)
+ALLOWED, DENIED, FALLBACK = "allowed", "denied", "fallback"
+
+
+@dataclass
+class Workload:
+    """Synthetic traffic: which policy keys each request touches."""
+
+    prefix: str
+    keys: int = 1000  # distinct per-user keys
+    skew: float = 1.0  # Zipf exponent over those keys; 0 = uniform
+    fanout: int = 3  # policies per request: one per-user key + (fanout - 1) shared keys
+    window_seconds: int = 60
+    limit: int = 1_000_000_000
+    algorithm: str = SLIDING_LOG
+    shards: int = 1
+
+    def __post_init__(self):
+        weights = [1.0 / (i + 1) ** self.skew for i in range(max(1, self.keys))]
+        total = 0.0
+        self._cumulative = []
+        for w in weights:
+            total += w
+            self._cumulative.append(total)
+
+    def pick_user(self, rng: random.Random) -> int:
+        return bisect.bisect_left(self._cumulative, rng.random() * self._cumulative[-1])
+
+    def policies(self, rng: random.Random) -> List[EffectiveLimit]:
+        return self.policies_for(self.pick_user(rng))
+
+    def policies_for(self, user: int) -> List[EffectiveLimit]:
+        limits = [self._limit(f"{self.prefix}:user:{user}", "USER_MODEL")]
+        for j in range(1, self.fanout):
+            # Every request hits the shared keys (think rl:global, rl:tenant:<id>)
+            limits.append(self._limit(f"{self.prefix}:shared:{j}", "GLOBAL", shards=self.shards))
+        return limits
+
+    def _limit(self, key: str, scope: str, shards: int = 1) -> EffectiveLimit:
+        if self.algorithm == SLIDING_COUNTER:
+            key += ":swc"
+        return EffectiveLimit(
+            key=key, window_seconds=self.window_seconds, limit=self.limit, label=scope,
+            scope=scope, algorithm=self.algorithm, shards=shards,
+        )
+
+
+def outcome(decisions: Sequence[Decision]) -> str:
+    if any(d.count == -1 for d in decisions):
+        return FALLBACK
+    return ALLOWED if all(d.allowed for d in decisions) else DENIED
+
+
+# --- sync engine operations (mirror main._evaluate_in_redis) ---
+
+def tx_check(limiter: SlidingWindowRateLimiterTx, counter: SlidingWindowCounterRateLimiter,
+             limits: Sequence[EffectiveLimit]) -> str:
+    decisions = []
+    for lim in limits:
+        if lim.algorithm == SLIDING_COUNTER:
+            decisions.append(counter.check_and_consume_detailed(
+                lim.key, lim.window_seconds, lim.limit, buckets=lim.buckets, shards=lim.shards))
+        elif lim.shards > 1:
+            decisions.append(limiter.check_and_consume_sharded(
+                lim.key, lim.window_seconds, lim.limit, lim.shards))
+        else:
+            decisions.append(limiter.check_and_consume_detailed(lim.key, lim.window_seconds, lim.limit))
+    return outcome(decisions)
+
+
+def script_check(limiter: SlidingWindowRateLimiterTx, limits: Sequence[EffectiveLimit]) -> str:
+    return outcome(limiter.check_and_consume_many(limits))
+
+
+# --- drivers ---
+
+def run_threads(
+    concurrency: int, requests: int, make_op: Callable[[random.Random], Callable[[], str]], seed: int
+) -> Tuple[List[int], Dict[str, int], float]:
+    """Run `requests` operations over `concurrency` threads; returns latencies (ns), outcomes, wall time."""
+    per_worker = [requests // concurrency + (1 if i < requests % concurrency else 0)
+                  for i in range(concurrency)]
+    latencies: List[List[int]] = [[] for _ in range(concurrency)]
+    outcomes: List[Dict[str, int]] = [{ALLOWED: 0, DENIED: 0, FALLBACK: 0} for _ in range(concurrency)]
+    start_gate = threading.Barrier(concurrency + 1)
+
+    def worker(i: int) -> None:
+        op = make_op(random.Random(seed + i))
+        lat, out = latencies[i], outcomes[i]
+        start_gate.wait()
+        for _ in range(per_worker[i]):
+            t0 = time.perf_counter_ns()
+            result = op()
+            lat.append(time.perf_counter_ns() - t0)
+            out[result] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    start_gate.wait()
+    t0 = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    return [x for lat in latencies for x in lat], _merge(outcomes), elapsed
+
+
+def run_async(
+    concurrency: int, requests: int, make_op: Callable[[random.Random], Callable], seed: int
+) -> Tuple[List[int], Dict[str, int], float]:
+    """Same as run_threads with `concurrency` asyncio tasks on one event loop."""
+    latencies: List[int] = []
+    outcomes = {ALLOWED: 0, DENIED: 0, FALLBACK: 0}
+
+    async def main() -> float:
+        remaining = [requests]
+
+        async def worker(i: int) -> None:
+            op = make_op(random.Random(seed + i))
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                t0 = time.perf_counter_ns()
+                result = await op()
+                latencies.append(time.perf_counter_ns() - t0)
+                outcomes[result] += 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        return time.perf_counter() - t0
+
+    elapsed = asyncio.run(main())
+    return latencies, outcomes, elapsed
+
+
+def _merge(outcomes: Sequence[Dict[str, int]]) -> Dict[str, int]:
+    merged = {ALLOWED: 0, DENIED: 0, FALLBACK: 0}
+    for out in outcomes:
+        for k, v in out.items():
+            merged[k] += v
+    return merged
+
+
+def percentile(sorted_values: Sequence[int], pct: float) -> int:
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies_ns: List[int], outcomes: Dict[str, int], elapsed: float,
+              engine_stats: Optional[Dict[str, int]] = None) -> Dict[str, float]:
+    latencies_ns = sorted(latencies_ns)
+    total = len(latencies_ns)
+    ms = 1e-6
+    summary = {
+        "requests": total,
+        "elapsedSeconds": round(elapsed, 4),
+        "opsPerSec": round(total / elapsed, 1) if elapsed else 0.0,
+        "latencyMs": {
+            "mean": round(sum(latencies_ns) / total * ms, 4) if total else 0.0,
+            "p50": round(percentile(latencies_ns, 50) * ms, 4),
+            "p99": round(percentile(latencies_ns, 99) * ms, 4),
+            "p999": round(percentile(latencies_ns, 99.9) * ms, 4),
+            "max": round(latencies_ns[-1] * ms, 4) if total else 0.0,
+        },
+        "allowed": outcomes[ALLOWED],
+        "denied": outcomes[DENIED],
+        "fallbacks": outcomes[FALLBACK],
+        "fallbackRate": round(outcomes[FALLBACK] / total, 6) if total else 0.0,
+    }
+    if engine_stats is not None:
+        summary["watchRetries"] = engine_stats["watchRetries"]
+        summary["watchRetriesPerRequest"] = round(engine_stats["watchRetries"] / total, 4) if total else 0.0
+    return summary
+
+
+# --- Redis setup ---
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def spawned_redis() -> Iterator[str]:
+    """Start a throwaway, non-persistent redis-server; yields its URL."""
+    exe = shutil.which("redis-server")
+    if exe is None:
+        raise SystemExit("redis-server not found on PATH (use --redis-url or --fake-redis)")
+    port = _free_port()
+    proc = subprocess.Popen(
+        [exe, "--port", str(port), "--save", "", "--appendonly", "no"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"redis://127.0.0.1:{port}/0"
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                redis.Redis.from_url(url).ping()
+                break
+            except redis.ConnectionError:
+                if time.monotonic() > deadline or proc.poll() is not None:
+                    raise SystemExit("redis-server did not start")
+                time.sleep(0.05)
+        yield url
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def _fake_redis_clients():
+    try:
+        import fakeredis
+    except ImportError:
+        raise SystemExit('--fake-redis needs fakeredis: pip install "fakeredis[lua]"')
+    server = fakeredis.FakeServer()
+    return fakeredis.FakeRedis(server=server), fakeredis.FakeAsyncRedis(server=server)
+
+
+# --- targets ---
+
+def bench_engine(args, workload: Workload, sync_client, async_client) -> Dict:
+    if args.engine == "memory":
+        # In-process engine: Redis is not touched, --async has nothing to overlap
+        memory = InMemoryRateLimiter()
+
+        def make_op(rng):
+            return lambda: outcome(memory.check_and_consume_many(workload.policies(rng)))
+
+        latencies, outcomes, elapsed = run_threads(args.concurrency, args.requests, make_op, args.seed)
+        return summarize(latencies, outcomes, elapsed, memory.stats())
+
+    if args.use_async:
+        limiter = AsyncSlidingWindowRateLimiterTx(async_client)
+
+        def make_op(rng):
+            async def op():
+                limits = workload.policies(rng)
+                if args.engine == "script":
+                    decisions = await limiter.check_and_consume_many(limits)
+                else:
+                    decisions = await limiter.check_and_consume_each(limits)
+                return outcome(decisions)
+            return op
+
+        latencies, outcomes, elapsed = run_async(args.concurrency, args.requests, make_op, args.seed)
+        return summarize(latencies, outcomes, elapsed, limiter.stats())
+
+    limiter = SlidingWindowRateLimiterTx(sync_client)
+    counter = SlidingWindowCounterRateLimiter(sync_client)
+
+    def make_op(rng):
+        if args.engine == "script":
+            return lambda: script_check(limiter, workload.policies(rng))
+        return lambda: tx_check(limiter, counter, workload.policies(rng))
+
+    latencies, outcomes, elapsed = run_threads(args.concurrency, args.requests, make_op, args.seed)
+    return summarize(latencies, outcomes, elapsed, limiter.stats())
+
+
+def bench_app(args, workload: Workload, sync_client) -> Dict:
+    """The whole /rate-limit/check handler in-process, with synthetic policies instead of Postgres."""
+    os.environ["RL_ENGINE"] = args.engine
+    os.environ.setdefault("RL_PG_POOL_MIN", "0")  # no Postgres connection at import
+    from unittest.mock import patch
+
+    from fastapi.testclient import TestClient
+
+    import main
+
+    limiter = SlidingWindowRateLimiterTx(sync_client)
+
+    def resolve(body):
+        # Runs in FastAPI's threadpool; the user index travels in the request
+        return workload.policies_for(int(body.userId.rsplit("-", 1)[1]))
+
+    with patch.object(main, "rate_limiter", limiter), \
+         patch.object(main, "counter_rate_limiter", SlidingWindowCounterRateLimiter(sync_client)), \
+         patch.object(main, "lease_manager", None), \
+         patch.object(main.policy_resolver, "resolve", side_effect=resolve):
+
+        def make_op(rng):
+            client = TestClient(main.app)
+
+            def op():
+                body = {"userId": f"bench-user-{workload.pick_user(rng)}", "modelId": "bench-model"}
+                response = client.post("/rate-limit/check", json=body)
+                return ALLOWED if response.json()["allowed"] else DENIED
+            return op
+
+        latencies, outcomes, elapsed = run_threads(args.concurrency, args.requests, make_op, args.seed)
+    # /rate-limit/check does not surface (False, -1) separately; the engine counters do
+    stats = limiter.stats()
+    outcomes[FALLBACK] = stats["contentionFallbacks"]
+    return summarize(latencies, outcomes, elapsed, stats)
+
+
+def bench_http(args, workload: Workload) -> Dict:
+    """A running server (real Redis + Postgres); userIds follow the workload's key skew."""
+    parts = urlsplit(args.url)
+
+    def make_op(rng):
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        headers = {"Content-Type": "application/json"}
+
+        def op():
+            body = {"userId": f"{args.user_prefix}{workload.pick_user(rng)}", "modelId": args.model_id}
+            if args.tenant_id:
+                body["tenantId"] = args.tenant_id
+            conn.request("POST", "/rate-limit/check", json.dumps(body), headers)
+            response = conn.getresponse()
+            payload = json.loads(response.read())
+            return ALLOWED if payload.get("allowed") else DENIED
+        return op
+
+    latencies, outcomes, elapsed = run_threads(args.concurrency, args.requests, make_op, args.seed)
+    return summarize(latencies, outcomes, elapsed)
+
+
+# --- reporting ---
+
+def compare(current: Dict, baseline: Dict) -> List[str]:
+    """Human-readable deltas of the headline metrics against a saved run."""
+    rows = [("opsPerSec", current["opsPerSec"], baseline["opsPerSec"])]
+    for p in ("p50", "p99", "p999"):
+        rows.append((f"{p} ms", current["latencyMs"][p], baseline["latencyMs"][p]))
+    rows.append(("fallbackRate", current["fallbackRate"], baseline["fallbackRate"]))
+    if "watchRetriesPerRequest" in current and "watchRetriesPerRequest" in baseline:
+        rows.append(("retries/req", current["watchRetriesPerRequest"], baseline["watchRetriesPerRequest"]))
+
+    lines = [f"{'metric':<14}{'baseline':>14}{'current':>14}{'delta':>10}"]
+    for name, now, before in rows:
+        delta = f"{(now - before) / before * 100:+.1f}%" if before else "n/a"
+        lines.append(f"{name:<14}{before:>14}{now:>14}{delta:>10}")
+    return lines
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--target", choices=("engine", "app", "http"), default="engine")
+    p.add_argument("--engine", choices=("tx", "script", "memory"), default="tx")
+    p.add_argument("--async", dest="use_async", action="store_true",
+                   help="engine target: use the redis.asyncio engine with asyncio tasks")
+    p.add_argument("--algorithm", choices=(SLIDING_LOG, SLIDING_COUNTER), default=SLIDING_LOG)
+    p.add_argument("--concurrency", type=int, default=16, help="threads (or asyncio tasks with --async)")
+    p.add_argument("--requests", type=int, default=20_000)
+    p.add_argument("--warmup", type=int, default=1_000, help="requests run before measuring")
+    p.add_argument("--keys", type=int, default=1_000, help="distinct per-user keys (1 = everyone on one key)")
+    p.add_argument("--skew", type=float, default=1.0, help="Zipf exponent over the keys (0 = uniform)")
+    p.add_argument("--fanout", type=int, default=3, help="policies per request (1 per-user + shared keys)")
+    p.add_argument("--shards", type=int, default=1, help="shards for the shared keys")
+    p.add_argument("--window", type=int, default=60, help="window seconds")
+    p.add_argument("--limit", type=int, default=1_000_000_000,
+                   help="per-policy limit (default: never rejects, measuring pure overhead)")
+    p.add_argument("--seed", type=int, default=1)
+
+    redis_opts = p.add_mutually_exclusive_group()
+    redis_opts.add_argument("--redis-url", default="redis://localhost:6379/15")
+    redis_opts.add_argument("--spawn-redis", action="store_true")
+    redis_opts.add_argument("--fake-redis", action="store_true")
+
+    p.add_argument("--url", default="http://localhost:8000", help="http target: server base URL")
+    p.add_argument("--user-prefix", default="bench-user-", help="http target: userId prefix")
+    p.add_argument("--model-id", default="gpt-4o", help="http target: modelId")
+    p.add_argument("--tenant-id", default=None, help="http target: tenantId")
+
+    p.add_argument("--output", help="write results as JSON to this file")
+    p.add_argument("--compare", help="print deltas against a JSON file from a previous run")
+    return p.parse_args(argv)
+
+
+@contextmanager
+def redis_clients(args) -> Iterator[Tuple[object, object]]:
+    if args.fake_redis:
+        yield _fake_redis_clients()
+        return
+    if args.spawn_redis:
+        with spawned_redis() as url:
+            yield redis.Redis.from_url(url), redis.asyncio.Redis.from_url(url)
+        return
+    yield redis.Redis.from_url(args.redis_url), redis.asyncio.Redis.from_url(args.redis_url)
+
+
+def run(args: argparse.Namespace) -> Dict:
+    workload = Workload(
+        prefix=f"rl:bench:{uuid.uuid4().hex[:8]}", keys=args.keys, skew=args.skew,
+        fanout=args.fanout, window_seconds=args.window, limit=args.limit,
+        algorithm=args.algorithm, shards=args.shards,
+    )
+
+    if args.target == "http":
+        if args.warmup:
+            bench_http(argparse.Namespace(**{**vars(args), "requests": args.warmup}), workload)
+        results = bench_http(args, workload)
+    else:
+        with redis_clients(args) as (sync_client, async_client):
+            bench = (
+                (lambda a: bench_app(a, workload, sync_client)) if args.target == "app"
+                else (lambda a: bench_engine(a, workload, sync_client, async_client))
+            )
+            if args.warmup:
+                bench(argparse.Namespace(**{**vars(args), "requests": args.warmup}))
+            results = bench(args)
+
+    return {
+        "config": vars(args),
+        "results": results,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    args = parse_args(argv)
+    report = run(args)
+    print(json.dumps(report["results"], indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        print("\n".join(compare(report["results"], baseline)))
+
+
+if __name__ == "__main__":
+    main()
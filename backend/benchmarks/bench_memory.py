@@ -0,0 +1,116 @@
+# backend/benchmarks/bench_memory.py
+"""
+Redis memory per sliding-log entry, by ZSET member encoding.
+
+Fills one ZSET per (encoding, window size) with distinct members, the way
+the engines write them, and reads MEMORY USAGE (exact, SAMPLES 0):
+
+  tx-ms        decimal millisecond timestamp (the old WATCH path member;
+               requests in the same millisecond collapsed into one entry)
+  script-text  "<ms>:<node>:<seq>" (the old script member)
+  compact      10-byte nonce + sequence (rate_limiter._new_member)
+
+Small windows stay in Redis' listpack encoding, large ones (more than
+zset-max-listpack-entries, 128 by default) use a skiplist, where the member
+is a separate allocation; compare sizes on both sides of that threshold.
+
+Examples (from backend/):
+  python benchmarks/bench_memory.py --spawn-redis
+  python benchmarks/bench_memory.py --redis-url redis://localhost:6379/15 --entries 100 100000
+"""
+import argparse
+import json
+import os
+import sys
+import uuid
+from typing import Callable, Dict, List, Optional, Sequence
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import redis  # noqa: E402
+
+from benchmarks.bench_check import spawned_redis  # noqa: E402
+from rate_limiter import _new_member  # noqa: E402
+
+_BASE_MS = 1_700_000_000_000
+_NODE = uuid.uuid4().hex[:8]
+
+ENCODINGS: Dict[str, Callable[[int], object]] = {
+    "tx-ms": lambda i: str(_BASE_MS + i),
+    "script-text": lambda i: f"{_BASE_MS + i}:{_NODE}:{i}",
+    "compact": lambda i: _new_member(),
+}
+
+
+def fill(client, key: str, entries: int, member: Callable[[int], object], chunk: int = 10_000) -> None:
+    """ZADD `entries` distinct members, one millisecond apart, in pipelined chunks."""
+    for start in range(0, entries, chunk):
+        with client.pipeline(transaction=False) as pipe:
+            pipe.zadd(key, {member(i): _BASE_MS + i for i in range(start, min(start + chunk, entries))})
+            pipe.execute()
+
+
+def measure(client, prefix: str, entries: int, encoding: str) -> Dict:
+    key = f"{prefix}:{encoding}:{entries}"
+    fill(client, key, entries, ENCODINGS[encoding])
+    try:
+        used = int(client.memory_usage(key, samples=0))
+        object_encoding = client.object("encoding", key)
+    finally:
+        client.delete(key)
+    if isinstance(object_encoding, bytes):
+        object_encoding = object_encoding.decode()
+    return {
+        "encoding": encoding,
+        "entries": entries,
+        "objectEncoding": object_encoding,
+        "bytes": used,
+        "bytesPerEntry": round(used / entries, 1),
+    }
+
+
+def report(rows: Sequence[Dict]) -> List[str]:
+    lines = [f"{'entries':>10}  {'member':<12}{'redis enc':<11}{'bytes/entry':>12}{'vs tx-ms':>10}"]
+    baseline = {r["entries"]: r["bytesPerEntry"] for r in rows if r["encoding"] == "tx-ms"}
+    for r in rows:
+        before = baseline.get(r["entries"])
+        delta = f"{(r['bytesPerEntry'] - before) / before * 100:+.1f}%" if before else "n/a"
+        lines.append(
+            f"{r['entries']:>10}  {r['encoding']:<12}{r['objectEncoding']:<11}"
+            f"{r['bytesPerEntry']:>12}{delta:>10}"
+        )
+    return lines
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--entries", type=int, nargs="+", default=[100, 10_000, 1_000_000],
+                   help="entries per window (one ZSET each)")
+    p.add_argument("--encodings", nargs="+", choices=sorted(ENCODINGS), default=list(ENCODINGS))
+    redis_opts = p.add_mutually_exclusive_group()
+    redis_opts.add_argument("--redis-url", default="redis://localhost:6379/15")
+    redis_opts.add_argument("--spawn-redis", action="store_true")
+    p.add_argument("--output", help="write results as JSON to this file")
+    return p.parse_args(argv)
+
+
+def run(client, entries: Sequence[int], encodings: Sequence[str]) -> List[Dict]:
+    prefix = f"rl:bench:mem:{uuid.uuid4().hex[:8]}"
+    return [measure(client, prefix, n, enc) for n in entries for enc in encodings]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    args = parse_args(argv)
+    if args.spawn_redis:
+        with spawned_redis() as url:
+            rows = run(redis.Redis.from_url(url), args.entries, args.encodings)
+    else:
+        rows = run(redis.Redis.from_url(args.redis_url), args.entries, args.encodings)
+    print("\n".join(report(rows)))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# backend/check_profiler.py
+import cProfile
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+
+class _Profiled:
+    """A check in flight: its cProfile run, or the stacks sampled from its thread."""
+
+    __slots__ = ("thread_id", "started", "profile", "stacks", "duration")
+
+    def __init__(self, thread_id: int, started: float, profile: Optional[cProfile.Profile]):
+        self.thread_id = thread_id
+        self.started = started
+        self.profile = profile
+        self.stacks: Counter = Counter()
+        self.duration = 0.0
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class CheckProfiler:
+    """
+    Profiles individual checks, for offline analysis.
+
+    - Every `every_n`-th check runs under cProfile (one at a time; a check
+      due while another is profiled is skipped), written as
+      check-<epoch ms>-<duration ms>ms.prof (pstats, e.g. for snakeviz).
+    - Checks still running after `slow_ms` are stack-sampled from then on:
+      a daemon thread samples their threads every `interval` seconds, and
+      the samples are written as collapsed stacks ("outer;inner count"
+      lines, for flamegraph.pl or speedscope) to check-...ms.folded.
+
+    Files go to `directory`, written by the sampler thread; only the newest
+    `max_files` are kept. Both triggers at 0 disable it: begin() then
+    returns None without touching any shared state. With async handlers all
+    checks share the event loop thread, so profiles include whatever else
+    ran while the check was awaiting.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        slow_ms: float = 0,
+        every_n: int = 0,
+        interval: float = 0.002,
+        max_files: int = 100,
+    ):
+        self.directory = directory
+        self.interval = interval
+        self.max_files = max(1, max_files)
+        self.slow_ms = 0.0
+        self.every_n = 0
+        self._lock = threading.Lock()
+        self._active: Dict[int, _Profiled] = {}
+        self._finished: List[_Profiled] = []
+        self._counter = itertools.count(1)
+        self._profiling = False  # a cProfile run is in flight (only one profiler per process)
+        self._thread: Optional[threading.Thread] = None
+        self._stamp = 0
+        self.profiles = 0
+        self.write_errors = 0
+        self.configure(slow_ms, every_n)
+
+    @property
+    def enabled(self) -> bool:
+        return self.slow_ms > 0 or self.every_n > 0
+
+    def configure(self, slow_ms: float, every_n: int) -> None:
+        """Change the triggers at runtime; the sampler thread runs only while enabled."""
+        self.slow_ms = max(0.0, slow_ms)
+        self.every_n = max(0, every_n)
+        if self.enabled:
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="check-profiler", daemon=True)
+                    self._thread.start()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "slowMs": self.slow_ms,
+            "everyN": self.every_n,
+            "inFlight": len(self._active),
+            "profiles": self.profiles,
+            "writeErrors": self.write_errors,
+        }
+
+    def begin(self) -> Optional[_Profiled]:
+        """Register the calling thread's check; pass the result to end()."""
+        if not self.enabled:
+            return None
+        every_n = self.every_n
+        profile = None
+        with self._lock:
+            if every_n > 0 and next(self._counter) % every_n == 0 and not self._profiling:
+                self._profiling = True
+                profile = cProfile.Profile()
+            profiled = _Profiled(threading.get_ident(), time.perf_counter(), profile)
+            self._active[id(profiled)] = profiled
+        if profile is not None:
+            try:
+                profile.enable()
+            except ValueError:  # another profiler (e.g. a coverage tool) is active
+                profiled.profile = None
+                with self._lock:
+                    self._profiling = False
+        return profiled
+
+    def end(self, profiled: Optional[_Profiled]) -> None:
+        if profiled is None:
+            return
+        if profiled.profile is not None:
+            profiled.profile.disable()
+        profiled.duration = time.perf_counter() - profiled.started
+        with self._lock:
+            self._active.pop(id(profiled), None)
+            if profiled.profile is not None:
+                self._profiling = False
+            if profiled.profile is not None or profiled.stacks:
+                self._finished.append(profiled)
+
+    def sample(self) -> None:
+        """Take one stack sample of every check due for profiling (called by the sampler thread)."""
+        frames = sys._current_frames()
+        now = time.perf_counter()
+        slow = self.slow_ms / 1000
+        with self._lock:
+            for profiled in self._active.values():
+                if profiled.profile is None and slow and now - profiled.started >= slow:
+                    frame = frames.get(profiled.thread_id)
+                    if frame is not None:
+                        profiled.stacks[_collapse(frame)] += 1
+
+    def write_finished(self) -> None:
+        with self._lock:
+            finished, self._finished = self._finished, []
+        for profiled in finished:
+            try:
+                self._write(profiled)
+            except OSError:
+                self.write_errors += 1
+
+    def _write(self, profiled: _Profiled) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        # Unique and in write order even for several profiles within a millisecond
+        self._stamp = max(int(time.time() * 1000), self._stamp + 1)
+        path = os.path.join(self.directory, f"check-{self._stamp}-{profiled.duration * 1000:.0f}ms")
+        if profiled.profile is not None:
+            profiled.profile.dump_stats(path + ".prof")
+        else:
+            with open(path + ".folded", "w") as f:
+                for stack, count in profiled.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        self.profiles += 1
+        files = sorted(
+            (n for n in os.listdir(self.directory) if n.startswith("check-") and n.endswith((".prof", ".folded"))),
+            key=lambda n: int(n.split("-")[1]),
+        )
+        for old in files[: -self.max_files]:
+            os.remove(os.path.join(self.directory, old))
+
+    def _run(self) -> None:
+        me = threading.current_thread()
+        while self.enabled and self._thread is me:
+            time.sleep(self.interval)
+            self.sample()
+            self.write_finished()
+        self.write_finished()
+
+    def stop(self) -> None:
+        self.configure(0, 0)
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=1)
+        self.write_finished()
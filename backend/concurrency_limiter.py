@@ -0,0 +1,223 @@
+# backend/concurrency_limiter.py
+import base64
+import os
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+
+import redis
+import redis.asyncio
+from redis.crc import key_slot
+
+from rate_limiter import Decision
+
+if TYPE_CHECKING:
+    from policy_resolver import EffectiveLimit
+
+
+# Take one in-flight slot on every key, all-or-nothing. Each key is a ZSET of
+# leases: member = lease id, score = expiry (ms); expired leases are dropped
+# first, so slots held by crashed callers come back by themselves.
+# KEYS  = concurrency keys
+# ARGV  = now_ms, lease id, then (limit, lease_ms) per key
+# Reply = {admitted, in-flight count per key.., earliest lease expiry per key..}
+_ACQUIRE_LUA = """
+local now = tonumber(ARGV[1])
+local n = #KEYS
+local admitted = 1
+local reply = {0}
+for i = 1, n do
+  redis.call('ZREMRANGEBYSCORE', KEYS[i], '-inf', now)
+  reply[1 + i] = redis.call('ZCARD', KEYS[i])
+  if reply[1 + i] >= tonumber(ARGV[1 + 2 * i]) then
+    admitted = 0
+  end
+end
+
+if admitted == 1 then
+  for i = 1, n do
+    local lease_ms = tonumber(ARGV[2 + 2 * i])
+    redis.call('ZADD', KEYS[i], now + lease_ms, ARGV[2])
+    if redis.call('PTTL', KEYS[i]) < lease_ms then
+      redis.call('PEXPIRE', KEYS[i], lease_ms)
+    end
+    reply[1 + i] = reply[1 + i] + 1
+  end
+end
+reply[1] = admitted
+
+-- A slot frees up at the latest when the oldest lease expires
+for i = 1, n do
+  local first = redis.call('ZRANGE', KEYS[i], 0, 0, 'WITHSCORES')
+  reply[1 + n + i] = first[2] and math.floor(tonumber(first[2])) or 0
+end
+return reply
+"""
+
+# KEYS = concurrency keys of one lease; ARGV = lease id. Reply = slots freed.
+_RELEASE_LUA = """
+local freed = 0
+for i = 1, #KEYS do
+  freed = freed + redis.call('ZREM', KEYS[i], ARGV[1])
+end
+return freed
+"""
+
+# Concurrency keys end with this suffix (see BasePolicyResolver); release only
+# touches such keys, whatever a lease id claims.
+KEY_SUFFIX = ":conc"
+
+
+class InvalidLease(ValueError):
+    """A lease id that this service did not issue."""
+
+
+def encode_lease(lease: str, keys: Sequence[str]) -> str:
+    """Lease id handed to callers: a random id plus the keys it holds, so release needs no lookup."""
+    packed = base64.urlsafe_b64encode("\n".join(keys).encode()).decode().rstrip("=")
+    return f"{lease}.{packed}"
+
+
+def decode_lease(lease_id: str) -> Tuple[str, List[str]]:
+    lease, _, packed = lease_id.partition(".")
+    try:
+        keys = base64.urlsafe_b64decode(packed + "=" * (-len(packed) % 4)).decode().split("\n")
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidLease(lease_id)
+    if len(lease) != 32 or not all(k.endswith(KEY_SUFFIX) for k in keys):
+        raise InvalidLease(lease_id)
+    return lease, keys
+
+
+def _acquire_args(limits: Sequence["EffectiveLimit"], lease: str, now_ms: int) -> list:
+    args: list = [now_ms, lease]
+    for lim in limits:
+        args += [lim.limit, lim.window_seconds * 1000]
+    return args
+
+
+def _decisions(limits: Sequence["EffectiveLimit"], reply) -> List[Decision]:
+    """Decisions for an acquire reply; on rejection, policies that had a free slot stay allowed."""
+    n = len(limits)
+    admitted = bool(int(reply[0]))
+    return [
+        Decision(admitted or int(reply[1 + i]) < lim.limit, int(reply[1 + i]), int(reply[1 + n + i]))
+        for i, lim in enumerate(limits)
+    ]
+
+
+def _by_slot(items: Sequence, key) -> Dict[int, list]:
+    slots: Dict[int, list] = {}
+    for item in items:
+        slots.setdefault(key_slot(key(item).encode()), []).append(item)
+    return slots
+
+
+def _merge(limits, calls, replies) -> List[Decision]:
+    """
+    Per-slot decisions back in policy order. If some slot rejected, the
+    slots that admitted are released by the caller, so their counts drop
+    back by one.
+    """
+    rejected = not all(int(reply[0]) for reply in replies)
+    by_key = {}
+    for call, reply in zip(calls, replies):
+        decisions = _decisions(call, reply)
+        if rejected and int(reply[0]):
+            decisions = [d._replace(count=d.count - 1) for d in decisions]
+        by_key.update(zip((lim.key for lim in call), decisions))
+    return [by_key[lim.key] for lim in limits]
+
+
+class ConcurrencyLimiter:
+    """
+    In-flight limits for CONCURRENCY policies: acquire() takes a slot on
+    every policy of a request and returns a lease id, release() gives the
+    slots back. A policy's window_seconds is its lease timeout; leases not
+    released by then expire and free their slot.
+
+    One script call per acquire or release. With `cluster=True` keys in
+    different slots get one call each, and slots taken before a rejecting
+    slot are released again.
+    """
+
+    def __init__(self, redis_client: redis.Redis, cluster: bool = False):
+        self.redis = redis_client
+        self.cluster = cluster
+        self._acquire = self.redis.register_script(_ACQUIRE_LUA)
+        self._release = self.redis.register_script(_RELEASE_LUA)
+
+    def acquire(self, limits: Sequence["EffectiveLimit"]) -> Tuple[Optional[str], List[Decision]]:
+        """(lease id or None if rejected, one decision per policy)."""
+        if not limits:
+            return None, []
+        lease = os.urandom(16).hex()
+        now_ms = int(time.time() * 1000)
+        if not self.cluster:
+            reply = self._acquire(keys=[lim.key for lim in limits], args=_acquire_args(limits, lease, now_ms))
+            decisions = _decisions(limits, reply)
+        else:
+            calls = list(_by_slot(limits, lambda lim: lim.key).values())
+            replies = [
+                self._acquire(keys=[lim.key for lim in call], args=_acquire_args(call, lease, now_ms))
+                for call in calls
+            ]
+            decisions = _merge(limits, calls, replies)
+            if not all(d.allowed for d in decisions):
+                for call, reply in zip(calls, replies):
+                    if int(reply[0]):
+                        self._release(keys=[lim.key for lim in call], args=[lease])
+        if not all(d.allowed for d in decisions):
+            return None, decisions
+        return encode_lease(lease, [lim.key for lim in limits]), decisions
+
+    def release(self, lease_id: str) -> int:
+        """Free the lease's slots; returns how many were still held (0 if it had expired)."""
+        lease, keys = decode_lease(lease_id)
+        if not self.cluster:
+            return int(self._release(keys=keys, args=[lease]))
+        return sum(
+            int(self._release(keys=call, args=[lease]))
+            for call in _by_slot(keys, lambda k: k).values()
+        )
+
+
+class AsyncConcurrencyLimiter:
+    """asyncio counterpart of ConcurrencyLimiter (same scripts and key layout)."""
+
+    def __init__(self, redis_client: redis.asyncio.Redis, cluster: bool = False):
+        self.redis = redis_client
+        self.cluster = cluster
+        self._acquire = self.redis.register_script(_ACQUIRE_LUA)
+        self._release = self.redis.register_script(_RELEASE_LUA)
+
+    async def acquire(self, limits: Sequence["EffectiveLimit"]) -> Tuple[Optional[str], List[Decision]]:
+        if not limits:
+            return None, []
+        lease = os.urandom(16).hex()
+        now_ms = int(time.time() * 1000)
+        if not self.cluster:
+            reply = await self._acquire(keys=[lim.key for lim in limits], args=_acquire_args(limits, lease, now_ms))
+            decisions = _decisions(limits, reply)
+        else:
+            calls = list(_by_slot(limits, lambda lim: lim.key).values())
+            replies = [
+                await self._acquire(keys=[lim.key for lim in call], args=_acquire_args(call, lease, now_ms))
+                for call in calls
+            ]
+            decisions = _merge(limits, calls, replies)
+            if not all(d.allowed for d in decisions):
+                for call, reply in zip(calls, replies):
+                    if int(reply[0]):
+                        await self._release(keys=[lim.key for lim in call], args=[lease])
+        if not all(d.allowed for d in decisions):
+            return None, decisions
+        return encode_lease(lease, [lim.key for lim in limits]), decisions
+
+    async def release(self, lease_id: str) -> int:
+        lease, keys = decode_lease(lease_id)
+        if not self.cluster:
+            return int(await self._release(keys=keys, args=[lease]))
+        freed = 0
+        for call in _by_slot(keys, lambda k: k).values():
+            freed += int(await self._release(keys=call, args=[lease]))
+        return freed
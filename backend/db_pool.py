@@ -0,0 +1,177 @@
+# backend/db_pool.py
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+import psycopg2
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the acquire timeout."""
+
+
+class PgConnectionPool:
+    """
+    Thread-safe, bounded psycopg2 connection pool.
+
+    - keeps between `min_size` and `max_size` connections
+    - `acquire` blocks up to `acquire_timeout` seconds when all are in use
+    - connections idle for longer than `health_check_interval` are probed
+      with `SELECT 1` before being handed out; closed or broken ones are
+      replaced with fresh connections
+    - connections run in autocommit mode (the resolver only reads), so a
+      returned connection never holds an open transaction
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        min_size: int = 1,
+        max_size: int = 10,
+        acquire_timeout: float = 5.0,
+        health_check_interval: float = 30.0,
+        **connect_kwargs: Any,
+    ):
+        if max_size < 1 or not 0 <= min_size <= max_size:
+            raise ValueError("pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self._connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle: List[Tuple[Any, float]] = []  # (connection, last_used monotonic)
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._timeouts = 0
+        self._reconnects = 0
+        self._closed = False
+
+        for _ in range(min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, **self._connect_kwargs)
+        conn.autocommit = True
+        return conn
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolTimeout("connection pool is closed")
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"no Postgres connection available within {self.acquire_timeout}s "
+                            f"(max_size={self.max_size})"
+                        )
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+            if conn is None:
+                # Reserved a slot above; open the connection outside the lock
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(conn, last_used):
+                self._close_quietly(conn)
+                with self._cond:
+                    self._size -= 1
+                    self._reconnects += 1
+                continue
+
+            with self._cond:
+                self._in_use += 1
+            return conn
+
+    def release(self, conn, discard: bool = False) -> None:
+        with self._cond:
+            self._in_use -= 1
+            keep = not (discard or conn.closed or self._closed)
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._size -= 1
+            self._cond.notify()
+        if not keep:
+            # Also covers connections returned after close(), which would otherwise leak
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """Borrow a connection; broken connections are dropped instead of returned."""
+        conn = self.acquire()
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.release(conn, discard=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "size": self._size,
+                "inUse": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "maxSize": self.max_size,
+                "saturation": self._in_use / self.max_size,
+                "timeouts": self._timeouts,
+                "reconnects": self._reconnects,
+            }
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
@@ -0,0 +1,198 @@
+# backend/degraded_mode.py
+import math
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence
+
+from rate_limiter import Decision
+
+if TYPE_CHECKING:
+    from policy_resolver import EffectiveLimit
+
+
+# What a policy does while Redis is unavailable (see LocalRateLimiter)
+FAIL_OPEN = "open"      # admit without counting
+FAIL_CLOSED = "closed"  # reject
+LOCAL = "local"         # per-process approximate limit
+DEGRADED_MODES = (FAIL_OPEN, FAIL_CLOSED, LOCAL)
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker around the Redis backend.
+
+    Closed: calls go through. After `failure_threshold` failures in a row it
+    opens and callers skip Redis for `reset_seconds`; then one caller is let
+    through as a probe (half-open). A successful probe closes the breaker, a
+    failed one opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_seconds: float = 5.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+
+    def allow(self) -> bool:
+        """Whether the caller may use Redis now (a half-open probe counts as allowed)."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self._clock() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                self.state = self.OPEN
+                self.opened_at = self._clock()
+
+    def abort_probe(self) -> None:
+        """
+        The call ended without telling us whether Redis is reachable (a script
+        error, cancellation). Nothing is counted, but a half-open probe goes
+        back to open so the next one is let through after `reset_seconds`.
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self.opened_at = self._clock()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {"state": self.state, "failures": self.failures, "trips": self.trips}
+
+    def retry_at_ms(self) -> int:
+        """Epoch ms of the next probe (for Retry-After while rejecting)."""
+        with self._lock:
+            remaining = max(0.0, self.opened_at + self.reset_seconds - self._clock())
+        return int((time.time() + remaining) * 1000)
+
+
+class LocalRateLimiter:
+    """
+    In-process stand-in for Redis while the circuit breaker is open.
+
+    Each policy is handled per `modes[scope]` (default `default_mode`):
+    fail open, fail closed, or count locally with a weighted two-window
+    counter against `limit / nodes` (rounded up), so a fleet of `nodes`
+    processes admits roughly the configured limit in total. Local counts
+    are not shared between processes and never written back to Redis.
+    """
+
+    def __init__(
+        self,
+        nodes: int = 1,
+        modes: Optional[Dict[str, str]] = None,
+        default_mode: str = LOCAL,
+        max_keys: int = 100_000,
+        clock: Callable[[], float] = time.time,
+    ):
+        if default_mode not in DEGRADED_MODES:
+            raise ValueError(f"unknown degraded mode {default_mode!r}")
+        self.nodes = max(1, nodes)
+        self.modes = dict(modes or {})
+        self.default_mode = default_mode
+        self.max_keys = max_keys
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> [window index, count in that window, count in the previous one, expiry ms]
+        self._windows: Dict[str, List[int]] = {}
+        self.checks = 0
+
+    def mode(self, lim: "EffectiveLimit") -> str:
+        return self.modes.get(lim.scope, self.default_mode)
+
+    def _estimate(self, lim: "EffectiveLimit", now_ms: int) -> tuple:
+        window_ms = lim.window_seconds * 1000
+        idx = now_ms // window_ms
+        state = self._windows.get(lim.key)
+        current = previous = 0
+        if state is not None:
+            if state[0] == idx:
+                current, previous = state[1], state[2]
+            elif state[0] == idx - 1:
+                previous = state[1]
+        weight = 1 - (now_ms - idx * window_ms) / window_ms
+        return idx, current, previous, math.floor(previous * weight + current)
+
+    def check(self, limits: Sequence["EffectiveLimit"], retry_at_ms: int = 0) -> List[Decision]:
+        """
+        Admit one request (its cost, for COST policies) against each policy,
+        all-or-nothing across the locally counted ones. Fail-closed
+        rejections report `retry_at_ms` (the breaker's next probe) as their
+        reset time.
+        """
+        now_ms = int(self._clock() * 1000)
+        with self._lock:
+            self.checks += 1
+            decisions: List[Decision] = []
+            counted = []
+            for lim in limits:
+                mode = self.mode(lim)
+                if mode == FAIL_OPEN:
+                    decisions.append(Decision(True, 0))
+                elif mode == FAIL_CLOSED:
+                    decisions.append(Decision(False, lim.limit, retry_at_ms))
+                else:
+                    idx, current, previous, estimate = self._estimate(lim, now_ms)
+                    local_limit = -(-lim.limit // self.nodes)
+                    reset_ms = (idx + 1) * lim.window_seconds * 1000
+                    counted.append((len(decisions), lim, idx, current, previous))
+                    decisions.append(
+                        Decision(estimate + lim.cost <= local_limit, estimate * self.nodes, reset_ms)
+                    )
+
+            if all(d.allowed for d in decisions):
+                for i, lim, idx, current, previous in counted:
+                    expires_ms = (idx + 2) * lim.window_seconds * 1000
+                    self._windows[lim.key] = [idx, current + lim.cost, previous, expires_ms]
+                    decisions[i] = decisions[i]._replace(count=decisions[i].count + lim.cost * self.nodes)
+                self._prune(now_ms)
+        return decisions
+
+    def _prune(self, now_ms: int) -> None:
+        if len(self._windows) <= self.max_keys:
+            return
+        for k in [k for k, state in self._windows.items() if state[3] <= now_ms]:
+            del self._windows[k]
+        # Still too many live keys: drop the least recently created
+        for k in list(self._windows)[: len(self._windows) - self.max_keys]:
+            del self._windows[k]
+
+
+def parse_modes(spec: str) -> Dict[str, str]:
+    """'GLOBAL=open,USER_MODEL=local' -> {scope: mode}; unknown modes raise ValueError."""
+    modes: Dict[str, str] = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        scope, _, mode = item.partition("=")
+        mode = mode.strip().lower()
+        if mode not in DEGRADED_MODES:
+            raise ValueError(f"unknown degraded mode {mode!r} for scope {scope.strip()!r}")
+        modes[scope.strip().upper()] = mode
+    return modes
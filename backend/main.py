@@ -1,14 +1,86 @@
 # main.py
-from fastapi import FastAPI, HTTPException
+import asyncio
+import math
+from contextlib import asynccontextmanager, contextmanager
+from typing import List
+
+from fastapi import FastAPI, HTTPException, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 import redis
+import redis.asyncio
+import redis.cluster
 import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+import metrics
+import request_timing
+from adaptive_limits import AdaptiveLimits
+from audit_log import DecisionAuditLog
+from check_profiler import CheckProfiler
+from degraded_mode import CircuitBreaker, LocalRateLimiter, parse_modes
+from models import (
+    AcquireResponse,
+    AdjustRequest,
+    AdjustResponse,
+    DiagnosticsSettings,
+    FeedbackRequest,
+    FeedbackResponse,
+    IdentityCacheInvalidation,
+    PeekResponse,
+    PolicyStatus,
+    RateLimitRequest,
+    RateLimitResponse,
+    ReleaseRequest,
+    ReleaseResponse,
+)
+from rate_limiter import SLIDING_COUNTER, Decision, SlidingWindowCounterRateLimiter, SlidingWindowRateLimiterTx
+from quota_lease import AsyncQuotaLeaseManager, QuotaLeaseManager
+from async_rate_limiter import AsyncSlidingWindowRateLimiterTx
+from concurrency_limiter import AsyncConcurrencyLimiter, ConcurrencyLimiter, InvalidLease, decode_lease
+from memory_rate_limiter import InMemoryRateLimiter
+from async_policy_resolver import AsyncPolicyResolver
+from db_pool import PgConnectionPool
+from policy_index import PolicyIndex, PolicyIndexRefresher
+from policy_resolver import (
+    CONCURRENCY,
+    COST,
+    PolicyResolver,
+    SCOPE_PRECEDENCE,
+    PreparingConnection,
+    with_cost,
+)
+from stream_protocol import decode_checks, encode_frames, error_frame, result_frame
+from ttl_cache import TTLCache
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if policy_refresher is not None:
+        policy_refresher.start()
+    if audit_log is not None:
+        audit_log.start()
+    adaptive_limits.start()
+    yield
+    if policy_refresher is not None:
+        policy_refresher.stop()
+    if audit_log is not None:
+        audit_log.stop()
+    check_profiler.stop()
+    adaptive_limits.stop()
+    if lease_manager is not None:
+        if RL_ASYNC:
+            await lease_manager.release_all()
+        else:
+            lease_manager.release_all()
+    if RL_ASYNC:
+        await async_policy_resolver.close()
+        await async_redis_client.aclose()
 
-from models import RateLimitRequest, RateLimitResponse
-from rate_limiter import SlidingWindowRateLimiterTx
-from policy_resolver import PolicyResolver, SCOPE_PRECEDENCE
 
-app = FastAPI(title="AI Rate Limiter Demo")
+app = FastAPI(title="AI Rate Limiter Demo", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,8 +90,73 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-redis_client = redis.Redis(host="localhost", port=6379, db=0)
-rate_limiter = SlidingWindowRateLimiterTx(redis_client)
+# Redis connection. With RL_REDIS_CLUSTER=1, RL_REDIS_URL is any cluster node
+# (the rest are discovered), keys are hash-tagged per policy and scripted
+# evaluation is split per slot.
+RL_REDIS_URL = os.getenv("RL_REDIS_URL", "redis://localhost:6379/0")
+RL_REDIS_CLUSTER = os.getenv("RL_REDIS_CLUSTER", "0").lower() in ("1", "true", "yes")
+# Connections per process (per node on a cluster); size to worker threads / in-flight checks
+RL_REDIS_MAX_CONNECTIONS = int(os.getenv("RL_REDIS_MAX_CONNECTIONS", "50"))
+# Bound every Redis call, so a stalled server fails the check quickly instead
+# of blocking the worker (the circuit breaker below then stops trying)
+_redis_options = dict(
+    max_connections=RL_REDIS_MAX_CONNECTIONS,
+    socket_timeout=float(os.getenv("RL_REDIS_SOCKET_TIMEOUT", "0.25")),
+    socket_connect_timeout=float(os.getenv("RL_REDIS_CONNECT_TIMEOUT", "0.25")),
+)
+
+if RL_REDIS_CLUSTER:
+    redis_client = redis.cluster.RedisCluster.from_url(RL_REDIS_URL, **_redis_options)
+else:
+    redis_client = redis.Redis.from_url(RL_REDIS_URL, **_redis_options)
+rate_limiter = SlidingWindowRateLimiterTx(redis_client, cluster=RL_REDIS_CLUSTER)
+# Constant-memory engine for policies with algorithm = 'SLIDING_COUNTER'
+counter_rate_limiter = SlidingWindowCounterRateLimiter(redis_client, cluster=RL_REDIS_CLUSTER)
+# In-flight leases for CONCURRENCY policies (/rate-limit/acquire, /rate-limit/release)
+concurrency_limiter = ConcurrencyLimiter(redis_client, cluster=RL_REDIS_CLUSTER)
+
+# Engine mode:
+# - "tx":     one WATCH/MULTI/EXEC transaction per policy (default)
+# - "script": all policies of a request in one atomic server-side script call
+# - "memory": counts kept in this process, no Redis (single node only)
+RL_ENGINE = os.getenv("RL_ENGINE", "tx").lower()
+memory_rate_limiter = InMemoryRateLimiter(
+    stripes=int(os.getenv("RL_MEMORY_STRIPES", "64")),
+    max_keys=int(os.getenv("RL_MEMORY_MAX_KEYS", "1000000")),
+)
+
+# Degraded mode: after RL_BREAKER_FAILURES consecutive Redis connection errors or
+# timeouts, checks skip Redis for RL_BREAKER_RESET_SECONDS and are answered by a
+# per-process limiter (limits divided by RL_DEGRADED_NODES), or fail open/closed
+# per scope via RL_DEGRADED_MODES ("GLOBAL=open,USER_MODEL=local,..."). Then one
+# check probes Redis and a success switches back.
+redis_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("RL_BREAKER_FAILURES", "5")),
+    reset_seconds=float(os.getenv("RL_BREAKER_RESET_SECONDS", "5")),
+)
+local_rate_limiter = LocalRateLimiter(
+    nodes=int(os.getenv("RL_DEGRADED_NODES", "1")),
+    modes=parse_modes(os.getenv("RL_DEGRADED_MODES", "")),
+    default_mode=os.getenv("RL_DEGRADED_DEFAULT_MODE", "local").lower(),
+)
+# Negative cache: once Redis rejects a policy key, further checks on it are
+# rejected from memory until the reset time Redis reported (capped at
+# RL_BLOCK_CACHE_MAX_SECONDS, so a raised limit is picked up). Size 0 disables.
+blocked_cache = TTLCache(
+    max_size=int(os.getenv("RL_BLOCK_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.getenv("RL_BLOCK_CACHE_MAX_SECONDS", "5")),
+)
+# Errors that mean "Redis unavailable" (script or data errors are not)
+_REDIS_UNAVAILABLE = (redis.ConnectionError, redis.TimeoutError, redis.exceptions.ClusterError)
+
+# Upper bound on requests accepted by /rate-limit/check-batch
+RL_MAX_BATCH_SIZE = int(os.getenv("RL_MAX_BATCH_SIZE", "500"))
+# Messages one /rate-limit/stream connection may have in evaluation at once
+RL_STREAM_MAX_INFLIGHT = int(os.getenv("RL_STREAM_MAX_INFLIGHT", "64"))
+
+# RL_ASYNC=1 serves /rate-limit/check from an `async def` handler using redis.asyncio
+# and asyncpg, so one worker can keep many checks in flight while waiting on I/O.
+RL_ASYNC = os.getenv("RL_ASYNC", "0").lower() in ("1", "true", "yes")
 
 # Postgres DSN – adjust as needed
 DB_DSN = os.getenv(
@@ -27,41 +164,613 @@ DB_DSN = os.getenv(
     "dbname=rate_limiter user=postgres password=postgres host=localhost port=5432",
 )
 
-policy_resolver = PolicyResolver(DB_DSN)
+# Name -> id lookups (tenant, user, api key, model, tier) rarely change; cache them
+identity_cache = TTLCache(
+    max_size=int(os.getenv("RL_IDENTITY_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.getenv("RL_IDENTITY_CACHE_TTL", "60")),
+    negative_ttl_seconds=float(os.getenv("RL_IDENTITY_CACHE_NEGATIVE_TTL", "10")),
+)
+
+# Sized to the number of threads running sync handlers concurrently
+# (opened lazily in async mode, where the asyncpg pool serves checks)
+db_pool = PgConnectionPool(
+    DB_DSN,
+    min_size=0 if RL_ASYNC else int(os.getenv("RL_PG_POOL_MIN", "1")),
+    max_size=int(os.getenv("RL_PG_POOL_MAX", "10")),
+    acquire_timeout=float(os.getenv("RL_PG_POOL_TIMEOUT", "5")),
+    health_check_interval=float(os.getenv("RL_PG_POOL_HEALTHCHECK_INTERVAL", "30")),
+    connection_factory=PreparingConnection,
+)
+
+policy_resolver = PolicyResolver(DB_DSN, identity_cache=identity_cache, pool=db_pool)
+policy_resolver.hash_tags = RL_REDIS_CLUSTER
+
+# Async path (RL_ASYNC=1); shares the identity cache with the sync resolver
+if RL_REDIS_CLUSTER:
+    async_redis_client = redis.asyncio.RedisCluster.from_url(RL_REDIS_URL, **_redis_options)
+else:
+    async_redis_client = redis.asyncio.Redis.from_url(RL_REDIS_URL, **_redis_options)
+async_rate_limiter = AsyncSlidingWindowRateLimiterTx(async_redis_client, cluster=RL_REDIS_CLUSTER)
+async_concurrency_limiter = AsyncConcurrencyLimiter(async_redis_client, cluster=RL_REDIS_CLUSTER)
+async_policy_resolver = AsyncPolicyResolver(
+    DB_DSN,
+    identity_cache=identity_cache,
+    min_size=int(os.getenv("RL_PG_POOL_MIN", "1")),
+    max_size=int(os.getenv("RL_PG_POOL_MAX", "10")),
+)
+async_policy_resolver.hash_tags = RL_REDIS_CLUSTER
+
+# Optional quota leasing for hot shared keys: policies in RL_LEASE_SCOPES with a
+# limit of at least RL_LEASE_MIN_LIMIT are served from capacity this node
+# reserves in chunks, so they stay off the per-request Redis path (not used
+# by the memory engine, which has no Redis path). With RL_ASYNC the leases
+# are renewed through redis.asyncio.
+RL_LEASE_SCOPES = [s.strip() for s in os.getenv("RL_LEASE_SCOPES", "").split(",") if s.strip()]
+_lease_options = dict(
+    scopes=RL_LEASE_SCOPES,
+    min_limit=int(os.getenv("RL_LEASE_MIN_LIMIT", "10000")),
+    lease_seconds=float(os.getenv("RL_LEASE_SECONDS", "1")),
+    max_chunk=int(os.getenv("RL_LEASE_MAX_CHUNK", "1000")),
+)
+if not RL_LEASE_SCOPES or RL_ENGINE == "memory":
+    lease_manager = None
+elif RL_ASYNC:
+    lease_manager = AsyncQuotaLeaseManager(async_redis_client, **_lease_options)
+else:
+    lease_manager = QuotaLeaseManager(redis_client, **_lease_options)
+
+# Policy index: enabled policies are held in memory and refreshed from
+# rate_limit_policy.updated_at every RL_POLICY_REFRESH_SECONDS (0 disables the
+# index; every check then queries Postgres), with a full reload every
+# RL_POLICY_FULL_RELOAD_SECONDS. Until the first load, resolution uses SQL.
+RL_POLICY_REFRESH_SECONDS = float(os.getenv("RL_POLICY_REFRESH_SECONDS", "2"))
+policy_refresher = None
+if RL_POLICY_REFRESH_SECONDS > 0:
+    policy_index = PolicyIndex()
+    policy_resolver.policy_index = policy_index
+    async_policy_resolver.policy_index = policy_index
+    policy_refresher = PolicyIndexRefresher(
+        policy_index,
+        policy_resolver,
+        interval=RL_POLICY_REFRESH_SECONDS,
+        full_reload_seconds=float(os.getenv("RL_POLICY_FULL_RELOAD_SECONDS", "300")),
+    )
+
+# Adaptive limits: policies with an adaptive_group are enforced at a fraction of
+# their limit that POST /rate-limit/feedback shrinks multiplicatively
+# (RL_ADAPTIVE_DECREASE, floor RL_ADAPTIVE_MIN_SCALE) while reported latency or
+# error rate is over its threshold and grows additively (RL_ADAPTIVE_INCREASE)
+# while healthy. Kept in Redis; each node refreshes its copy every
+# RL_ADAPTIVE_REFRESH_SECONDS.
+adaptive_limits = AdaptiveLimits(
+    redis_client,
+    latency_threshold_ms=float(os.getenv("RL_ADAPTIVE_LATENCY_MS", "1000")),
+    error_rate_threshold=float(os.getenv("RL_ADAPTIVE_ERROR_RATE", "0.05")),
+    decrease=float(os.getenv("RL_ADAPTIVE_DECREASE", "0.7")),
+    increase=float(os.getenv("RL_ADAPTIVE_INCREASE", "0.05")),
+    min_scale=float(os.getenv("RL_ADAPTIVE_MIN_SCALE", "0.1")),
+    interval_seconds=float(os.getenv("RL_ADAPTIVE_INTERVAL_SECONDS", "1")),
+    refresh_seconds=float(os.getenv("RL_ADAPTIVE_REFRESH_SECONDS", "1")),
+)
+
+# Decision audit log: with RL_AUDIT_DIR set, allow/deny decisions (sampled at
+# RL_AUDIT_SAMPLE_RATE / RL_AUDIT_DENY_SAMPLE_RATE) are queued in memory and
+# written in batches by a background thread to rotating msgpack files there.
+# Decisions arriving while RL_AUDIT_QUEUE_SIZE are queued are dropped and counted.
+RL_AUDIT_DIR = os.getenv("RL_AUDIT_DIR", "")
+audit_log = (
+    DecisionAuditLog(
+        RL_AUDIT_DIR,
+        sample_rate=float(os.getenv("RL_AUDIT_SAMPLE_RATE", "1")),
+        deny_sample_rate=float(os.getenv("RL_AUDIT_DENY_SAMPLE_RATE", "1")),
+        queue_size=int(os.getenv("RL_AUDIT_QUEUE_SIZE", "100000")),
+        flush_seconds=float(os.getenv("RL_AUDIT_FLUSH_SECONDS", "1")),
+        max_file_bytes=int(float(os.getenv("RL_AUDIT_MAX_FILE_MB", "64")) * 1024 * 1024),
+        max_files=int(os.getenv("RL_AUDIT_MAX_FILES", "24")),
+    )
+    if RL_AUDIT_DIR
+    else None
+)
+
+# Diagnostics for slow checks, switchable at runtime (POST /admin/diagnostics):
+# RL_SERVER_TIMING=1 returns a Server-Timing header with the spans of each
+# /rate-limit/check; RL_PROFILE_EVERY=N runs every Nth check under cProfile and
+# RL_PROFILE_SLOW_MS stack-samples checks running longer than that, writing the
+# profiles to RL_PROFILE_DIR. When off, a check only reads these two settings.
+server_timing_enabled = os.getenv("RL_SERVER_TIMING", "0").lower() in ("1", "true", "yes")
+check_profiler = CheckProfiler(
+    os.getenv("RL_PROFILE_DIR", "profiles"),
+    slow_ms=float(os.getenv("RL_PROFILE_SLOW_MS", "0")),
+    every_n=int(os.getenv("RL_PROFILE_EVERY", "0")),
+    max_files=int(os.getenv("RL_PROFILE_MAX_FILES", "100")),
+)
+
+# Metrics (GET /metrics). Cache, pool and contention counters are read at scrape time.
+def _observe_watch_retries(retries):
+    metrics.WATCH_RETRIES.observe(retries)
+    if retries:
+        request_timing.note("watch-retries", str(retries))
+
+
+rate_limiter.retry_observer = _observe_watch_retries
+async_rate_limiter.retry_observer = _observe_watch_retries
+metrics.REGISTRY.register(
+    metrics.StatsCollector(
+        identity_cache=identity_cache,
+        pool_stats=db_pool.stats,
+        engine_stats={"sync": rate_limiter.stats, "async": async_rate_limiter.stats},
+        breaker=redis_breaker,
+        local_limiter=local_rate_limiter,
+        blocked_cache=blocked_cache,
+        audit_log=audit_log,
+        adaptive_limits=adaptive_limits,
+    )
+)
+_redis_eval_seconds = metrics.redis_eval_timer(RL_ENGINE)
+_redis_eval_batch_seconds = metrics.redis_eval_timer("batch")
+
+
+def _as_evaluated(policies, decisions):
+    return [
+        {"policy": p, "allowed": d.allowed, "count": d.count, "resetMs": d.reset_ms}
+        for p, d in zip(policies, decisions)
+    ]
+
+
+def _effective(policies, cost):
+    """Policies as enforced for one request: its cost applied, adaptive limits scaled."""
+    return adaptive_limits.apply(with_cost(policies, cost))
+
+
+def _audit(endpoint, evaluated, result):
+    if audit_log is not None:
+        audit_log.record(endpoint, evaluated, result)
+
+
+def _lease_locally(policies):
+    """
+    Serve leased policies from this node's quota leases.
+
+    Returns (evaluated, remote): `evaluated` holds the leased policies'
+    results and `remote` the policies still to check in Redis, or None when
+    a leased policy already rejected the request.
+    """
+    if lease_manager is None:
+        return [], policies
+    leased = [p for p in policies if lease_manager.handles(p)]
+    if not leased:
+        return [], policies
+
+    return _leased_evaluated(policies, leased, lease_manager.consume(leased))
+
+
+async def _lease_locally_async(policies):
+    """Async counterpart of _lease_locally (lease_manager is an AsyncQuotaLeaseManager)."""
+    if lease_manager is None:
+        return [], policies
+    leased = [p for p in policies if lease_manager.handles(p)]
+    if not leased:
+        return [], policies
+    return _leased_evaluated(policies, leased, await lease_manager.consume(leased))
+
+
+def _leased_evaluated(policies, leased, decisions):
+    evaluated = _as_evaluated(leased, decisions)
+    if not all(d.allowed for d in decisions):
+        return evaluated, None
+    return evaluated, [p for p in policies if not lease_manager.handles(p)]
+
+
+def _settle_leases(policies, local, remote_evaluated):
+    """Merge local and Redis results in policy order; give leased units back if Redis rejected."""
+    if local and not all(e["allowed"] for e in remote_evaluated):
+        lease_manager.refund(e["policy"] for e in local)
+    order = {id(p): i for i, p in enumerate(policies)}
+    return sorted(local + remote_evaluated, key=lambda e: order[id(e["policy"])])
+
+
+@contextmanager
+def _refunding_leases_on_error(leased):
+    """
+    Give back the lease units taken for (local, remote) pairs if the Redis
+    call in the block fails, so the fallback does not count them again.
+    """
+    try:
+        yield
+    except BaseException:
+        if lease_manager is not None:
+            lease_manager.refund(e["policy"] for local, remote in leased if remote is not None for e in local)
+        raise
+
+
+def _with_breaker(evaluate, fallback):
+    """evaluate() unless the Redis breaker is open or Redis fails; then fallback()."""
+    if not redis_breaker.allow():
+        return fallback()
+    try:
+        result = evaluate()
+    except _REDIS_UNAVAILABLE:
+        redis_breaker.record_failure()
+        return fallback()
+    except BaseException:
+        # Script/data errors and cancellation say nothing about Redis being
+        # down, but a half-open probe must not be left hanging
+        redis_breaker.abort_probe()
+        raise
+    redis_breaker.record_success()
+    return result
+
+
+async def _with_breaker_async(evaluate, fallback):
+    """Async counterpart of _with_breaker (evaluate returns an awaitable)."""
+    if not redis_breaker.allow():
+        return fallback()
+    try:
+        result = await evaluate()
+    except _REDIS_UNAVAILABLE:
+        redis_breaker.record_failure()
+        return fallback()
+    except BaseException:  # including cancellation; see _with_breaker
+        redis_breaker.abort_probe()
+        raise
+    redis_breaker.record_success()
+    return result
+
+
+def _evaluate_degraded(policies):
+    """Answer from the per-process limiter while Redis is unavailable."""
+    return _as_evaluated(policies, local_rate_limiter.check(policies, redis_breaker.retry_at_ms()))
+
+
+def _evaluate_policies(policies):
+    """Evaluate all policies (leased ones locally); returns dicts {policy, allowed, count, resetMs}."""
+    blocked = _cached_rejection(policies)
+    if blocked is not None:
+        return blocked
+    return _with_breaker(lambda: _evaluate_with_redis(policies), lambda: _evaluate_degraded(policies))
+
+
+async def _evaluate_policies_async(policies):
+    """Async counterpart of _evaluate_policies."""
+    blocked = _cached_rejection(policies)
+    if blocked is not None:
+        return blocked
+    return await _with_breaker_async(
+        lambda: _evaluate_with_redis_async(policies), lambda: _evaluate_degraded(policies)
+    )
+
+
+def _cached_rejection(policies):
+    """
+    Reject from blocked_cache while any policy is known to be over its limit;
+    None if the request has to be evaluated. Only the blocking policies are
+    returned: the others were not evaluated, so they are left out of the
+    metrics and the audit log.
+    """
+    now_ms = int(time.time() * 1000)
+    blocking, decisions = [], []
+    for p in policies:
+        until = blocked_cache.get(p.key, None)
+        if until is not None and until > now_ms:
+            blocking.append(p)
+            decisions.append(Decision(False, p.limit, until))
+    return _as_evaluated(blocking, decisions) if blocking else None
+
+
+def _remember_blocked(evaluated):
+    """Cache "blocked until resetMs" for policies Redis just rejected."""
+    now_ms = int(time.time() * 1000)
+    for e in evaluated:
+        # Whether a COST policy admits depends on the next request's cost
+        if e["policy"].limit_unit == COST:
+            continue
+        if not e["allowed"] and e["resetMs"] > now_ms:
+            ttl_seconds = min((e["resetMs"] - now_ms) / 1000, blocked_cache.ttl_seconds)
+            blocked_cache.set(e["policy"].key, e["resetMs"], ttl_seconds=ttl_seconds)
+
+
+def _evaluate_with_redis(policies):
+    local, remote = _lease_locally(policies)
+    if remote is None:
+        return local
+    started = time.perf_counter()
+    with _refunding_leases_on_error([(local, remote)]):
+        remote_evaluated = _evaluate_in_redis(remote)
+    _redis_eval_seconds.observe(time.perf_counter() - started)
+    _remember_blocked(remote_evaluated)
+    return _settle_leases(policies, local, remote_evaluated)
+
+
+async def _evaluate_with_redis_async(policies):
+    local, remote = await _lease_locally_async(policies)
+    if remote is None:
+        return local
+    started = time.perf_counter()
+    with _refunding_leases_on_error([(local, remote)]):
+        remote_evaluated = await _evaluate_in_redis_async(remote)
+    _redis_eval_seconds.observe(time.perf_counter() - started)
+    _remember_blocked(remote_evaluated)
+    return _settle_leases(policies, local, remote_evaluated)
+
+
+def _evaluate_batch(groups):
+    """Evaluate a batch of policy groups in one Redis call (degraded mode while Redis is down)."""
+
+    def evaluate():
+        leased, remote_groups = _lease_batch(groups)
+        started = time.perf_counter()
+        with _refunding_leases_on_error(leased):
+            if RL_ENGINE == "memory":
+                results = memory_rate_limiter.check_and_consume_batch(remote_groups)
+            else:
+                results = rate_limiter.check_and_consume_batch(remote_groups)
+        _redis_eval_batch_seconds.observe(time.perf_counter() - started)
+        return _settle_batch(groups, leased, remote_groups, results)
+
+    return _with_breaker(evaluate, lambda: [_evaluate_degraded(g) for g in groups])
+
+
+async def _evaluate_batch_async(groups):
+    """Async counterpart of _evaluate_batch."""
+
+    async def evaluate():
+        leased, remote_groups = await _lease_batch_async(groups)
+        started = time.perf_counter()
+        with _refunding_leases_on_error(leased):
+            if RL_ENGINE == "memory":
+                results = memory_rate_limiter.check_and_consume_batch(remote_groups)
+            else:
+                results = await async_rate_limiter.check_and_consume_batch(remote_groups)
+        _redis_eval_batch_seconds.observe(time.perf_counter() - started)
+        return _settle_batch(groups, leased, remote_groups, results)
+
+    return await _with_breaker_async(evaluate, lambda: [_evaluate_degraded(g) for g in groups])
+
+
+def _lease_batch(groups):
+    """
+    _cached_rejection, then _lease_locally, per request; requests rejected
+    locally get an empty Redis group.
+    """
+    leased = []
+    for g in groups:
+        blocked = _cached_rejection(g)
+        leased.append((blocked, None) if blocked is not None else _lease_locally(g))
+    return leased, [remote or [] for _, remote in leased]
+
+
+async def _lease_batch_async(groups):
+    """Async counterpart of _lease_batch."""
+    leased = []
+    for g in groups:
+        blocked = _cached_rejection(g)
+        leased.append((blocked, None) if blocked is not None else await _lease_locally_async(g))
+    return leased, [remote or [] for _, remote in leased]
+
+
+def _settle_batch(groups, leased, remote_groups, results):
+    evaluated = []
+    for g, (local, remote), sent, decisions in zip(groups, leased, remote_groups, results):
+        if remote is None:
+            evaluated.append(local)
+        else:
+            remote_evaluated = _as_evaluated(sent, decisions)
+            _remember_blocked(remote_evaluated)
+            evaluated.append(_settle_leases(g, local, remote_evaluated))
+    return evaluated
+
+
+def _evaluate_in_redis(policies):
+    """Run the policies through the configured engine."""
+    if RL_ENGINE == "memory":
+        return _as_evaluated(policies, memory_rate_limiter.check_and_consume_many(policies))
+    if RL_ENGINE == "script":
+        return _as_evaluated(policies, rate_limiter.check_and_consume_many(policies))
+
+    decisions = []
+    for p in policies:
+        if p.limit_unit == COST:
+            # Weighted windows are summed server-side: one script call
+            decision = rate_limiter.check_and_consume_many([p])[0]
+        elif p.algorithm == SLIDING_COUNTER:
+            decision = counter_rate_limiter.check_and_consume_detailed(
+                key=p.key,
+                window_seconds=p.window_seconds,
+                limit=p.limit,
+                buckets=p.buckets,
+                shards=p.shards,
+            )
+        elif p.shards > 1:
+            decision = rate_limiter.check_and_consume_sharded(
+                key=p.key,
+                window_seconds=p.window_seconds,
+                limit=p.limit,
+                shards=p.shards,
+            )
+        else:
+            decision = rate_limiter.check_and_consume_detailed(
+                key=p.key,
+                window_seconds=p.window_seconds,
+                limit=p.limit,
+            )
+        decisions.append(decision)
+    return _as_evaluated(policies, decisions)
+
+
+async def _evaluate_in_redis_async(policies):
+    """Async counterpart of _evaluate_in_redis; tx mode runs the per-policy transactions concurrently."""
+    if RL_ENGINE == "memory":
+        # No I/O to wait on: the in-process engine answers inline
+        return _as_evaluated(policies, memory_rate_limiter.check_and_consume_many(policies))
+    if RL_ENGINE == "script":
+        decisions = await async_rate_limiter.check_and_consume_many(policies)
+    else:
+        decisions = await async_rate_limiter.check_and_consume_each(policies)
+    return _as_evaluated(policies, decisions)
 
 
 @app.get("/health")
 def health():
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "dbPool": db_pool.stats(),
+        "redisBreaker": redis_breaker.stats(),
+        "policyIndex": policy_refresher.stats() if policy_refresher is not None else None,
+        "auditLog": audit_log.stats() if audit_log is not None else None,
+        "adaptiveLimits": adaptive_limits.stats(),
+    }
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(generate_latest(metrics.REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+
+def _diagnostics_status():
+    return {"serverTiming": server_timing_enabled, "profiler": check_profiler.stats()}
+
+
+@app.get("/admin/diagnostics")
+def get_diagnostics():
+    return _diagnostics_status()
 
 
-@app.post("/rate-limit/check", response_model=RateLimitResponse)
-def check_rate_limit(body: RateLimitRequest):
+@app.post("/admin/diagnostics")
+def set_diagnostics(body: DiagnosticsSettings):
+    global server_timing_enabled
+    if body.serverTiming is not None:
+        server_timing_enabled = body.serverTiming
+    if body.profileSlowMs is not None or body.profileEvery is not None:
+        check_profiler.configure(
+            body.profileSlowMs if body.profileSlowMs is not None else check_profiler.slow_ms,
+            body.profileEvery if body.profileEvery is not None else check_profiler.every_n,
+        )
+    return _diagnostics_status()
+
+
+@app.post("/admin/identity-cache/invalidate")
+def invalidate_identity_cache(body: IdentityCacheInvalidation):
+    if body.all:
+        policy_resolver.clear_identity_cache()
+    if body.tenantId:
+        policy_resolver.invalidate_tenant(body.tenantId)
+    if body.apiKey:
+        policy_resolver.invalidate_api_key(body.apiKey)
+    if body.modelId:
+        policy_resolver.invalidate_model(body.modelId)
+    if body.modelTier:
+        policy_resolver.invalidate_model_tier(body.modelTier)
+    return {"status": "ok", "entries": len(identity_cache)}
+
+
+def _validate(body: RateLimitRequest) -> None:
     if not body.userId or not body.modelId:
         raise HTTPException(status_code=400, detail="userId and modelId are required")
+    if body.cost < 1:
+        raise HTTPException(status_code=400, detail="cost must be at least 1")
 
-    try:
-        policies = policy_resolver.resolve(body)
-    except Exception as e:
-        # In a real system you'd log this; for now, surface it
-        raise HTTPException(status_code=500, detail=f"Policy resolve error: {e}")
 
-    # We'll evaluate all policies and collect results so we can return a clear cause
-    evaluated = []  # list of dicts: {policy, allowed, count}
-    for p in policies:
-        allowed, count = rate_limiter.check_and_consume(
-            key=p.key,
-            window_seconds=p.window_seconds,
-            limit=p.limit,
+def _validate_batch(bodies: List[RateLimitRequest]) -> None:
+    if len(bodies) > RL_MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"batch of {len(bodies)} exceeds the maximum of {RL_MAX_BATCH_SIZE}",
         )
-        evaluated.append(
-            {
-                "policy": p,
-                "allowed": allowed,
-                "count": count,
-            }
+    for i, body in enumerate(bodies):
+        if not body.userId or not body.modelId:
+            raise HTTPException(
+                status_code=400, detail=f"requests[{i}]: userId and modelId are required"
+            )
+        if body.cost < 1:
+            raise HTTPException(status_code=400, detail=f"requests[{i}]: cost must be at least 1")
+
+
+def _identity_key(body: RateLimitRequest) -> tuple:
+    """Requests with the same identity fields resolve to the same policies."""
+    return (body.tenantId, body.userId, body.apiKey, body.modelId, body.modelTier)
+
+
+def _split_leased(policies):
+    """(leased, remote) policies for a peek; leased ones are read from their ledgers."""
+    leased = [p for p in policies if lease_manager is not None and lease_manager.handles(p)]
+    remote = [p for p in policies if lease_manager is None or not lease_manager.handles(p)]
+    return leased, remote
+
+
+def _backend_unavailable():
+    # Peeking has no local answer: counts live in Redis
+    raise HTTPException(status_code=503, detail="rate limit backend unavailable")
+
+
+def _build_peek_response(policies, decisions) -> PeekResponse:
+    now_ms = int(time.time() * 1000)
+    blocking = [d.reset_ms for d in decisions if not d.allowed]
+    retry_after = None
+    if blocking and all(blocking):
+        retry_after = max(0, max(blocking) - now_ms)
+    return PeekResponse(
+        allowed=not blocking,
+        retryAfterMs=retry_after,
+        policies=[
+            PolicyStatus(
+                label=p.label,
+                key=p.key,
+                limit=p.limit,
+                count=d.count,
+                remaining=max(0, p.limit - d.count),
+                windowSeconds=p.window_seconds,
+                resetAt=d.reset_ms or None,
+            )
+            for p, d in zip(policies, decisions)
+        ],
+    )
+
+
+def _build_acquire_response(policies, lease_id, decisions) -> AcquireResponse:
+    status = _build_peek_response(policies, decisions)
+    cause = None
+    if lease_id is None and policies:
+        failures = sorted(
+            (e for e in _as_evaluated(policies, decisions) if not e["allowed"]),
+            key=lambda e: SCOPE_PRECEDENCE.get(e["policy"].scope, 0),
+            reverse=True,
+        )
+        cause = "; ".join(
+            f"{e['policy'].label} concurrency exceeded: {e['count']}/{e['policy'].limit} in flight "
+            f"(key={e['policy'].key})"
+            for e in failures
         )
+    expires_at = None
+    if lease_id is not None:
+        expires_at = int(time.time() * 1000) + min(p.window_seconds for p in policies) * 1000
+    return AcquireResponse(
+        allowed=lease_id is not None or not policies,
+        leaseId=lease_id,
+        expiresAt=expires_at,
+        cause=cause,
+        retryAfterMs=status.retryAfterMs,
+        policies=status.policies,
+    )
+
+
+def _set_rate_limit_headers(response: Response, result: RateLimitResponse) -> None:
+    """RateLimit-* headers for the reported policy, plus Retry-After when rejected."""
+    response.headers["RateLimit-Limit"] = str(result.limit)
+    response.headers["RateLimit-Remaining"] = str(max(0, result.limit - result.count))
+    if result.resetAt:
+        reset_seconds = math.ceil(max(0, result.resetAt - time.time() * 1000) / 1000)
+        response.headers["RateLimit-Reset"] = str(reset_seconds)
+    if not result.allowed and result.retryAfterMs is not None:
+        response.headers["Retry-After"] = str(math.ceil(result.retryAfterMs / 1000))
 
+
+def _build_response(evaluated, charged_at=None) -> RateLimitResponse:
+    """
+    Turn evaluated policies ({policy, allowed, count, resetMs} dicts) into the
+    API response; `charged_at` (epoch ms, taken before the evaluation) is
+    reported if COST policies were charged.
+    """
+    now_ms = int(time.time() * 1000)
     # Find any failing policies
     failures = [e for e in evaluated if not e["allowed"]]
 
@@ -88,12 +797,19 @@ def check_rate_limit(body: RateLimitRequest):
                 other.append(f"{op.label} ({o['count']}/{op.limit})")
             cause += "; also violated: " + ", ".join(other)
 
+        # The request fits again once every failing policy has room (0 = unknown)
+        resets = [o.get("resetMs", 0) for o in failures]
+        reset_at = max(resets) if all(resets) else None
+
         return RateLimitResponse(
             allowed=False,
             limit=p.limit,
             count=count,
             windowSeconds=p.window_seconds,
             cause=cause,
+            retryAfterMs=max(0, reset_at - now_ms) if reset_at else None,
+            resetAt=reset_at,
+            configuredLimit=p.configured_limit,
         )
 
     # All policies passed; determine primary policy by smallest remaining capacity (limit - count)
@@ -125,6 +841,7 @@ def check_rate_limit(body: RateLimitRequest):
             "limit": e["policy"].limit,
             "count": e["count"],
             "windowSeconds": e["policy"].window_seconds,
+            "configuredLimit": e["policy"].configured_limit,
         }
         for e in evaluated
         if e["allowed"]
@@ -136,4 +853,462 @@ def check_rate_limit(body: RateLimitRequest):
         count=primary_count,
         windowSeconds=primary.window_seconds,
         fulfilled=fulfilled,
+        resetAt=primary_entry.get("resetMs") or None,
+        configuredLimit=primary.configured_limit,
+        chargedAt=charged_at if any(e["policy"].limit_unit == COST for e in evaluated) else None,
     )
+
+
+@contextmanager
+def _diagnosed(response: Response):
+    """Server-Timing spans and/or profiling of one check, as currently switched on."""
+    timing = request_timing.begin() if server_timing_enabled else None
+    profiled = check_profiler.begin()
+    try:
+        yield
+    finally:
+        check_profiler.end(profiled)
+        if timing is not None:
+            response.headers["Server-Timing"] = timing.header()
+
+
+if RL_ASYNC:
+
+    @app.post("/rate-limit/check", response_model=RateLimitResponse)
+    async def check_rate_limit(body: RateLimitRequest, response: Response):
+        if not (server_timing_enabled or check_profiler.enabled):
+            return await _check_rate_limit(body, response)
+        with _diagnosed(response):
+            return await _check_rate_limit(body, response)
+
+    async def _check_rate_limit(body: RateLimitRequest, response: Response):
+        started = time.perf_counter()
+        _validate(body)
+
+        try:
+            policies = _effective(await async_policy_resolver.resolve(body), body.cost)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Policy resolve error: {e}")
+        metrics.RESOLVE_LATENCY.observe(time.perf_counter() - started)
+        request_timing.mark("resolve")
+
+        charged_at = int(time.time() * 1000)
+        evaluated = await _evaluate_policies_async(policies)
+        request_timing.mark("evaluate")
+        metrics.record_decisions(evaluated)
+        result = _build_response(evaluated, charged_at)
+        request_timing.mark("build")
+        _audit("check", evaluated, result)
+        _set_rate_limit_headers(response, result)
+        metrics.CHECK.observe(time.perf_counter() - started)
+        return result
+
+else:
+
+    @app.post("/rate-limit/check", response_model=RateLimitResponse)
+    def check_rate_limit(body: RateLimitRequest, response: Response):
+        if not (server_timing_enabled or check_profiler.enabled):
+            return _check_rate_limit(body, response)
+        with _diagnosed(response):
+            return _check_rate_limit(body, response)
+
+    def _check_rate_limit(body: RateLimitRequest, response: Response):
+        started = time.perf_counter()
+        _validate(body)
+
+        try:
+            policies = _effective(policy_resolver.resolve(body), body.cost)
+        except Exception as e:
+            # In a real system you'd log this; for now, surface it
+            raise HTTPException(status_code=500, detail=f"Policy resolve error: {e}")
+        metrics.RESOLVE_LATENCY.observe(time.perf_counter() - started)
+        request_timing.mark("resolve")
+
+        # We'll evaluate all policies and collect results so we can return a clear cause
+        charged_at = int(time.time() * 1000)
+        evaluated = _evaluate_policies(policies)
+        request_timing.mark("evaluate")
+        metrics.record_decisions(evaluated)
+        result = _build_response(evaluated, charged_at)
+        request_timing.mark("build")
+        _audit("check", evaluated, result)
+        _set_rate_limit_headers(response, result)
+        metrics.CHECK.observe(time.perf_counter() - started)
+        return result
+
+
+# Read-only: remaining capacity of every resolved policy, without consuming.
+# Lets blocked clients wait for resetAt / retryAfterMs instead of polling /check.
+if RL_ASYNC:
+
+    @app.post("/rate-limit/peek", response_model=PeekResponse)
+    async def peek_rate_limit(body: RateLimitRequest):
+        _validate(body)
+        try:
+            policies = _effective(await async_policy_resolver.resolve(body), body.cost)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Policy resolve error: {e}")
+
+        leased, remote = _split_leased(policies)
+
+        async def peek():
+            if RL_ENGINE == "memory":
+                remote_decisions = memory_rate_limiter.peek(remote)
+            else:
+                remote_decisions = await async_rate_limiter.peek(remote)
+            decisions = dict(zip(map(id, remote), remote_decisions))
+            if leased:
+                decisions.update(zip(map(id, leased), await lease_manager.peek(leased)))
+            return [decisions[id(p)] for p in policies]
+
+        decisions = await _with_breaker_async(peek, _backend_unavailable)
+        return _build_peek_response(policies, decisions)
+
+else:
+
+    @app.post("/rate-limit/peek", response_model=PeekResponse)
+    def peek_rate_limit(body: RateLimitRequest):
+        _validate(body)
+        try:
+            policies = _effective(policy_resolver.resolve(body), body.cost)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Policy resolve error: {e}")
+
+        leased, remote = _split_leased(policies)
+
+        def peek():
+            engine = memory_rate_limiter if RL_ENGINE == "memory" else rate_limiter
+            decisions = dict(zip(map(id, remote), engine.peek(remote)))
+            if leased:
+                decisions.update(zip(map(id, leased), lease_manager.peek(leased)))
+            return [decisions[id(p)] for p in policies]
+
+        decisions = _with_breaker(peek, _backend_unavailable)
+        return _build_peek_response(policies, decisions)
+
+
+# Post-hoc cost correction: once a request's actual cost is known (e.g. tokens
+# generated), its COST policies are charged the difference to what /check
+# charged, booked at the check's chargedAt so it leaves the window with the
+# charge. No admission check; a negative difference gives units back, which
+# needs chargedAt (a refund booked later would outlive the charge).
+def _validate_adjustment(body: AdjustRequest) -> None:
+    _validate(body)
+    if body.actualCost < 0:
+        raise HTTPException(status_code=400, detail="actualCost must not be negative")
+    if body.actualCost < body.cost and body.chargedAt is None:
+        raise HTTPException(status_code=400, detail="chargedAt from the check response is required to give units back")
+
+
+if RL_ASYNC:
+
+    @app.post("/rate-limit/adjust", response_model=AdjustResponse)
+    async def adjust_cost(body: AdjustRequest):
+        _validate_adjustment(body)
+        try:
+            policies = await async_policy_resolver.resolve(body)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Policy resolve error: {e}")
+
+        weighted = [p for p in policies if p.limit_unit == COST]
+        delta = body.actualCost - body.cost
+
+        async def adjust():
+            if RL_ENGINE == "memory":
+                memory_rate_limiter.adjust(weighted, delta, body.chargedAt)
+            else:
+                await async_rate_limiter.adjust(weighted, delta, body.chargedAt)
+
+        await _with_breaker_async(adjust, _backend_unavailable)
+        return AdjustResponse(delta=delta, keys=[p.key for p in weighted])
+
+else:
+
+    @app.post("/rate-limit/adjust", response_model=AdjustResponse)
+    def adjust_cost(body: AdjustRequest):
+        _validate_adjustment(body)
+        try:
+            policies = policy_resolver.resolve(body)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Policy resolve error: {e}")
+
+        weighted = [p for p in policies if p.limit_unit == COST]
+        delta = body.actualCost - body.cost
+        engine = memory_rate_limiter if RL_ENGINE == "memory" else rate_limiter
+        _with_breaker(lambda: engine.adjust(weighted, delta, body.chargedAt), _backend_unavailable)
+        return AdjustResponse(delta=delta, keys=[p.key for p in weighted])
+
+
+# Load feedback for adaptive limits, from the services behind them (e.g. a GPU
+# pool reporting p95 latency). Sync in both modes: reports are infrequent, and
+# checks never wait on them.
+@app.post("/rate-limit/feedback", response_model=FeedbackResponse)
+def report_feedback(body: FeedbackRequest):
+    if not body.group:
+        raise HTTPException(status_code=400, detail="group is required")
+    if body.latencyMs is None and body.errorRate is None and body.healthy is None:
+        raise HTTPException(status_code=400, detail="one of latencyMs, errorRate or healthy is required")
+    index = policy_resolver.policy_index
+    if index is not None and index.loaded and body.group not in index.adaptive_groups:
+        raise HTTPException(status_code=404, detail=f"no enabled policy uses adaptive group {body.group!r}")
+    unhealthy = body.healthy is False or adaptive_limits.unhealthy(body.latencyMs, body.errorRate)
+    scale, action = _with_breaker(
+        lambda: adaptive_limits.feedback(body.group, unhealthy), _backend_unavailable
+    )
+    return FeedbackResponse(group=body.group, scale=scale, action=action)
+
+
+# Concurrency (in-flight) limits: /acquire takes a slot on every CONCURRENCY
+# policy of the request and returns a lease id, /release frees it. Leases not
+# released within the policy's window_seconds expire.
+def _validate_lease(lease_id: str) -> None:
+    try:
+        decode_lease(lease_id)
+    except InvalidLease:
+        raise HTTPException(status_code=400, detail="unknown lease id")
+
+
+if RL_ASYNC:
+
+    @app.post("/rate-limit/acquire", response_model=AcquireResponse)
+    async def acquire_concurrency(body: RateLimitRequest, response: Response):
+        _validate(body)
+        try:
+            policies = adaptive_limits.apply(
+                await async_policy_resolver.resolve(body, limit_type=CONCURRENCY)
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Policy resolve error: {e}")
+
+        lease_id, decisions = await _with_breaker_async(
+            lambda: async_concurrency_limiter.acquire(policies), _backend_unavailable
+        )
+        evaluated = _as_evaluated(policies, decisions)
+        metrics.record_decisions(evaluated)
+        result = _build_acquire_response(policies, lease_id, decisions)
+        _audit("acquire", evaluated, result)
+        if result.retryAfterMs is not None:
+            response.headers["Retry-After"] = str(math.ceil(result.retryAfterMs / 1000))
+        return result
+
+    @app.post("/rate-limit/release", response_model=ReleaseResponse)
+    async def release_concurrency(body: ReleaseRequest):
+        _validate_lease(body.leaseId)
+        freed = await _with_breaker_async(
+            lambda: async_concurrency_limiter.release(body.leaseId), _backend_unavailable
+        )
+        return ReleaseResponse(released=freed > 0)
+
+else:
+
+    @app.post("/rate-limit/acquire", response_model=AcquireResponse)
+    def acquire_concurrency(body: RateLimitRequest, response: Response):
+        _validate(body)
+        try:
+            policies = adaptive_limits.apply(policy_resolver.resolve(body, limit_type=CONCURRENCY))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Policy resolve error: {e}")
+
+        lease_id, decisions = _with_breaker(
+            lambda: concurrency_limiter.acquire(policies), _backend_unavailable
+        )
+        evaluated = _as_evaluated(policies, decisions)
+        metrics.record_decisions(evaluated)
+        result = _build_acquire_response(policies, lease_id, decisions)
+        _audit("acquire", evaluated, result)
+        if result.retryAfterMs is not None:
+            response.headers["Retry-After"] = str(math.ceil(result.retryAfterMs / 1000))
+        return result
+
+    @app.post("/rate-limit/release", response_model=ReleaseResponse)
+    def release_concurrency(body: ReleaseRequest):
+        _validate_lease(body.leaseId)
+        freed = _with_breaker(lambda: concurrency_limiter.release(body.leaseId), _backend_unavailable)
+        return ReleaseResponse(released=freed > 0)
+
+
+# Batch check for gateways: identical identities are resolved once and all keys
+# of the batch are evaluated in a single Redis script call (regardless of
+# RL_ENGINE). Requests are applied in order, each all-or-nothing; responses
+# come back in the same order.
+if RL_ASYNC:
+
+    @app.post("/rate-limit/check-batch", response_model=List[RateLimitResponse])
+    async def check_rate_limit_batch(bodies: List[RateLimitRequest]):
+        started = time.perf_counter()
+        _validate_batch(bodies)
+
+        resolved = {}
+        try:
+            for body in bodies:
+                ident = _identity_key(body)
+                if ident not in resolved:
+                    resolve_started = time.perf_counter()
+                    resolved[ident] = await async_policy_resolver.resolve(body)
+                    metrics.RESOLVE_LATENCY.observe(time.perf_counter() - resolve_started)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Policy resolve error: {e}")
+
+        groups = [_effective(resolved[_identity_key(body)], body.cost) for body in bodies]
+        charged_at = int(time.time() * 1000)
+        evaluated = await _evaluate_batch_async(groups)
+        for e in evaluated:
+            metrics.record_decisions(e)
+        responses = [_build_response(e, charged_at) for e in evaluated]
+        for e, result in zip(evaluated, responses):
+            _audit("check_batch", e, result)
+        metrics.CHECK_BATCH.observe(time.perf_counter() - started)
+        return responses
+
+else:
+
+    @app.post("/rate-limit/check-batch", response_model=List[RateLimitResponse])
+    def check_rate_limit_batch(bodies: List[RateLimitRequest]):
+        started = time.perf_counter()
+        _validate_batch(bodies)
+
+        resolved = {}
+        try:
+            for body in bodies:
+                ident = _identity_key(body)
+                if ident not in resolved:
+                    resolve_started = time.perf_counter()
+                    resolved[ident] = policy_resolver.resolve(body)
+                    metrics.RESOLVE_LATENCY.observe(time.perf_counter() - resolve_started)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Policy resolve error: {e}")
+
+        groups = [_effective(resolved[_identity_key(body)], body.cost) for body in bodies]
+        charged_at = int(time.time() * 1000)
+        evaluated = _evaluate_batch(groups)
+        for e in evaluated:
+            metrics.record_decisions(e)
+        responses = [_build_response(e, charged_at) for e in evaluated]
+        for e, result in zip(evaluated, responses):
+            _audit("check_batch", e, result)
+        metrics.CHECK_BATCH.observe(time.perf_counter() - started)
+        return responses
+
+
+# Streaming checks for gateways (see stream_protocol): one WebSocket carries
+# msgpack messages of check frames. Each message is evaluated like a
+# /rate-limit/check-batch (identities resolved once, one Redis call) and
+# answered with one message of result frames. Up to RL_STREAM_MAX_INFLIGHT
+# messages per connection are evaluated concurrently, so answers can arrive
+# in a different order than the messages; callers match them by frame id.
+def _stream_frames(checks, resolved, evaluated, charged_at):
+    """
+    Result frames for `checks`, given resolved[identity], the evaluation of
+    the resolved ones and the epoch ms taken before it.
+    """
+    frames = []
+    results = iter(evaluated)
+    for check in checks:
+        policies = resolved[_identity_key(check)]
+        if isinstance(policies, Exception):
+            frames.append(error_frame(check.id, f"Policy resolve error: {policies}"))
+            continue
+        e = next(results)
+        metrics.record_decisions(e)
+        try:
+            result = _build_response(e, charged_at)
+        except HTTPException as exc:
+            frames.append(error_frame(check.id, exc.detail))
+            continue
+        _audit("stream", e, result)
+        frames.append(result_frame(check.id, result))
+    return frames
+
+
+def _stream_groups(checks, resolved):
+    return [
+        _effective(resolved[_identity_key(c)], c.cost)
+        for c in checks
+        if not isinstance(resolved[_identity_key(c)], Exception)
+    ]
+
+
+def _check_stream_message(checks):
+    resolved = {}
+    for check in checks:
+        ident = _identity_key(check)
+        if ident not in resolved:
+            try:
+                resolved[ident] = policy_resolver.resolve(check)
+            except Exception as e:
+                resolved[ident] = e
+    charged_at = int(time.time() * 1000)
+    evaluated = _evaluate_batch(_stream_groups(checks, resolved))
+    return _stream_frames(checks, resolved, evaluated, charged_at)
+
+
+async def _check_stream_message_async(checks):
+    resolved = {}
+    for check in checks:
+        ident = _identity_key(check)
+        if ident not in resolved:
+            try:
+                resolved[ident] = await async_policy_resolver.resolve(check)
+            except Exception as e:
+                resolved[ident] = e
+    charged_at = int(time.time() * 1000)
+    evaluated = await _evaluate_batch_async(_stream_groups(checks, resolved))
+    return _stream_frames(checks, resolved, evaluated, charged_at)
+
+
+async def _answer_stream_message(message: bytes) -> bytes:
+    started = time.perf_counter()
+    try:
+        checks, frames = decode_checks(message, RL_MAX_BATCH_SIZE)
+    except ValueError as e:
+        return encode_frames([error_frame(None, str(e))])
+    if checks:
+        try:
+            if RL_ASYNC:
+                frames += await _check_stream_message_async(checks)
+            else:
+                frames += await run_in_threadpool(_check_stream_message, checks)
+        except Exception as e:
+            # e.g. a Redis ResponseError: answer every check instead of dropping the message
+            frames += [error_frame(c.id, f"Rate limit evaluation error: {e}") for c in checks]
+    metrics.CHECK_STREAM.observe(time.perf_counter() - started)
+    return encode_frames(frames)
+
+
+@app.websocket("/rate-limit/stream")
+async def stream_checks(websocket: WebSocket):
+    await websocket.accept()
+    inflight = asyncio.Semaphore(RL_STREAM_MAX_INFLIGHT)
+    send_lock = asyncio.Lock()
+    tasks = set()
+
+    async def send(reply: bytes) -> None:
+        async with send_lock:
+            await websocket.send_bytes(reply)
+
+    async def answer(message: bytes) -> None:
+        try:
+            await send(await _answer_stream_message(message))
+        except (WebSocketDisconnect, RuntimeError):
+            pass  # the connection went away mid-evaluation
+        finally:
+            inflight.release()
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is None:
+                await send(encode_frames([error_frame(None, "messages must be binary msgpack")]))
+                continue
+            # Stop reading while the connection has too much in flight (backpressure)
+            await inflight.acquire()
+            task = asyncio.create_task(answer(message["bytes"]))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,364 @@
+# backend/memory_rate_limiter.py
+import math
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence, Tuple
+
+from rate_limiter import SLIDING_COUNTER, Decision
+
+if TYPE_CHECKING:
+    from policy_resolver import EffectiveLimit
+
+
+class _Log:
+    """Sliding log of one key: admission times (monotonic ms) in a ring buffer."""
+
+    __slots__ = ("times", "head", "size", "expires")
+
+    def __init__(self, capacity: int):
+        self.times = array("q", bytes(8 * capacity))
+        self.head = 0
+        self.size = 0
+        self.expires = 0  # monotonic ms after which the log is empty
+
+    def trim(self, cutoff: int) -> None:
+        times, cap = self.times, len(self.times)
+        while self.size and times[self.head] <= cutoff:
+            self.head = (self.head + 1) % cap
+            self.size -= 1
+
+    def at(self, rank: int) -> int:
+        return self.times[(self.head + rank) % len(self.times)]
+
+    def append(self, now: int, limit: int) -> None:
+        cap = len(self.times)
+        if self.size == cap:
+            # Grow on demand (doubling, up to the limit) so a high limit
+            # costs memory only once it is used
+            grown = array("q", (self.at(i) for i in range(self.size)))
+            grown.frombytes(bytes(8 * (max(min(limit, cap * 2), cap + 1) - cap)))
+            self.times, self.head, cap = grown, 0, len(grown)
+        self.times[(self.head + self.size) % cap] = now
+        self.size += 1
+
+
+class _WeightedLog:
+    """Sliding log of a COST policy: (time, units) entries and their running total."""
+
+    __slots__ = ("entries", "total", "expires")
+
+    def __init__(self):
+        self.entries: deque = deque()
+        self.total = 0
+        self.expires = 0
+
+    def trim(self, cutoff: int) -> None:
+        entries = self.entries
+        while entries and entries[0][0] <= cutoff:
+            self.total -= entries.popleft()[1]
+
+    def add(self, now: int, units: int) -> None:
+        self.entries.append((now, units))
+        self.total += units
+
+    def insert(self, at: int, units: int) -> None:
+        """Add an entry at an earlier time, keeping the entries in time order."""
+        entries = self.entries
+        i = len(entries)
+        while i and entries[i - 1][0] > at:
+            i -= 1
+        entries.insert(i, (at, units))
+        self.total += units
+
+    def freed_at(self, need: int) -> int:
+        """Time of the entry after whose expiry `need` units are free (0 if none)."""
+        freed = 0
+        for at, units in self.entries:
+            freed += units
+            if freed >= need:
+                return at
+        return 0
+
+
+class _Counter:
+    """Weighted sliding counter of one key: per-bucket counts in a ring of buckets + 1 slots."""
+
+    __slots__ = ("ids", "counts", "expires")
+
+    def __init__(self, buckets: int):
+        self.ids = array("q", [-1] * (buckets + 1))
+        self.counts = array("q", bytes(8 * (buckets + 1)))
+        self.expires = 0
+
+    def estimate(self, cur: int, buckets: int, weight: float) -> int:
+        total = 0.0
+        for idx, count in zip(self.ids, self.counts):
+            if idx > cur - buckets:
+                total += count
+            elif idx == cur - buckets:
+                total += count * weight
+        return math.floor(total)
+
+    def add(self, cur: int, units: int = 1) -> None:
+        slot = cur % len(self.ids)
+        if self.ids[slot] != cur:
+            self.ids[slot] = cur
+            self.counts[slot] = 0
+        self.counts[slot] += units
+
+
+class _Stripe:
+    __slots__ = ("lock", "windows", "ops", "evictions")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Least recently used first
+        self.windows: "OrderedDict[str, object]" = OrderedDict()
+        self.ops = 0
+        self.evictions = 0
+
+
+class InMemoryRateLimiter:
+    """
+    Redis-free engine with the SlidingWindowRateLimiterTx contract, for
+    single-node deployments, sidecars and tests.
+
+    Sliding logs keep one monotonic-ms timestamp per admitted request in a
+    per-key ring buffer (an int64 array that grows up to the limit);
+    SLIDING_COUNTER policies keep `buckets + 1` counts, and sliding logs of
+    COST policies a deque of (time, units). Keys are spread over
+    `stripes` independently locked dicts. Keys whose window has emptied are
+    evicted every `sweep_every` operations on their stripe, and each stripe
+    holds at most max_keys / stripes keys: past that, an idle key among the
+    `evict_probe` least recently used ones is dropped, or else the least
+    recently used key.
+
+    State is per process: several workers each enforce the full limit.
+    """
+
+    def __init__(
+        self,
+        stripes: int = 64,
+        max_keys: int = 1_000_000,
+        sweep_every: int = 4096,
+        evict_probe: int = 16,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._stripes = [_Stripe() for _ in range(max(1, stripes))]
+        self._stripe_cap = max(1, max_keys // len(self._stripes))
+        self.sweep_every = sweep_every
+        self.evict_probe = max(1, evict_probe)
+        self._clock = clock
+
+    @property
+    def evictions(self) -> int:
+        return sum(s.evictions for s in self._stripes)
+
+    def _stripe_index(self, key: str) -> int:
+        return hash(key) % len(self._stripes)
+
+    def _now(self) -> Tuple[int, int]:
+        """(monotonic ms for window math, wall-clock ms for reported reset times)."""
+        return int(self._clock() * 1000), int(time.time() * 1000)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "watchRetries": 0,
+            "contentionFallbacks": 0,
+            "keys": sum(len(s.windows) for s in self._stripes),
+            "evictions": self.evictions,
+        }
+
+    def check_and_consume(
+        self,
+        key: str,
+        window_seconds: int,
+        limit: int,
+        max_retries: int = 5,
+    ) -> Tuple[bool, int]:
+        """Returns (allowed, current_count_after_operation); never contended."""
+        allowed, count, _ = self.check_and_consume_detailed(key, window_seconds, limit)
+        return allowed, count
+
+    def check_and_consume_detailed(
+        self,
+        key: str,
+        window_seconds: int,
+        limit: int,
+        max_retries: int = 5,
+    ) -> Decision:
+        """Single sliding-log key; skips the multi-policy bookkeeping of _evaluate."""
+        now, wall = self._now()
+        window_ms = window_seconds * 1000
+        stripe = self._stripes[self._stripe_index(key)]
+        with stripe.lock:
+            state = stripe.windows.get(key)
+            if not isinstance(state, _Log):
+                state = stripe.windows[key] = _Log(min(max(limit, 1), 16))
+            stripe.windows.move_to_end(key)
+            decision = self._count_log(state, window_ms, limit, now, wall)
+            if decision.allowed:
+                state.append(now, limit)
+                state.expires = now + window_ms
+                decision = Decision(True, decision.count + 1, decision.reset_ms)
+            self._maybe_sweep(stripe, now)
+        return decision
+
+    def check_and_consume_many(self, limits: Sequence["EffectiveLimit"]) -> List[Decision]:
+        """All policies of one request, all-or-nothing."""
+        return self.check_and_consume_batch([limits])[0]
+
+    def check_and_consume_batch(
+        self, groups: Sequence[Sequence["EffectiveLimit"]]
+    ) -> List[List[Decision]]:
+        """Requests in order, each all-or-nothing (same contract as the script engine)."""
+        return [self._evaluate(limits, consume=True) for limits in groups]
+
+    def peek(self, limits: Sequence["EffectiveLimit"]) -> List[Decision]:
+        """Current usage of each policy without consuming."""
+        return self._evaluate(limits, consume=False)
+
+    def _evaluate(self, limits: Sequence["EffectiveLimit"], consume: bool) -> List[Decision]:
+        if not limits:
+            return []
+        now, wall = self._now()
+        stripes = sorted({self._stripe_index(lim.key) for lim in limits})
+        locks = [self._stripes[i].lock for i in stripes]
+        for lock in locks:  # sorted order, so concurrent multi-key requests cannot deadlock
+            lock.acquire()
+        try:
+            states = [self._state(lim, create=consume) for lim in limits]
+            decisions = [
+                self._count(lim, state, now, wall) for lim, state in zip(limits, states)
+            ]
+            if consume and all(d.allowed for d in decisions):
+                for i, (lim, state) in enumerate(zip(limits, states)):
+                    self._add(lim, state, now, lim.cost)
+                    decisions[i] = decisions[i]._replace(count=decisions[i].count + lim.cost)
+            if consume:
+                for i in stripes:
+                    self._maybe_sweep(self._stripes[i], now)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+        return decisions
+
+    def adjust(
+        self, limits: Sequence["EffectiveLimit"], delta: int, charged_at_ms: Optional[int] = None
+    ) -> None:
+        """
+        Add `delta` units to COST policies after the fact, without an admission
+        check, booked at `charged_at_ms` (epoch ms of the charge, default now)
+        so they expire with the charge; see SlidingWindowRateLimiterTx.adjust.
+        """
+        if not limits or not delta:
+            return
+        now, wall = self._now()
+        at = now if charged_at_ms is None else now - max(0, wall - charged_at_ms)
+        for lim in limits:
+            window_ms = lim.window_seconds * 1000
+            if at <= now - window_ms:
+                continue  # the charge already left the window
+            stripe = self._stripes[self._stripe_index(lim.key)]
+            with stripe.lock:
+                state = self._state(lim, create=True)
+                if isinstance(state, _WeightedLog) and at < now:
+                    state.trim(now - window_ms)
+                    state.insert(at, delta)
+                    state.expires = max(state.expires, at + window_ms)
+                elif isinstance(state, _Counter):
+                    buckets = len(state.ids) - 1
+                    state.add(math.floor(at / (window_ms / buckets)), delta)
+                    state.expires = max(state.expires, at + window_ms + math.ceil(window_ms / buckets))
+                else:
+                    self._add(lim, state, now, delta)
+
+    def _state(self, lim: "EffectiveLimit", create: bool):
+        windows = self._stripes[self._stripe_index(lim.key)].windows
+        state = windows.get(lim.key)
+        if lim.algorithm == SLIDING_COUNTER:
+            kind = _Counter
+        else:
+            kind = _WeightedLog if lim.limit_unit == "COST" else _Log
+        if not isinstance(state, kind):
+            # New key, or its policy switched algorithm or unit: start from empty
+            if kind is _Counter:
+                state = _Counter(max(1, lim.buckets))
+            elif kind is _WeightedLog:
+                state = _WeightedLog()
+            else:
+                state = _Log(min(max(lim.limit, 1), 16))
+            if create:
+                windows[lim.key] = state
+        if create:
+            windows.move_to_end(lim.key)
+        return state
+
+    @staticmethod
+    def _count(lim: "EffectiveLimit", state, now: int, wall: int) -> Decision:
+        window_ms = lim.window_seconds * 1000
+        if isinstance(state, _Counter):
+            buckets = len(state.ids) - 1
+            bucket_ms = window_ms / buckets
+            cur = math.floor(now / bucket_ms)
+            weight = 1 - (now - cur * bucket_ms) / bucket_ms
+            count = max(0, state.estimate(cur, buckets, weight))
+            reset = wall + int((cur + 1) * bucket_ms) - now
+            return Decision(count + lim.cost <= lim.limit, count, reset)
+
+        if isinstance(state, _WeightedLog):
+            state.trim(now - window_ms)
+            count = max(0, state.total)
+            blocking = state.freed_at(max(1, count + lim.cost - lim.limit))
+            reset = wall + blocking + window_ms - now if blocking else 0
+            return Decision(count + lim.cost <= lim.limit, count, reset)
+
+        return InMemoryRateLimiter._count_log(state, window_ms, lim.limit, now, wall)
+
+    @staticmethod
+    def _count_log(state: _Log, window_ms: int, limit: int, now: int, wall: int) -> Decision:
+        state.trim(now - window_ms)
+        count = state.size
+        reset = 0
+        if count:
+            # The entry keeping the key at its limit (the oldest one if under it)
+            blocking = state.at(max(0, count - limit))
+            reset = wall + blocking + window_ms - now
+        return Decision(count < limit, count, reset)
+
+    @staticmethod
+    def _add(lim: "EffectiveLimit", state, now: int, units: int) -> None:
+        window_ms = lim.window_seconds * 1000
+        if isinstance(state, _Counter):
+            buckets = len(state.ids) - 1
+            state.add(math.floor(now / (window_ms / buckets)), units)
+            # The oldest bucket still counts (weighted) for one more bucket
+            state.expires = now + window_ms + math.ceil(window_ms / buckets)
+        elif isinstance(state, _WeightedLog):
+            state.add(now, units)
+            state.expires = now + window_ms
+        else:
+            state.append(now, lim.limit)
+            state.expires = now + window_ms
+
+    def _maybe_sweep(self, stripe: _Stripe, now: int) -> None:
+        windows = stripe.windows
+        # Over the cap: drop an idle key if one of the least recently used is,
+        # else the least recently used one, so busy keys keep their windows
+        while len(windows) > self._stripe_cap:
+            victim = next(
+                (k for k in islice(windows, self.evict_probe) if windows[k].expires <= now),
+                next(iter(windows)),
+            )
+            del windows[victim]
+            stripe.evictions += 1
+        stripe.ops += 1
+        if stripe.ops >= self.sweep_every:
+            stripe.ops = 0
+            idle = [k for k, state in windows.items() if state.expires <= now]
+            for k in idle:
+                del windows[k]
+            stripe.evictions += len(idle)
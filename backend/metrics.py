@@ -0,0 +1,215 @@
+# backend/metrics.py
+from typing import Callable, Dict, Iterable, Optional
+
+from prometheus_client import CollectorRegistry, Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from policy_resolver import SCOPE_PRECEDENCE
+
+# Own registry, so /metrics shows only what this service defines
+REGISTRY = CollectorRegistry()
+
+# Sub-millisecond (cached resolve, single script call) up to the multi-second tail
+_LATENCY_BUCKETS = (
+    0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+CHECK_LATENCY = Histogram(
+    "rl_check_duration_seconds",
+    "Total time to answer a rate-limit check (batch, stream: the whole batch or message)",
+    ["endpoint"],
+    buckets=_LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+RESOLVE_LATENCY = Histogram(
+    "rl_policy_resolve_duration_seconds",
+    "Time to resolve the applicable policies of a request",
+    buckets=_LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+REDIS_EVAL_LATENCY = Histogram(
+    "rl_redis_eval_duration_seconds",
+    "Time spent evaluating policies in Redis",
+    ["engine"],
+    buckets=_LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+DECISIONS = Counter(
+    "rl_policy_decisions",
+    "Per-policy outcomes of rate-limit checks",
+    ["scope", "outcome"],
+    registry=REGISTRY,
+)
+WATCH_RETRIES = Histogram(
+    "rl_watch_retries_per_check",
+    "WatchError retries per WATCH/MULTI/EXEC check (max_retries = contention fallback)",
+    buckets=(0, 1, 2, 3, 4, 5),
+    registry=REGISTRY,
+)
+
+# Pre-bound children: the request path never builds label dicts
+CHECK = CHECK_LATENCY.labels("check")
+CHECK_BATCH = CHECK_LATENCY.labels("check_batch")
+CHECK_STREAM = CHECK_LATENCY.labels("stream")
+_DECISIONS_BY_SCOPE = {
+    (scope, allowed): DECISIONS.labels(scope, "allowed" if allowed else "denied")
+    for scope in SCOPE_PRECEDENCE
+    for allowed in (True, False)
+}
+
+
+def redis_eval_timer(engine: str):
+    """Pre-bound Redis evaluation histogram for one engine mode."""
+    return REDIS_EVAL_LATENCY.labels(engine)
+
+
+def record_decisions(evaluated: Iterable[dict]) -> None:
+    """Count each evaluated policy ({policy, allowed, count}) by scope and outcome."""
+    for e in evaluated:
+        child = _DECISIONS_BY_SCOPE.get((e["policy"].scope, e["allowed"]))
+        if child is not None:
+            child.inc()
+
+
+class StatsCollector:
+    """
+    Exposes counters the components already keep (identity cache, DB pool,
+    engine contention, Redis circuit breaker, blocked-key cache, audit log,
+    adaptive limits) at scrape time, so they add nothing to the request path.
+    """
+
+    def __init__(
+        self,
+        identity_cache=None,
+        pool_stats: Optional[Callable[[], Dict]] = None,
+        engine_stats: Optional[Dict[str, Callable[[], Dict[str, int]]]] = None,
+        breaker=None,
+        local_limiter=None,
+        blocked_cache=None,
+        audit_log=None,
+        adaptive_limits=None,
+    ):
+        self.identity_cache = identity_cache
+        self.pool_stats = pool_stats
+        self.engine_stats = engine_stats or {}
+        self.breaker = breaker
+        self.local_limiter = local_limiter
+        self.blocked_cache = blocked_cache
+        self.audit_log = audit_log
+        self.adaptive_limits = adaptive_limits
+
+    def collect(self):
+        cache = self.identity_cache
+        if cache is not None:
+            hits, misses = cache.hits, cache.misses
+            yield CounterMetricFamily(
+                "rl_identity_cache_hits", "Identity cache hits", value=hits
+            )
+            yield CounterMetricFamily(
+                "rl_identity_cache_misses", "Identity cache misses", value=misses
+            )
+            yield GaugeMetricFamily(
+                "rl_identity_cache_hit_ratio",
+                "Identity cache hits / lookups since start",
+                value=hits / (hits + misses) if hits + misses else 0.0,
+            )
+            yield GaugeMetricFamily(
+                "rl_identity_cache_entries", "Entries in the identity cache", value=len(cache)
+            )
+
+        if self.pool_stats is not None:
+            stats = self.pool_stats()
+            connections = GaugeMetricFamily(
+                "rl_db_pool_connections", "Postgres pool connections by state", labels=["state"]
+            )
+            connections.add_metric(["in_use"], stats["inUse"])
+            connections.add_metric(["idle"], stats["idle"])
+            yield connections
+            yield GaugeMetricFamily("rl_db_pool_max_size", "Postgres pool max size", value=stats["maxSize"])
+            yield GaugeMetricFamily(
+                "rl_db_pool_waiting", "Threads waiting for a Postgres connection", value=stats["waiting"]
+            )
+            yield GaugeMetricFamily(
+                "rl_db_pool_saturation", "Postgres pool in-use / max size", value=stats["saturation"]
+            )
+            yield CounterMetricFamily(
+                "rl_db_pool_timeouts", "Postgres pool acquire timeouts", value=stats["timeouts"]
+            )
+            yield CounterMetricFamily(
+                "rl_db_pool_reconnects", "Broken Postgres connections replaced", value=stats["reconnects"]
+            )
+
+        if self.engine_stats:
+            retries = CounterMetricFamily(
+                "rl_watch_retries", "WatchError retries", labels=["engine"]
+            )
+            fallbacks = CounterMetricFamily(
+                "rl_contention_fallbacks",
+                "Checks rejected with (False, -1) after exhausting WATCH retries",
+                labels=["engine"],
+            )
+            for name, stats_fn in self.engine_stats.items():
+                stats = stats_fn()
+                retries.add_metric([name], stats["watchRetries"])
+                fallbacks.add_metric([name], stats["contentionFallbacks"])
+            yield retries
+            yield fallbacks
+
+        if self.breaker is not None:
+            stats = self.breaker.stats()
+            yield GaugeMetricFamily(
+                "rl_redis_breaker_open",
+                "1 while the Redis circuit breaker is open or probing",
+                value=0 if stats["state"] == "closed" else 1,
+            )
+            yield CounterMetricFamily(
+                "rl_redis_breaker_trips", "Times the Redis circuit breaker opened", value=stats["trips"]
+            )
+        if self.local_limiter is not None:
+            yield CounterMetricFamily(
+                "rl_degraded_checks",
+                "Checks answered by the local limiter while Redis was unavailable",
+                value=self.local_limiter.checks,
+            )
+        if self.blocked_cache is not None:
+            yield CounterMetricFamily(
+                "rl_blocked_cache_hits",
+                "Policy lookups answered as blocked from the negative cache",
+                value=self.blocked_cache.hits,
+            )
+            yield GaugeMetricFamily(
+                "rl_blocked_cache_entries", "Policy keys cached as blocked", value=len(self.blocked_cache)
+            )
+        if self.audit_log is not None:
+            stats = self.audit_log.stats()
+            yield CounterMetricFamily(
+                "rl_audit_records", "Decisions written to the audit log", value=stats["records"]
+            )
+            yield CounterMetricFamily(
+                "rl_audit_dropped",
+                "Decisions dropped because the audit queue was full",
+                value=stats["dropped"],
+            )
+            yield CounterMetricFamily(
+                "rl_audit_write_errors", "Audit batches lost to write errors", value=stats["writeErrors"]
+            )
+            yield GaugeMetricFamily(
+                "rl_audit_queue_depth", "Decisions waiting to be written", value=stats["queued"]
+            )
+        if self.adaptive_limits is not None:
+            scales = GaugeMetricFamily(
+                "rl_adaptive_limit_scale",
+                "Fraction of the configured limits enforced for an adaptive group",
+                labels=["group"],
+            )
+            for group, scale in self.adaptive_limits.scales().items():
+                scales.add_metric([group], scale)
+            yield scales
+            adjustments = CounterMetricFamily(
+                "rl_adaptive_adjustments",
+                "Adaptive scale changes made by this node's feedback reports",
+                labels=["direction"],
+            )
+            adjustments.add_metric(["decrease"], self.adaptive_limits.decreases)
+            adjustments.add_metric(["increase"], self.adaptive_limits.increases)
+            yield adjustments
@@ -0,0 +1,37 @@
+-- 003_policy_resolve_indexes.sql
+
+-- Indexes matching the shape of the PolicyResolver prepared statements
+-- (rl_resolve / rl_policies): identity lookups by name, then one probe per
+-- policy scope restricted to enabled rows.
+
+-- 1) Identity lookups
+
+CREATE INDEX IF NOT EXISTS idx_tenant_name
+  ON tenant(name);
+
+CREATE INDEX IF NOT EXISTS idx_user_account_tenant_external
+  ON user_account(tenant_id, external_id);
+
+CREATE INDEX IF NOT EXISTS idx_api_key_hash_active
+  ON api_key(key_hash) WHERE revoked = FALSE;
+
+
+-- 2) Policy matching (one partial index per scope predicate)
+
+CREATE INDEX IF NOT EXISTS idx_rlp_global_enabled
+  ON rate_limit_policy(scope) WHERE enabled AND scope = 'GLOBAL';
+
+CREATE INDEX IF NOT EXISTS idx_rlp_tenant_enabled
+  ON rate_limit_policy(scope, tenant_id) WHERE enabled;
+
+CREATE INDEX IF NOT EXISTS idx_rlp_apikey_enabled
+  ON rate_limit_policy(scope, api_key_id) WHERE enabled;
+
+CREATE INDEX IF NOT EXISTS idx_rlp_model_enabled
+  ON rate_limit_policy(scope, model_id) WHERE enabled;
+
+CREATE INDEX IF NOT EXISTS idx_rlp_model_tier_enabled
+  ON rate_limit_policy(scope, model_tier_id) WHERE enabled;
+
+CREATE INDEX IF NOT EXISTS idx_rlp_user_model_enabled
+  ON rate_limit_policy(scope, user_id, model_id) WHERE enabled;
@@ -0,0 +1,35 @@
+-- 004_policy_algorithm.sql
+
+-- Per-policy rate limiting algorithm:
+--   SLIDING_LOG     exact sliding window log (one ZSET member per request)
+--   SLIDING_COUNTER weighted sliding window counter (constant memory/time,
+--                   approximate); counter_buckets splits the window into that
+--                   many sub-buckets (NULL or 1 = previous/current window)
+
+ALTER TABLE rate_limit_policy
+  ADD COLUMN IF NOT EXISTS algorithm VARCHAR(20) NOT NULL DEFAULT 'SLIDING_LOG';
+
+ALTER TABLE rate_limit_policy
+  ADD COLUMN IF NOT EXISTS counter_buckets SMALLINT;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'rate_limit_policy_algorithm_check'
+    ) THEN
+        ALTER TABLE rate_limit_policy
+          ADD CONSTRAINT rate_limit_policy_algorithm_check
+          CHECK (algorithm IN ('SLIDING_LOG', 'SLIDING_COUNTER'));
+    END IF;
+END$$;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'rate_limit_policy_counter_buckets_check'
+    ) THEN
+        ALTER TABLE rate_limit_policy
+          ADD CONSTRAINT rate_limit_policy_counter_buckets_check
+          CHECK (counter_buckets IS NULL OR counter_buckets BETWEEN 1 AND 600);
+    END IF;
+END$$;
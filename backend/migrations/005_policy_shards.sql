@@ -0,0 +1,20 @@
+-- 005_policy_shards.sql
+
+-- Sharded counters: stripe a policy's window over `shards` Redis keys
+-- (rl:global:s0 .. rl:global:s{n-1}). Writes go to one shard picked by
+-- hashing, reads sum all shards, so a high-fan-in key such as GLOBAL is
+-- spread across Redis shards/cores. NULL or 1 = a single key.
+
+ALTER TABLE rate_limit_policy
+  ADD COLUMN IF NOT EXISTS shards SMALLINT;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'rate_limit_policy_shards_check'
+    ) THEN
+        ALTER TABLE rate_limit_policy
+          ADD CONSTRAINT rate_limit_policy_shards_check
+          CHECK (shards IS NULL OR shards BETWEEN 1 AND 256);
+    END IF;
+END$$;
@@ -0,0 +1,25 @@
+-- 006_policy_updated_at.sql
+
+-- Change tracking for the in-memory policy index: `updated_at` is set on
+-- every insert/update, so the API can refresh incrementally by polling
+-- rows changed since its last refresh. Disabling a policy is an update;
+-- hard deletes are detected by the refresher comparing row count and id
+-- sum with its snapshot.
+
+ALTER TABLE rate_limit_policy
+  ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT NOW();
+
+CREATE OR REPLACE FUNCTION rate_limit_policy_touch() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS rate_limit_policy_touch ON rate_limit_policy;
+CREATE TRIGGER rate_limit_policy_touch
+  BEFORE UPDATE ON rate_limit_policy
+  FOR EACH ROW EXECUTE FUNCTION rate_limit_policy_touch();
+
+CREATE INDEX IF NOT EXISTS idx_rlp_updated_at
+  ON rate_limit_policy(updated_at);
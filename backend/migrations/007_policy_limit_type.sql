@@ -0,0 +1,22 @@
+-- 007_policy_limit_type.sql
+
+-- Policy type:
+--   RATE        requests per sliding window (POST /rate-limit/check)
+--   CONCURRENCY requests in flight (POST /rate-limit/acquire + /release);
+--               limit_value is the number of concurrent leases and
+--               window_seconds the lease timeout after which a slot held
+--               by a caller that never released it is reclaimed
+
+ALTER TABLE rate_limit_policy
+  ADD COLUMN IF NOT EXISTS limit_type VARCHAR(20) NOT NULL DEFAULT 'RATE';
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'rate_limit_policy_limit_type_check'
+    ) THEN
+        ALTER TABLE rate_limit_policy
+          ADD CONSTRAINT rate_limit_policy_limit_type_check
+          CHECK (limit_type IN ('RATE', 'CONCURRENCY'));
+    END IF;
+END$$;
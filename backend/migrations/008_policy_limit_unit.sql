@@ -0,0 +1,21 @@
+-- 008_policy_limit_unit.sql
+
+-- Units of a RATE policy's limit_value:
+--   REQUESTS every admitted request counts 1
+--   COST     every admitted request counts its `cost` (e.g. estimated
+--            tokens); POST /rate-limit/adjust corrects it with the actual cost
+-- CONCURRENCY policies always count leases.
+
+ALTER TABLE rate_limit_policy
+  ADD COLUMN IF NOT EXISTS limit_unit VARCHAR(20) NOT NULL DEFAULT 'REQUESTS';
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'rate_limit_policy_limit_unit_check'
+    ) THEN
+        ALTER TABLE rate_limit_policy
+          ADD CONSTRAINT rate_limit_policy_limit_unit_check
+          CHECK (limit_unit IN ('REQUESTS', 'COST'));
+    END IF;
+END$$;
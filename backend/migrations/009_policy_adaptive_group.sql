@@ -0,0 +1,9 @@
+-- 009_policy_adaptive_group.sql
+
+-- Policies with an adaptive_group are enforced at a fraction of limit_value
+-- that shrinks while the group's backend reports high latency or errors
+-- (POST /rate-limit/feedback) and grows back while it is healthy. Policies
+-- sharing a backend (e.g. a GPU pool) share a group. NULL = static limit.
+
+ALTER TABLE rate_limit_policy
+  ADD COLUMN IF NOT EXISTS adaptive_group VARCHAR(100);
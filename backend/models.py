@@ -8,6 +8,7 @@ class RateLimitRequest(BaseModel):
     tenantId: str | None = None
     apiKey: str | None = None
     modelTier: str | None = None  # e.g. "premium", "standard", "free"
+    cost: int = 1  # units charged to COST policies, e.g. estimated tokens
 
 
 # New: per-policy result returned when request is accepted
@@ -17,6 +18,7 @@ class PolicyResult(BaseModel):
     limit: int
     count: int
     windowSeconds: int
+    configuredLimit: Optional[int] = None  # static limit while `limit` is adaptively reduced
 
 
 class RateLimitResponse(BaseModel):
@@ -27,3 +29,91 @@ class RateLimitResponse(BaseModel):
     cause: Optional[str] = None
     # If accepted, include all policies that were successfully fulfilled
     fulfilled: Optional[List[PolicyResult]] = None
+    # Epoch ms when the reported policy frees capacity again; when rejected,
+    # retryAfterMs is the wait until every failing policy has room
+    retryAfterMs: Optional[int] = None
+    resetAt: Optional[int] = None
+    # Static limit of the reported policy while `limit` is adaptively reduced
+    configuredLimit: Optional[int] = None
+    # Epoch ms at which COST policies were charged; pass it to /rate-limit/adjust
+    chargedAt: Optional[int] = None
+
+
+# Read-only view of one policy (POST /rate-limit/peek)
+class PolicyStatus(BaseModel):
+    label: str
+    key: str
+    limit: int
+    count: int
+    remaining: int
+    windowSeconds: int
+    resetAt: Optional[int] = None
+
+
+class PeekResponse(BaseModel):
+    allowed: bool  # whether a check right now would be admitted
+    retryAfterMs: Optional[int] = None
+    policies: List[PolicyStatus]
+
+
+# In-flight leases for CONCURRENCY policies (POST /rate-limit/acquire, /release)
+class AcquireResponse(BaseModel):
+    allowed: bool
+    leaseId: Optional[str] = None  # pass to /rate-limit/release when done
+    expiresAt: Optional[int] = None  # epoch ms after which the slots are reclaimed anyway
+    cause: Optional[str] = None
+    retryAfterMs: Optional[int] = None
+    policies: List[PolicyStatus] = []
+
+
+class ReleaseRequest(BaseModel):
+    leaseId: str
+
+
+class ReleaseResponse(BaseModel):
+    released: bool  # False if the lease had already expired
+
+
+# Post-hoc correction of a checked request's cost (POST /rate-limit/adjust):
+# `cost` is what /check charged, `actualCost` what the request really used and
+# `chargedAt` the check response's chargedAt (required to give units back)
+class AdjustRequest(RateLimitRequest):
+    actualCost: int
+    chargedAt: Optional[int] = None
+
+
+class AdjustResponse(BaseModel):
+    delta: int  # units added to each COST policy (negative = refunded)
+    keys: List[str]  # COST policy keys that were adjusted
+
+
+# POST /rate-limit/feedback: load signal of an adaptive group, reported by the
+# service behind it; latencyMs / errorRate are compared with the thresholds,
+# healthy=false forces a decrease
+class FeedbackRequest(BaseModel):
+    group: str
+    latencyMs: Optional[float] = None
+    errorRate: Optional[float] = None
+    healthy: Optional[bool] = None
+
+
+class FeedbackResponse(BaseModel):
+    group: str
+    scale: float  # fraction of the configured limits now enforced
+    action: str  # "decreased", "increased" or "unchanged"
+
+
+# POST /admin/diagnostics: fields left out keep their current value
+class DiagnosticsSettings(BaseModel):
+    serverTiming: Optional[bool] = None
+    profileSlowMs: Optional[float] = None
+    profileEvery: Optional[int] = None
+
+
+# Admin: drop cached name -> id lookups after identities change
+class IdentityCacheInvalidation(BaseModel):
+    tenantId: Optional[str] = None
+    apiKey: Optional[str] = None
+    modelId: Optional[str] = None
+    modelTier: Optional[str] = None
+    all: bool = False
@@ -0,0 +1,217 @@
+# backend/policy_index.py
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, FrozenSet, List, Optional
+
+
+def _target(row: dict) -> Optional[tuple]:
+    """Index key of a policy row (scope, target ids), or None if it can never match."""
+    scope = row["scope"]
+    if scope == "GLOBAL":
+        ids: tuple = ()
+    elif scope == "TENANT":
+        ids = (row["tenant_id"],)
+    elif scope == "API_KEY":
+        ids = (row["api_key_id"],)
+    elif scope == "MODEL":
+        ids = (row["model_id"],)
+    elif scope == "MODEL_TIER":
+        ids = (row["model_tier_id"],)
+    elif scope == "USER_MODEL":
+        ids = (row["user_id"], row["model_id"])
+    else:
+        return None
+    # NULL target ids never match in SQL either
+    return None if None in ids else (scope, *ids)
+
+
+class PolicyIndex:
+    """
+    In-memory snapshot of the enabled rate_limit_policy rows, indexed by
+    scope and target id, so a request's policies are a few dict lookups
+    instead of a query. Matches POLICIES_SQL: same predicates, same order
+    (SCOPE_PRECEDENCE, then policy id).
+
+    Readers take the current index without locking; writers rebuild it and
+    swap the reference.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows: Dict[int, dict] = {}
+        self._index: Optional[Dict[tuple, List[dict]]] = None
+        self.id_sum = 0
+        self.adaptive_groups: FrozenSet[str] = frozenset()
+        self.watermark: Optional[datetime] = None  # newest updated_at seen
+
+    @property
+    def loaded(self) -> bool:
+        return self._index is not None
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def replace(self, rows: List[dict]) -> None:
+        """Load a full snapshot (enabled rows only)."""
+        with self._lock:
+            self._rows = {r["id"]: r for r in rows}
+            self.watermark = None
+            self._rebuild(rows)
+
+    def apply(self, rows: List[dict]) -> int:
+        """Apply changed rows (any `enabled`); returns how many changed the index."""
+        with self._lock:
+            changed = 0
+            for r in rows:
+                old = self._rows.get(r["id"])
+                if r["enabled"]:
+                    if old != r:
+                        self._rows[r["id"]] = r
+                        changed += 1
+                elif old is not None:
+                    del self._rows[r["id"]]
+                    changed += 1
+            if changed:
+                self._rebuild(rows)
+            else:
+                self._advance_watermark(rows)
+            return changed
+
+    def _advance_watermark(self, rows: List[dict]) -> None:
+        stamps = [r["updated_at"] for r in rows if r.get("updated_at") is not None]
+        if stamps and (self.watermark is None or max(stamps) > self.watermark):
+            self.watermark = max(stamps)
+
+    def _rebuild(self, rows: List[dict]) -> None:
+        index: Dict[tuple, List[dict]] = {}
+        for r in sorted(self._rows.values(), key=lambda r: r["id"]):
+            target = _target(r)
+            if target is not None:
+                index.setdefault(target, []).append(r)
+        self.id_sum = sum(self._rows)
+        self.adaptive_groups = frozenset(
+            r["adaptive_group"] for r in self._rows.values() if r.get("adaptive_group")
+        )
+        self._advance_watermark(rows)
+        self._index = index
+
+    def policies(
+        self,
+        tenant_id: Optional[int],
+        user_id: Optional[int],
+        api_key_id: Optional[int],
+        model_id: Optional[int],
+        model_tier_id: Optional[int],
+    ) -> List[dict]:
+        """Enabled policies for these ids, most specific scope first."""
+        index = self._index or {}
+        # In SCOPE_PRECEDENCE order; rows under one probe are sorted by id
+        probes = (
+            ("USER_MODEL", user_id, model_id),
+            ("API_KEY", api_key_id),
+            ("TENANT", tenant_id),
+            ("MODEL", model_id),
+            ("MODEL_TIER", model_tier_id),
+            ("GLOBAL",),
+        )
+        matched: List[dict] = []
+        for probe in probes:
+            rows = index.get(probe)
+            if rows:
+                matched.extend(rows)
+        return matched
+
+
+class PolicyIndexRefresher:
+    """
+    Keeps a PolicyIndex in step with Postgres from a daemon thread.
+
+    Every `interval` seconds it applies the rows whose updated_at is at or
+    after the index watermark (minus `overlap_seconds`, for transactions
+    that commit after later ones), then compares the enabled row count and
+    id sum with the index to catch hard deletes; a mismatch, or every
+    `full_reload_seconds`, reloads the whole table. A failed refresh keeps
+    serving the previous snapshot.
+
+    `loader` provides load_policy_snapshot() and
+    load_policy_changes(since) -> (rows, enabled_count, id_sum), e.g. a
+    PolicyResolver.
+    """
+
+    def __init__(
+        self,
+        index: PolicyIndex,
+        loader,
+        interval: float = 2.0,
+        full_reload_seconds: float = 300.0,
+        overlap_seconds: float = 10.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.index = index
+        self.loader = loader
+        self.interval = interval
+        self.full_reload_seconds = full_reload_seconds
+        self.overlap = timedelta(seconds=overlap_seconds)
+        self._clock = clock
+        self._last_full: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.refreshes = 0
+        self.full_reloads = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+
+    def refresh(self) -> None:
+        now = self._clock()
+        if (
+            not self.index.loaded
+            or self._last_full is None
+            or now - self._last_full >= self.full_reload_seconds
+        ):
+            self._full_reload(now)
+            return
+        watermark = self.index.watermark
+        since = watermark - self.overlap if watermark is not None else datetime(1970, 1, 1)
+        rows, enabled_count, id_sum = self.loader.load_policy_changes(since)
+        self.index.apply(rows)
+        self.refreshes += 1
+        if (enabled_count, id_sum) != (len(self.index), self.index.id_sum):
+            self._full_reload(now)
+
+    def _full_reload(self, now: float) -> None:
+        self.index.replace(self.loader.load_policy_snapshot())
+        self._last_full = now
+        self.full_reloads += 1
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+                self.last_error = None
+            except Exception as e:  # keep the last good snapshot; retry next tick
+                self.errors += 1
+                self.last_error = str(e)
+            self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="policy-index-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "loaded": self.index.loaded,
+            "policies": len(self.index),
+            "refreshes": self.refreshes,
+            "fullReloads": self.full_reloads,
+            "errors": self.errors,
+            "lastError": self.last_error,
+        }
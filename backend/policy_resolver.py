@@ -1,11 +1,24 @@
 # backend/policy_resolver.py
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from typing import List, Optional
 
 import psycopg2
+import psycopg2.extensions
 from psycopg2.extras import RealDictCursor
 
+from db_pool import PgConnectionPool
 from models import RateLimitRequest
+import request_timing
+from ttl_cache import MISSING, TTLCache
+
+
+# Policy types (rate_limit_policy.limit_type)
+RATE = "RATE"                # requests per sliding window (/rate-limit/check)
+CONCURRENCY = "CONCURRENCY"  # requests in flight (/rate-limit/acquire, window = lease timeout)
+
+# Units a policy's limit is expressed in (rate_limit_policy.limit_unit)
+REQUESTS = "REQUESTS"  # every admitted request counts 1
+COST = "COST"          # requests count their cost (RateLimitRequest.cost, e.g. tokens)
 
 
 @dataclass
@@ -15,6 +28,21 @@ class EffectiveLimit:
     limit: int
     label: str
     scope: str  # original policy scope (e.g. 'USER_MODEL', 'MODEL_TIER', ...)
+    algorithm: str = "SLIDING_LOG"  # or 'SLIDING_COUNTER'
+    buckets: int = 1  # sub-buckets per window (SLIDING_COUNTER only)
+    shards: int = 1  # sub-keys the window is striped over (see rate_limiter.shard_keys)
+    limit_type: str = RATE  # or CONCURRENCY
+    limit_unit: str = REQUESTS  # or COST
+    cost: int = 1  # units this request consumes (see with_cost; always 1 for REQUESTS)
+    adaptive_group: Optional[str] = None  # AIMD feedback group (see adaptive_limits)
+    configured_limit: Optional[int] = None  # limit_value while `limit` is scaled down adaptively
+
+
+def with_cost(limits: List[EffectiveLimit], cost: int) -> List[EffectiveLimit]:
+    """The request's limits with `cost` applied to its COST policies (copies; cached limits are shared)."""
+    if cost == 1:
+        return limits
+    return [replace(lim, cost=cost) if lim.limit_unit == COST else lim for lim in limits]
 
 
 # Scope precedence (higher = more specific)
@@ -28,9 +56,138 @@ SCOPE_PRECEDENCE = {
 }
 
 
-class PolicyResolver:
+# rate_limit_policy columns the service reads, plus the joined tier name.
+# Listed explicitly so new columns do not silently widen every row fetched.
+_POLICY_COLUMNS = """
+    p.id, p.scope, p.tenant_id, p.user_id, p.api_key_id, p.model_id,
+    p.model_tier_id, p.window_seconds, p.limit_value, p.enabled,
+    p.algorithm, p.counter_buckets, p.shards, p.limit_type, p.limit_unit,
+    p.adaptive_group, p.updated_at,
+    mt.name AS tier_name
+"""
+
+# Shared by the prepared statements below; `ctx` supplies the resolved ids.
+_POLICY_SELECT = f"""
+    {_POLICY_COLUMNS},
+    CASE p.scope
+      WHEN 'USER_MODEL' THEN 6
+      WHEN 'API_KEY'    THEN 5
+      WHEN 'TENANT'     THEN 4
+      WHEN 'MODEL'      THEN 3
+      WHEN 'MODEL_TIER' THEN 2
+      WHEN 'GLOBAL'     THEN 1
+      ELSE 0
+    END AS precedence
+"""
+
+_POLICY_MATCH = """
+    p.enabled = TRUE
+    AND (
+          p.scope = 'GLOBAL'
+       OR (p.scope = 'TENANT'     AND p.tenant_id     = ctx.tenant_id)
+       OR (p.scope = 'API_KEY'    AND p.api_key_id    = ctx.api_key_id)
+       OR (p.scope = 'MODEL'      AND p.model_id      = ctx.model_id)
+       OR (p.scope = 'MODEL_TIER' AND p.model_tier_id = ctx.model_tier_id)
+       OR (p.scope = 'USER_MODEL' AND p.user_id       = ctx.user_id AND p.model_id = ctx.model_id)
+    )
+"""
+
+# Policies for already-resolved ids:
+# $1 tenant_id, $2 user_id, $3 api_key_id, $4 model_id, $5 model_tier_id
+POLICIES_SQL = f"""
+        WITH ctx AS (
+          SELECT $1::int AS tenant_id, $2::int AS user_id, $3::int AS api_key_id,
+                 $4::int AS model_id, $5::int AS model_tier_id
+        )
+        SELECT {_POLICY_SELECT}
+        FROM ctx
+        JOIN rate_limit_policy p ON {_POLICY_MATCH}
+        LEFT JOIN model_tier mt ON mt.id = p.model_tier_id
+        ORDER BY precedence DESC, p.id ASC
+"""
+
+# Identities and policies in one round trip. Always returns at least one
+# row (LEFT JOIN) so the resolved ids come back even when nothing matches.
+# $1 tenant.name, $2 user_account.external_id, $3 api_key.key_hash,
+# $4 model.name, $5 model_tier.name (explicit override)
+RESOLVE_SQL = f"""
+        WITH ids AS (
+          SELECT
+            t.id AS tenant_id,
+            (SELECT ua.id FROM user_account ua
+              WHERE ua.tenant_id = t.id AND ua.external_id = $2
+              LIMIT 1) AS user_id,
+            (SELECT k.id FROM api_key k
+              WHERE k.key_hash = $3 AND k.revoked = FALSE
+              LIMIT 1) AS api_key_id,
+            m.id AS model_id,
+            m.tier_id AS model_default_tier_id,
+            (SELECT x.id FROM model_tier x WHERE x.name = $5 LIMIT 1) AS explicit_tier_id
+          FROM (SELECT 1) AS one
+          LEFT JOIN LATERAL (SELECT id FROM tenant WHERE name = $1 LIMIT 1) t ON TRUE
+          LEFT JOIN LATERAL (SELECT id, tier_id FROM model WHERE name = $4 LIMIT 1) m ON TRUE
+        ),
+        ctx AS (
+          SELECT ids.*,
+                 COALESCE(ids.explicit_tier_id, ids.model_default_tier_id) AS model_tier_id
+          FROM ids
+        )
+        SELECT ctx.tenant_id             AS ctx_tenant_id,
+               ctx.user_id               AS ctx_user_id,
+               ctx.api_key_id            AS ctx_api_key_id,
+               ctx.model_id              AS ctx_model_id,
+               ctx.model_default_tier_id AS ctx_model_default_tier_id,
+               ctx.explicit_tier_id      AS ctx_explicit_tier_id,
+               {_POLICY_SELECT}
+        FROM ctx
+        LEFT JOIN rate_limit_policy p
+          ON {_POLICY_MATCH}
+        LEFT JOIN model_tier mt ON mt.id = p.model_tier_id
+        ORDER BY precedence DESC, p.id ASC
+"""
+
+# Policy index (policy_index.PolicyIndex): every enabled policy, and the rows
+# changed since a timestamp (including disabled ones, which leave the index)
+# with the enabled row count and id sum, so deleted rows can be noticed.
+POLICY_SNAPSHOT_SQL = f"""
+        SELECT {_POLICY_COLUMNS}
+        FROM rate_limit_policy p
+        LEFT JOIN model_tier mt ON mt.id = p.model_tier_id
+        WHERE p.enabled = TRUE
+"""
+
+POLICY_CHANGES_SQL = f"""
+        SELECT {_POLICY_COLUMNS}
+        FROM rate_limit_policy p
+        LEFT JOIN model_tier mt ON mt.id = p.model_tier_id
+        WHERE p.updated_at >= %s
+"""
+
+POLICY_TOTALS_SQL = """
+        SELECT count(*) AS enabled_count, COALESCE(sum(id), 0) AS id_sum
+        FROM rate_limit_policy
+        WHERE enabled = TRUE
+"""
+
+# name -> (param types, statement), used with PREPARE / EXECUTE
+_PREPARED_STATEMENTS = {
+    "rl_policies": ("(int, int, int, int, int)", POLICIES_SQL),
+    "rl_resolve": ("(text, text, text, text, text)", RESOLVE_SQL),
+}
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that remembers which statements it has PREPAREd."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared: set = set()
+
+
+class BasePolicyResolver:
     """
-    DB-backed PolicyResolver using Postgres.
+    Storage-independent part of policy resolution, shared by the sync
+    PolicyResolver and the asyncio AsyncPolicyResolver.
 
     Mapping assumptions:
     - body.tenantId   = tenant.name
@@ -38,173 +195,176 @@ class PolicyResolver:
     - body.apiKey     = api_key.key_hash
     - body.modelId    = model.name
     - body.modelTier  = model_tier.name (optional hint; tier can also be derived from model)
+
+    Name -> id lookups go through `identity_cache` (LRU + TTL, including
+    negative entries for unknown names). Call the `invalidate_*` hooks when
+    identities change so the cache does not serve stale ids.
+
+    Set `hash_tags` when the limiter runs on Redis Cluster: keys become
+    `rl:{tenant:1}` instead of `rl:tenant:1`.
+
+    Set `policy_index` (a policy_index.PolicyIndex) to match policies in
+    memory once it is loaded and the ids are cached, instead of querying
+    per request.
     """
 
-    def __init__(self, dsn: str):
-        self.dsn = dsn
-        # simple persistent connection for demo; in prod use a pool
-        self.conn = psycopg2.connect(self.dsn)
+    hash_tags = False
+    policy_index = None
 
-    def _fetch_one(self, query: str, params: tuple) -> Optional[dict]:
-        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(query, params)
-            row = cur.fetchone()
-            return dict(row) if row else None
+    def __init__(self, identity_cache: Optional[TTLCache] = None):
+        self.identity_cache = identity_cache if identity_cache is not None else TTLCache()
 
-    def _get_tenant_id(self, tenant_name: Optional[str]) -> Optional[int]:
-        if not tenant_name:
-            return None
-        row = self._fetch_one(
-            "SELECT id FROM tenant WHERE name = %s",
-            (tenant_name,),
-        )
-        return row["id"] if row else None
+    # --- identity cache invalidation hooks ---
 
-    def _get_user_id(self, tenant_id: Optional[int], external_id: Optional[str]) -> Optional[int]:
-        if not tenant_id or not external_id:
-            return None
-        row = self._fetch_one(
-            """
-            SELECT id FROM user_account
-            WHERE tenant_id = %s AND external_id = %s
-            """,
-            (tenant_id, external_id),
-        )
-        return row["id"] if row else None
+    def invalidate_tenant(self, tenant_name: str) -> None:
+        """Drop a tenant and every user cached under it."""
+        tenant_id = self.identity_cache.get(("tenant", tenant_name), None)
+        self.identity_cache.invalidate(("tenant", tenant_name))
+        if tenant_id is not None:
+            self.identity_cache.invalidate_where(
+                lambda k: k[0] == "user" and k[1] == tenant_id
+            )
 
-    def _get_api_key_id(self, api_key_value: Optional[str]) -> Optional[int]:
-        if not api_key_value:
-            return None
-        row = self._fetch_one(
-            "SELECT id FROM api_key WHERE key_hash = %s AND revoked = FALSE",
-            (api_key_value,),
-        )
-        return row["id"] if row else None
-
-    def _get_model_id_and_tier(self, model_name: Optional[str]) -> tuple[Optional[int], Optional[int]]:
-        if not model_name:
-            return None, None
-        row = self._fetch_one(
-            "SELECT id, tier_id FROM model WHERE name = %s",
-            (model_name,),
-        )
-        if not row:
-            return None, None
-        return row["id"], row["tier_id"]
+    def invalidate_user(self, tenant_id: int, external_id: str) -> None:
+        self.identity_cache.invalidate(("user", tenant_id, external_id))
+
+    def invalidate_api_key(self, api_key_value: str) -> None:
+        """Call after creating or revoking a key."""
+        self.identity_cache.invalidate(("api_key", api_key_value))
+
+    def invalidate_model(self, model_name: str) -> None:
+        self.identity_cache.invalidate(("model", model_name))
+
+    def invalidate_model_tier(self, tier_name: str) -> None:
+        self.identity_cache.invalidate(("tier", tier_name))
+
+    def clear_identity_cache(self) -> None:
+        self.identity_cache.clear()
+
+    def _cached_identities(self, body: RateLimitRequest) -> Optional[dict]:
+        """Return the ids for this request if every lookup is cached, else None."""
+        cache = self.identity_cache
+        tenant_id = None
+        if body.tenantId:
+            tenant_id = cache.get(("tenant", body.tenantId))
+            if tenant_id is MISSING:
+                return None
+        user_id = None
+        if tenant_id and body.userId:
+            user_id = cache.get(("user", tenant_id, body.userId))
+            if user_id is MISSING:
+                return None
+        api_key_id = None
+        if body.apiKey:
+            api_key_id = cache.get(("api_key", body.apiKey))
+            if api_key_id is MISSING:
+                return None
+        model = None
+        if body.modelId:
+            model = cache.get(("model", body.modelId))
+            if model is MISSING:
+                return None
+        explicit_tier_id = None
+        if body.modelTier:
+            explicit_tier_id = cache.get(("tier", body.modelTier))
+            if explicit_tier_id is MISSING:
+                return None
 
-    def _get_model_tier_id_by_name(self, tier_name: Optional[str]) -> Optional[int]:
-        if not tier_name:
+        model_id, model_tier_id_from_model = model if model else (None, None)
+        return {
+            "tenant_id": tenant_id,
+            "user_id": user_id,
+            "api_key_id": api_key_id,
+            "model_id": model_id,
+            # allow explicit modelTier override from request if provided
+            "model_tier_id": explicit_tier_id or model_tier_id_from_model,
+        }
+
+    def _remember_identities(self, body: RateLimitRequest, ctx: dict) -> None:
+        """Seed the identity cache from the ctx_* columns of a resolve row."""
+        cache = self.identity_cache
+        if body.tenantId:
+            cache.set(("tenant", body.tenantId), ctx["ctx_tenant_id"])
+        if ctx["ctx_tenant_id"] and body.userId:
+            cache.set(("user", ctx["ctx_tenant_id"], body.userId), ctx["ctx_user_id"])
+        if body.apiKey:
+            cache.set(("api_key", body.apiKey), ctx["ctx_api_key_id"])
+        if body.modelId:
+            model = ctx["ctx_model_id"]
+            cache.set(("model", body.modelId), (model, ctx["ctx_model_default_tier_id"]) if model else None)
+        if body.modelTier:
+            cache.set(("tier", body.modelTier), ctx["ctx_explicit_tier_id"])
+
+    def _indexed_policies(self, ids: dict) -> Optional[List[dict]]:
+        """Policies for cached ids from the policy index, or None if none is loaded."""
+        index = self.policy_index
+        if index is None or not index.loaded:
             return None
-        row = self._fetch_one(
-            "SELECT id FROM model_tier WHERE name = %s",
-            (tier_name,),
-        )
-        return row["id"] if row else None
+        return index.policies(**ids)
 
-    def _get_applicable_policies(
-        self,
-        tenant_id: Optional[int],
-        user_id: Optional[int],
-        api_key_id: Optional[int],
-        model_id: Optional[int],
-        model_tier_id: Optional[int],
-    ) -> List[dict]:
-        # We'll pass all IDs; for NULLs, the matching WHERE conditions simply won't fire.
-        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(
-                """
-                SELECT *,
-                       CASE scope
-                         WHEN 'USER_MODEL' THEN 6
-                         WHEN 'API_KEY'    THEN 5
-                         WHEN 'TENANT'     THEN 4
-                         WHEN 'MODEL'      THEN 3
-                         WHEN 'MODEL_TIER' THEN 2
-                         WHEN 'GLOBAL'     THEN 1
-                         ELSE 0
-                       END AS precedence
-                FROM rate_limit_policy
-                WHERE enabled = TRUE
-                  AND (
-                        scope = 'GLOBAL'
-                     OR (scope = 'TENANT'     AND tenant_id     = %s)
-                     OR (scope = 'API_KEY'    AND api_key_id    = %s)
-                     OR (scope = 'MODEL'      AND model_id      = %s)
-                     OR (scope = 'MODEL_TIER' AND model_tier_id = %s)
-                     OR (scope = 'USER_MODEL' AND user_id       = %s AND model_id = %s)
-                  )
-                ORDER BY precedence DESC, id ASC
-                """,
-                (
-                    tenant_id,
-                    api_key_id,
-                    model_id,
-                    model_tier_id,
-                    user_id,
-                    model_id,
-                ),
-            )
-            rows = cur.fetchall()
-            return [dict(r) for r in rows]
+    @staticmethod
+    def _resolve_params(body: RateLimitRequest) -> tuple:
+        """Positional parameters of RESOLVE_SQL."""
+        return (
+            body.tenantId or None,
+            body.userId or None,
+            body.apiKey or None,
+            body.modelId or None,
+            body.modelTier or None,
+        )
 
     def _redis_key_for_policy(self, policy: dict) -> str:
+        key = self._redis_base_key_for_policy(policy)
+        # Counter policies store a HASH, not a ZSET; keep them apart so switching
+        # a policy's algorithm never hits a WRONGTYPE on the old key
+        if policy.get("algorithm") == "SLIDING_COUNTER":
+            key += ":swc"
+        # In-flight leases (concurrency_limiter) live in their own ZSET
+        if policy.get("limit_type") == CONCURRENCY:
+            key += ":conc"
+        # Cost-weighted windows store units per entry, not one per request
+        elif policy.get("limit_unit") == COST:
+            key += ":cost"
+        return key
+
+    def _redis_base_key_for_policy(self, policy: dict) -> str:
+        entity = self._policy_entity(policy)
+        # On Redis Cluster the entity is a hash tag, so the suffixed keys built
+        # from it (`:swc`, `:conc`, `:cost`, and quota_lease's `:lease`) share
+        # its slot; see rate_limiter.shard_keys
+        return f"rl:{{{entity}}}" if self.hash_tags else f"rl:{entity}"
+
+    @staticmethod
+    def _policy_entity(policy: dict) -> str:
         scope = policy["scope"]
         if scope == "GLOBAL":
-            return "rl:global"
+            return "global"
         elif scope == "TENANT":
-            return f"rl:tenant:{policy['tenant_id']}"
+            return f"tenant:{policy['tenant_id']}"
         elif scope == "API_KEY":
-            return f"rl:apikey:{policy['api_key_id']}"
+            return f"apikey:{policy['api_key_id']}"
         elif scope == "MODEL":
-            return f"rl:model:{policy['model_id']}"
+            return f"model:{policy['model_id']}"
         elif scope == "MODEL_TIER":
-            return f"rl:modeltier:{policy['model_tier_id']}"
+            return f"modeltier:{policy['model_tier_id']}"
         elif scope == "USER_MODEL":
-            return f"rl:user:{policy['user_id']}:model:{policy['model_id']}"
+            return f"user:{policy['user_id']}:model:{policy['model_id']}"
         else:
             # Fallback (should not happen)
-            return f"rl:unknown:{policy['id']}"
-
-    def resolve(self, body: RateLimitRequest) -> List[EffectiveLimit]:
-        """
-        Resolve all applicable policies for this request context and translate them
-        into EffectiveLimit objects (each one corresponds to a Redis key to enforce).
-        """
-
-        # 1) Map request context -> DB IDs
-        tenant_id = self._get_tenant_id(body.tenantId)
-        user_id = self._get_user_id(tenant_id, body.userId)
-        api_key_id = self._get_api_key_id(body.apiKey)
-
-        model_id, model_tier_id_from_model = self._get_model_id_and_tier(body.modelId)
-
-        # allow explicit modelTier override from request if provided
-        explicit_tier_id = self._get_model_tier_id_by_name(body.modelTier)
-        model_tier_id = explicit_tier_id or model_tier_id_from_model
-
-        # 2) Fetch matching policies from DB
-        policies = self._get_applicable_policies(
-            tenant_id=tenant_id,
-            user_id=user_id,
-            api_key_id=api_key_id,
-            model_id=model_id,
-            model_tier_id=model_tier_id,
-        )
+            return f"unknown:{policy['id']}"
 
-        # 3) Translate policies → EffectiveLimit list
+    def _to_effective_limits(self, policies: List[dict], limit_type: str = RATE) -> List[EffectiveLimit]:
+        """Translate policy rows (ordered by precedence) of one limit type into EffectiveLimit objects."""
         effective_limits: List[EffectiveLimit] = []
         for p in policies:
+            if (p.get("limit_type") or RATE) != limit_type:
+                continue
             key = self._redis_key_for_policy(p)
-            # Get tier name from DB if this is a MODEL_TIER scope
+            # Tier name comes joined in with the policy row
             scope_label = p["scope"]
-            if scope_label == "MODEL_TIER" and p.get("model_tier_id"):
-                tier_row = self._fetch_one(
-                    "SELECT name FROM model_tier WHERE id = %s",
-                    (p["model_tier_id"],),
-                )
-                if tier_row:
-                    scope_label = f"{tier_row['name'].upper()}_TIER"
-            
+            if scope_label == "MODEL_TIER" and p.get("tier_name"):
+                scope_label = f"{p['tier_name'].upper()}_TIER"
+
             effective_limits.append(
                 EffectiveLimit(
                     key=key,
@@ -212,7 +372,119 @@ class PolicyResolver:
                     limit=p["limit_value"],
                     label=scope_label,
                     scope=p["scope"],
+                    algorithm=p.get("algorithm") or "SLIDING_LOG",
+                    buckets=p.get("counter_buckets") or 1,
+                    shards=p.get("shards") or 1,
+                    limit_type=limit_type,
+                    limit_unit=p.get("limit_unit") or REQUESTS,
+                    adaptive_group=p.get("adaptive_group"),
                 )
             )
 
         return effective_limits
+
+
+class PolicyResolver(BasePolicyResolver):
+    """
+    DB-backed PolicyResolver using Postgres.
+
+    All queries borrow a connection from `pool`, so concurrent requests
+    (FastAPI runs sync handlers in a thread pool) do not share a connection.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        identity_cache: Optional[TTLCache] = None,
+        pool: Optional[PgConnectionPool] = None,
+    ):
+        super().__init__(identity_cache)
+        self.dsn = dsn
+        self.pool = (
+            pool
+            if pool is not None
+            else PgConnectionPool(self.dsn, connection_factory=PreparingConnection)
+        )
+
+    def _execute_prepared(self, cur, name: str, params: tuple) -> None:
+        """EXECUTE a server-side prepared statement, PREPARE-ing it on first use per connection."""
+        prepared = cur.connection.prepared
+        if name not in prepared:
+            param_types, statement = _PREPARED_STATEMENTS[name]
+            cur.execute(f"PREPARE {name} {param_types} AS {statement}")
+            prepared.add(name)
+        placeholders = ", ".join(["%s"] * len(params))
+        cur.execute(f"EXECUTE {name} ({placeholders})", params)
+
+    def _get_applicable_policies(
+        self,
+        tenant_id: Optional[int],
+        user_id: Optional[int],
+        api_key_id: Optional[int],
+        model_id: Optional[int],
+        model_tier_id: Optional[int],
+    ) -> List[dict]:
+        # We'll pass all IDs; for NULLs, the matching join conditions simply won't fire.
+        with self.pool.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            self._execute_prepared(
+                cur,
+                "rl_policies",
+                (tenant_id, user_id, api_key_id, model_id, model_tier_id),
+            )
+            rows = cur.fetchall()
+            return [dict(r) for r in rows]
+
+    def load_policy_snapshot(self) -> List[dict]:
+        """Every enabled policy (for PolicyIndex.replace)."""
+        with self.pool.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(POLICY_SNAPSHOT_SQL)
+            return [dict(r) for r in cur.fetchall()]
+
+    def load_policy_changes(self, since) -> tuple:
+        """(rows updated at or after `since`, enabled row count, enabled id sum)."""
+        with self.pool.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(POLICY_CHANGES_SQL, (since,))
+            rows = [dict(r) for r in cur.fetchall()]
+            cur.execute(POLICY_TOTALS_SQL)
+            totals = cur.fetchone()
+            return rows, totals["enabled_count"], totals["id_sum"]
+
+    def _resolve_in_one_round_trip(self, body: RateLimitRequest) -> List[dict]:
+        """
+        Map request context -> ids and fetch the matching policies with one
+        prepared statement, then seed the identity cache with the ids it found.
+        """
+        with self.pool.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            self._execute_prepared(cur, "rl_resolve", self._resolve_params(body))
+            rows = [dict(r) for r in cur.fetchall()]
+
+        # The statement always returns at least one row carrying the resolved ids
+        self._remember_identities(body, rows[0])
+
+        # LEFT JOIN: a row without a policy id means no policy matched
+        return [r for r in rows if r["id"] is not None]
+
+    def resolve(self, body: RateLimitRequest, limit_type: str = RATE) -> List[EffectiveLimit]:
+        """
+        Resolve all applicable policies of `limit_type` for this request context and
+        translate them into EffectiveLimit objects (each one corresponds to a Redis
+        key to enforce).
+        """
+
+        # 1) Map request context -> DB IDs and fetch matching policies.
+        #    Warm identity cache: the policy index (or one policy query);
+        #    otherwise a single statement does both.
+        ids = self._cached_identities(body)
+        if ids is not None:
+            policies = self._indexed_policies(ids)
+            if policies is None:
+                policies = self._get_applicable_policies(**ids)
+                request_timing.note("resolve-source", "policy-query")
+            else:
+                request_timing.note("resolve-source", "index")
+        else:
+            policies = self._resolve_in_one_round_trip(body)
+            request_timing.note("resolve-source", "round-trip")
+
+        # 2) Translate policies → EffectiveLimit list
+        return self._to_effective_limits(policies, limit_type)
@@ -0,0 +1,393 @@
+# backend/quota_lease.py
+import asyncio
+import math
+import threading
+import time
+import uuid
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import redis
+import redis.asyncio
+
+from rate_limiter import Decision
+
+if TYPE_CHECKING:
+    from policy_resolver import EffectiveLimit
+
+
+# Reserve up to `want` units from a shared sliding window ledger.
+# The ledger is a ZSET of grants: member = "<node>:<seq>:<units>", score = grant time.
+# KEYS  = ledger key
+# ARGV  = now_ms, window_ms, limit, want, member prefix ("<node>:<seq>")
+# Reply = {granted, units_in_window_after_grant}
+_ACQUIRE_LUA = """
+local now = tonumber(ARGV[1])
+local window_ms = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local want = tonumber(ARGV[4])
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now - window_ms)
+local used = 0
+for _, member in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+  used = used + tonumber(string.match(member, ':(%d+)$'))
+end
+
+local granted = math.min(want, limit - used)
+if granted < 1 then
+  return {0, used}
+end
+redis.call('ZADD', KEYS[1], now, ARGV[5] .. ':' .. granted)
+redis.call('PEXPIRE', KEYS[1], window_ms * 2)
+return {granted, used + granted}
+"""
+
+# Shrink a grant to the units actually used, keeping its original timestamp.
+# KEYS = ledger key; ARGV = old member, new member (nil-safe if expired)
+_RETURN_LUA = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not score then
+  return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+if ARGV[2] ~= '' then
+  redis.call('ZADD', KEYS[1], score, ARGV[2])
+end
+return 1
+"""
+
+
+def _decode(member) -> str:
+    return member.decode() if isinstance(member, bytes) else member
+
+
+class _Lease:
+    """Capacity reserved by this node from one shared key."""
+
+    __slots__ = ("prefix", "granted", "used", "shared_count", "granted_at", "expires_at")
+
+    def __init__(self, prefix: str, granted: int, shared_count: int, now: float, ttl: float):
+        self.prefix = prefix
+        self.granted = granted
+        self.used = 0
+        self.shared_count = shared_count  # units in the window right after the grant
+        self.granted_at = now
+        self.expires_at = now + ttl
+
+    @property
+    def member(self) -> str:
+        return f"{self.prefix}:{self.granted}"
+
+    def give_back_args(self) -> Optional[List[str]]:
+        """_RETURN_LUA args shrinking the grant to the units used, or None if all were used."""
+        if self.used >= self.granted:
+            return None
+        return [self.member, f"{self.prefix}:{self.used}" if self.used else ""]
+
+
+class _Renewal:
+    """A lease renewal in flight: what to hand back and what to ask for."""
+
+    __slots__ = ("prefix", "chunk", "give_back", "waiter")
+
+    def __init__(self, prefix: str, chunk: int, give_back: Optional[List[str]], waiter):
+        self.prefix = prefix
+        self.chunk = chunk
+        self.give_back = give_back
+        self.waiter = waiter  # set once the renewal finished, successfully or not
+
+
+class BaseQuotaLeaseManager:
+    """
+    Serves high-limit shared policies (e.g. GLOBAL, TENANT) from locally
+    leased capacity instead of touching their Redis key on every request.
+
+    Each node reserves a chunk of units from a per-policy ledger
+    (`<key>:lease`) in one atomic script call, admits requests from memory
+    until the chunk is used up or `lease_seconds` pass, then hands back what
+    it did not use and reserves a new chunk. Chunk size follows the local
+    admission rate (enough for one lease period), clamped to
+    [min_chunk, max_chunk] and to `max_share` of the policy limit.
+
+    Error bounds: units are reserved before they are used, but they are
+    timestamped at grant time, so they leave the window up to `lease_seconds`
+    early. Per window this can over-admit by at most
+    nodes * max_chunk. Unused units held by idle nodes are returned
+    on their next renewal or on `release_all`.
+
+    The lock only guards the local counters; renewals talk to Redis outside
+    it. One caller renews a key at a time, the others wait for its result.
+    Subclasses supply the Redis I/O (QuotaLeaseManager with redis-py,
+    AsyncQuotaLeaseManager with redis.asyncio) and `new_waiter`, the event
+    type callers wait on while another caller renews.
+    """
+
+    def __init__(
+        self,
+        new_waiter: Callable[[], object],
+        scopes: Iterable[str] = ("GLOBAL", "TENANT"),
+        min_limit: int = 10_000,
+        lease_seconds: float = 1.0,
+        min_chunk: int = 10,
+        max_chunk: int = 1_000,
+        max_share: float = 0.05,
+        retry_backoff: float = 0.05,
+    ):
+        self.scopes = frozenset(scopes)
+        self.min_limit = min_limit
+        self.lease_seconds = lease_seconds
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+        self.max_share = max_share
+        self.retry_backoff = retry_backoff
+        self._new_waiter = new_waiter
+
+        self.node_id = uuid.uuid4().hex[:12]
+        self._seq = 0
+        self._leases: Dict[str, _Lease] = {}
+        # key -> monotonic time before which we do not ask Redis again after a denial
+        self._exhausted_until: Dict[str, float] = {}
+        self._renewing: Dict[str, _Renewal] = {}
+        self._lock = threading.Lock()
+
+    def handles(self, lim: "EffectiveLimit") -> bool:
+        # Leases hand out single requests; COST policies always go to Redis, and so do
+        # adaptive ones, whose limit changes under leases sized for the old one
+        return (
+            lim.scope in self.scopes
+            and lim.limit >= self.min_limit
+            and lim.limit_unit != "COST"
+            and lim.adaptive_group is None
+        )
+
+    @staticmethod
+    def _ledger_key(key: str) -> str:
+        return f"{key}:lease"
+
+    def _chunk_size(self, lim: "EffectiveLimit", old: Optional[_Lease], now: float) -> int:
+        chunk = self.min_chunk
+        if old is not None:
+            elapsed = max(now - old.granted_at, 1e-3)
+            chunk = math.ceil(old.used / elapsed * self.lease_seconds)
+        cap = max(1, int(lim.limit * self.max_share))
+        return max(1, min(max(chunk, self.min_chunk), self.max_chunk, cap))
+
+    @staticmethod
+    def _admitted(lease: _Lease) -> Decision:
+        # Approximate window count: everything granted so far minus our unused part
+        return Decision(True, lease.shared_count - lease.granted + lease.used)
+
+    def _take(self, lim: "EffectiveLimit", now: float) -> Tuple[Optional[Decision], Optional[_Renewal], object]:
+        """
+        Admit one request from the current lease (under the lock).
+
+        Returns (decision, None, None) when answered locally, (None, renewal,
+        None) when the caller must run `renewal` against Redis and then
+        `_install` it, and (None, None, waiter) when another caller is
+        already renewing this key: wait for `waiter`, then try again.
+        """
+        lease = self._leases.get(lim.key)
+        if lease is not None and lease.used < lease.granted and lease.expires_at > now:
+            lease.used += 1
+            return self._admitted(lease), None, None
+        pending = self._renewing.get(lim.key)
+        if pending is not None:
+            return None, None, pending.waiter
+        backoff_until = self._exhausted_until.get(lim.key)
+        if backoff_until is not None:
+            if backoff_until > now:
+                return Decision(False, lim.limit), None, None
+            del self._exhausted_until[lim.key]
+
+        # Refunds for the old lease that arrive while renewing are dropped,
+        # which only leaves those units counted as used
+        self._leases.pop(lim.key, None)
+        self._seq += 1
+        renewal = _Renewal(
+            f"{self.node_id}:{self._seq}",
+            self._chunk_size(lim, lease, now),
+            lease.give_back_args() if lease is not None else None,
+            self._new_waiter(),
+        )
+        self._renewing[lim.key] = renewal
+        return None, renewal, None
+
+    def _acquire_args(self, lim: "EffectiveLimit", renewal: _Renewal) -> list:
+        return [
+            int(time.time() * 1000),
+            lim.window_seconds * 1000,
+            lim.limit,
+            renewal.chunk,
+            renewal.prefix,
+        ]
+
+    def _install(self, lim: "EffectiveLimit", renewal: _Renewal, reply, now: float) -> Decision:
+        """Store the lease granted by `reply` and admit the renewing request from it."""
+        granted, shared = int(reply[0]), int(reply[1])
+        with self._lock:
+            del self._renewing[lim.key]
+            renewal.waiter.set()
+            if granted < 1:
+                self._exhausted_until[lim.key] = now + self.retry_backoff
+                return Decision(False, lim.limit)
+            lease = _Lease(renewal.prefix, granted, shared, now, self.lease_seconds)
+            lease.used = 1
+            self._leases[lim.key] = lease
+            return self._admitted(lease)
+
+    def _abandon(self, lim: "EffectiveLimit", renewal: _Renewal) -> None:
+        """The renewal failed; let waiters try again themselves."""
+        with self._lock:
+            del self._renewing[lim.key]
+            renewal.waiter.set()
+
+    def _all_or_nothing(self, limits: Sequence["EffectiveLimit"], decisions: List[Decision]) -> List[Decision]:
+        if not all(d.allowed for d in decisions):
+            self.refund(lim for lim, d in zip(limits, decisions) if d.allowed)
+        return decisions
+
+    def _take_all(self) -> Dict[str, _Lease]:
+        with self._lock:
+            leases, self._leases = self._leases, {}
+        return leases
+
+    @staticmethod
+    def _peek_decisions(limits: Sequence["EffectiveLimit"], results) -> List[Decision]:
+        decisions = []
+        for lim, grants in zip(limits, results):
+            used = sum(int(_decode(member).rsplit(":", 1)[1]) for member, _ in grants)
+            reset_ms = int(grants[0][1]) + lim.window_seconds * 1000 if grants else 0
+            decisions.append(Decision(used < lim.limit, used, reset_ms))
+        return decisions
+
+    def _queue_peek(self, pipe, limits: Sequence["EffectiveLimit"]) -> None:
+        now_ms = int(time.time() * 1000)
+        for lim in limits:
+            window_start = f"({now_ms - lim.window_seconds * 1000}"
+            pipe.zrangebyscore(self._ledger_key(lim.key), window_start, "+inf", withscores=True)
+
+    def refund(self, limits: Iterable["EffectiveLimit"]) -> None:
+        """Undo one admission per policy (the request was rejected elsewhere)."""
+        with self._lock:
+            for lim in limits:
+                lease = self._leases.get(lim.key)
+                if lease is not None and lease.used > 0:
+                    lease.used -= 1
+
+
+class QuotaLeaseManager(BaseQuotaLeaseManager):
+    """Quota leases renewed with redis-py; see BaseQuotaLeaseManager."""
+
+    def __init__(self, redis_client: redis.Redis, **kwargs):
+        super().__init__(threading.Event, **kwargs)
+        self.redis = redis_client
+        self._acquire = self.redis.register_script(_ACQUIRE_LUA)
+        self._return = self.redis.register_script(_RETURN_LUA)
+
+    def _consume_one(self, lim: "EffectiveLimit", now: float) -> Decision:
+        while True:
+            with self._lock:
+                decision, renewal, waiter = self._take(lim, now)
+            if decision is not None:
+                return decision
+            if waiter is not None:
+                waiter.wait()
+                continue
+            try:
+                ledger = self._ledger_key(lim.key)
+                if renewal.give_back is not None:
+                    self._return(keys=[ledger], args=renewal.give_back)
+                reply = self._acquire(keys=[ledger], args=self._acquire_args(lim, renewal))
+            except BaseException:
+                self._abandon(lim, renewal)
+                raise
+            return self._install(lim, renewal, reply, now)
+
+    def consume(self, limits: Sequence["EffectiveLimit"]) -> List[Decision]:
+        """
+        Admit one request against each leased policy, all-or-nothing: if any
+        policy has no capacity, units taken from the others are put back.
+        """
+        now = time.monotonic()
+        decisions: List[Decision] = []
+        try:
+            for lim in limits:
+                decisions.append(self._consume_one(lim, now))
+        except BaseException:
+            self.refund(lim for lim, d in zip(limits, decisions) if d.allowed)
+            raise
+        return self._all_or_nothing(limits, decisions)
+
+    def peek(self, limits: Sequence["EffectiveLimit"]) -> List[Decision]:
+        """
+        Units granted from each policy's ledger in the current window, without
+        reserving anything. Leased but unused units count as used.
+        """
+        with self.redis.pipeline(transaction=False) as pipe:
+            self._queue_peek(pipe, limits)
+            results = pipe.execute()
+        return self._peek_decisions(limits, results)
+
+    def release_all(self) -> None:
+        """Return every unused unit to the shared ledgers (call on shutdown)."""
+        for key, lease in self._take_all().items():
+            args = lease.give_back_args()
+            if args is not None:
+                self._return(keys=[self._ledger_key(key)], args=args)
+
+
+class AsyncQuotaLeaseManager(BaseQuotaLeaseManager):
+    """
+    Quota leases renewed with redis.asyncio, so renewals never block the
+    event loop; see BaseQuotaLeaseManager.
+    """
+
+    def __init__(self, redis_client: redis.asyncio.Redis, **kwargs):
+        super().__init__(asyncio.Event, **kwargs)
+        self.redis = redis_client
+        self._acquire = self.redis.register_script(_ACQUIRE_LUA)
+        self._return = self.redis.register_script(_RETURN_LUA)
+
+    async def _consume_one(self, lim: "EffectiveLimit", now: float) -> Decision:
+        while True:
+            with self._lock:
+                decision, renewal, waiter = self._take(lim, now)
+            if decision is not None:
+                return decision
+            if waiter is not None:
+                await waiter.wait()
+                continue
+            try:
+                ledger = self._ledger_key(lim.key)
+                if renewal.give_back is not None:
+                    await self._return(keys=[ledger], args=renewal.give_back)
+                reply = await self._acquire(keys=[ledger], args=self._acquire_args(lim, renewal))
+            except BaseException:
+                self._abandon(lim, renewal)
+                raise
+            return self._install(lim, renewal, reply, now)
+
+    async def consume(self, limits: Sequence["EffectiveLimit"]) -> List[Decision]:
+        """Async counterpart of QuotaLeaseManager.consume."""
+        now = time.monotonic()
+        decisions: List[Decision] = []
+        try:
+            for lim in limits:
+                decisions.append(await self._consume_one(lim, now))
+        except BaseException:
+            self.refund(lim for lim, d in zip(limits, decisions) if d.allowed)
+            raise
+        return self._all_or_nothing(limits, decisions)
+
+    async def peek(self, limits: Sequence["EffectiveLimit"]) -> List[Decision]:
+        """Async counterpart of QuotaLeaseManager.peek."""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            self._queue_peek(pipe, limits)
+            results = await pipe.execute()
+        return self._peek_decisions(limits, results)
+
+    async def release_all(self) -> None:
+        """Return every unused unit to the shared ledgers (call on shutdown)."""
+        for key, lease in self._take_all().items():
+            args = lease.give_back_args()
+            if args is not None:
+                await self._return(keys=[self._ledger_key(key)], args=args)
@@ -0,0 +1,261 @@
+# backend/rate_limit_client.py
+import asyncio
+import threading
+import time
+from typing import List, Optional
+
+import httpx
+
+from models import RateLimitRequest, RateLimitResponse
+from ttl_cache import MISSING, TTLCache
+
+
+def _request_key(request: RateLimitRequest) -> tuple:
+    # Cost is part of the key: a COST policy that rejected a large request may admit a small one
+    return (request.tenantId, request.userId, request.apiKey, request.modelId, request.modelTier, request.cost)
+
+
+class _RejectionCache:
+    """
+    Rejections with a retry-after hint, answered locally until they expire,
+    so a blocked caller does not call the service again before it could
+    possibly be admitted.
+    """
+
+    def __init__(self, max_size: int, max_seconds: float):
+        self._cache = TTLCache(max_size=max_size, ttl_seconds=max_seconds)
+        self.max_seconds = max_seconds
+        self.hits = 0
+
+    def get(self, request: RateLimitRequest) -> Optional[RateLimitResponse]:
+        entry = self._cache.get(_request_key(request))
+        if entry is MISSING:
+            return None
+        until_ms, response = entry
+        remaining = until_ms - int(time.time() * 1000)
+        if remaining <= 0:
+            return None
+        self.hits += 1
+        return response.model_copy(update={"retryAfterMs": remaining})
+
+    def remember(self, request: RateLimitRequest, response: RateLimitResponse) -> None:
+        if response.allowed or not response.retryAfterMs:
+            return
+        until_ms = int(time.time() * 1000) + response.retryAfterMs
+        ttl_seconds = min(response.retryAfterMs / 1000, self.max_seconds)
+        self._cache.set(_request_key(request), (until_ms, response), ttl_seconds=ttl_seconds)
+
+
+class _Batch:
+    """Checks gathered for one /rate-limit/check-batch call."""
+
+    def __init__(self):
+        self.requests: List[RateLimitRequest] = []
+        self.responses: Optional[List[RateLimitResponse]] = None
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+
+
+def _payload(requests: List[RateLimitRequest]) -> list:
+    return [r.model_dump(exclude_none=True) for r in requests]
+
+
+def _parse(requests: List[RateLimitRequest], response: httpx.Response) -> List[RateLimitResponse]:
+    response.raise_for_status()
+    results = [RateLimitResponse.model_validate(item) for item in response.json()]
+    if len(results) != len(requests):
+        raise httpx.DecodingError(f"expected {len(requests)} results, got {len(results)}")
+    return results
+
+
+class RateLimitClient:
+    """
+    Thread-safe client for the limiter's check API.
+
+    Keeps a pool of keep-alive connections. Checks made concurrently within
+    `batch_window` seconds (up to `max_batch` of them) go out as one
+    /rate-limit/check-batch call: the first caller waits out the window and
+    sends the batch, the others wait for its answer. A rejection with a
+    retry-after hint is answered locally until it expires (per identity and
+    cost, at most `max_cached_seconds`).
+
+    HTTP and transport errors are raised as httpx exceptions to every
+    caller of the failed batch.
+    """
+
+    def __init__(
+        self,
+        base_url: str = "http://localhost:8000",
+        batch_window: float = 0.002,
+        max_batch: int = 100,
+        timeout: float = 1.0,
+        max_connections: int = 20,
+        cache_size: int = 10_000,
+        max_cached_seconds: float = 60.0,
+        transport: Optional[httpx.BaseTransport] = None,
+    ):
+        self.batch_window = batch_window
+        self.max_batch = max(1, max_batch)
+        self._http = httpx.Client(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=transport,
+        )
+        self._rejections = _RejectionCache(cache_size, max_cached_seconds)
+        self._cond = threading.Condition()
+        self._pending: Optional[_Batch] = None
+        self.calls = 0
+        self.checks = 0
+
+    def __enter__(self) -> "RateLimitClient":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._http.close()
+
+    def stats(self) -> dict:
+        return {"checks": self.checks, "calls": self.calls, "cachedRejections": self._rejections.hits}
+
+    def check(self, request: RateLimitRequest) -> RateLimitResponse:
+        """Check (and consume) one request, batched with concurrent checks."""
+        cached = self._rejections.get(request)
+        if cached is not None:
+            return cached
+
+        with self._cond:
+            self.checks += 1
+            batch = self._pending
+            leader = batch is None
+            if leader:
+                batch = self._pending = _Batch()
+            slot = len(batch.requests)
+            batch.requests.append(request)
+            if len(batch.requests) >= self.max_batch:
+                self._pending = None
+                self._cond.notify_all()
+
+        if leader:
+            self._wait_and_send(batch)
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        response = batch.responses[slot]
+        self._rejections.remember(request, response)
+        return response
+
+    def _wait_and_send(self, batch: _Batch) -> None:
+        deadline = time.monotonic() + self.batch_window
+        with self._cond:
+            # Woken early when the batch fills up
+            while self._pending is batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._pending = None
+                    break
+                self._cond.wait(remaining)
+            self.calls += 1
+        try:
+            batch.responses = _parse(
+                batch.requests, self._http.post("/rate-limit/check-batch", json=_payload(batch.requests))
+            )
+        except BaseException as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+
+class AsyncRateLimitClient:
+    """
+    asyncio counterpart of RateLimitClient (same batching and local
+    rejection cache) on one event loop, using httpx.AsyncClient.
+    """
+
+    def __init__(
+        self,
+        base_url: str = "http://localhost:8000",
+        batch_window: float = 0.002,
+        max_batch: int = 100,
+        timeout: float = 1.0,
+        max_connections: int = 20,
+        cache_size: int = 10_000,
+        max_cached_seconds: float = 60.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.batch_window = batch_window
+        self.max_batch = max(1, max_batch)
+        self._http = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=transport,
+        )
+        self._rejections = _RejectionCache(cache_size, max_cached_seconds)
+        self._pending: Optional[List[tuple]] = None  # (request, future) of the open batch
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._sending = set()
+        self.calls = 0
+        self.checks = 0
+
+    async def __aenter__(self) -> "AsyncRateLimitClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        self._flush()
+        if self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
+        await self._http.aclose()
+
+    def stats(self) -> dict:
+        return {"checks": self.checks, "calls": self.calls, "cachedRejections": self._rejections.hits}
+
+    async def check(self, request: RateLimitRequest) -> RateLimitResponse:
+        """Check (and consume) one request, batched with concurrent checks."""
+        cached = self._rejections.get(request)
+        if cached is not None:
+            return cached
+
+        self.checks += 1
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if self._pending is None:
+            self._pending = []
+            self._timer = loop.call_later(self.batch_window, self._flush)
+        self._pending.append((request, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+
+        response = await future
+        self._rejections.remember(request, response)
+        return response
+
+    def _flush(self) -> None:
+        batch, self._pending = self._pending, None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._send(batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch: List[tuple]) -> None:
+        self.calls += 1
+        requests = [request for request, _ in batch]
+        try:
+            results = _parse(requests, await self._http.post("/rate-limit/check-batch", json=_payload(requests)))
+        except BaseException as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), response in zip(batch, results):
+            if not future.done():
+                future.set_result(response)
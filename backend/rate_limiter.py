@@ -1,17 +1,604 @@
+import dataclasses
+import itertools
+import math
+import os
+import random
+import threading
 import time
-from typing import Tuple
+import zlib
+from typing import TYPE_CHECKING, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
 
 import redis
+from redis.crc import key_slot
+
+if TYPE_CHECKING:
+    from policy_resolver import EffectiveLimit
+
+
+# Policy algorithms (rate_limit_policy.algorithm)
+SLIDING_LOG = "SLIDING_LOG"
+SLIDING_COUNTER = "SLIDING_COUNTER"
+
+# Numeric codes passed to the script
+_ALGORITHM_CODES = {SLIDING_LOG: 0, SLIDING_COUNTER: 1}
+# Sliding log of a COST policy: each member carries its units (see _algorithm_code)
+_WEIGHTED_LOG = 2
+
+# Evaluates the policies of one or more requests in a single server-side call.
+# Each request is a "group" of policies; groups are evaluated in order, so
+# later requests see what earlier ones consumed.
+# KEYS  = the shard keys of each policy (one key unless sharded), grouped by request
+# ARGV  = now_ms, n_groups, member per group,
+#         then (group, window_ms, limit, algorithm, buckets, shards, write_shard, cost)
+#         per policy
+#         algorithm 0 = sliding log (ZSET, one member per request)
+#         algorithm 1 = sliding counter (HASH of bucket -> count, O(buckets) memory)
+#         algorithm 2 = weighted sliding log (ZSET, member = request member .. units;
+#                       counting sums the members in the window)
+#         cost = units the request consumes (1 for REQUESTS policies)
+#         a sharded policy counts the sum over its shard keys and writes to
+#         KEYS[first + write_shard - 1] only
+# Reply = {admitted_1, ..., admitted_g, count_1, ..., count_n, reset_1, ..., reset_n}
+#         (one count and reset per policy). reset = epoch ms at which the policy
+#         frees its next slot: when the entry that keeps it at its limit leaves
+#         the window (the oldest one if under the limit; for weighted logs, the
+#         entry after which `cost` more units fit); for counters, the next
+#         bucket boundary; 0 if the window is empty.
+# Within a group either all policies are consumed or none are (all-or-nothing).
+_MULTI_CHECK_LUA = """
+local now = tonumber(ARGV[1])
+local n_groups = tonumber(ARGV[2])
+local spec = 2 + n_groups
+local n_policies = (#ARGV - spec) / 8
+local counts = {}
+local buckets_now = {}
+local first_key = {}
+local reply = {}
+
+-- Weighted sliding counter: the window is `buckets` fixed sub-buckets plus
+-- the current partial one; the oldest bucket counts in proportion to how
+-- much of it still overlaps the window. buckets = 1 is the classic
+-- two-window (previous/current) estimate.
+local function counter_count(key, window_ms, buckets)
+  local bucket_ms = window_ms / buckets
+  local cur = math.floor(now / bucket_ms)
+  local weight = 1 - (now - cur * bucket_ms) / bucket_ms
+  local total = 0
+  local fields = redis.call('HGETALL', key)
+  for j = 1, #fields, 2 do
+    local idx = tonumber(fields[j])
+    if idx > cur - buckets then
+      total = total + tonumber(fields[j + 1])
+    elseif idx == cur - buckets then
+      total = total + tonumber(fields[j + 1]) * weight
+    else
+      redis.call('HDEL', key, fields[j])
+    end
+  end
+  return total, cur
+end
+
+-- Units of a weighted-log member: the digits after the 10-byte request member
+local function units(member)
+  return tonumber(string.sub(member, 11)) or 1
+end
+
+local function weighted_count(key, window_ms)
+  redis.call('ZREMRANGEBYSCORE', key, 0, now - window_ms)
+  local total = 0
+  for _, member in ipairs(redis.call('ZRANGE', key, 0, -1)) do
+    total = total + units(member)
+  end
+  return total
+end
+
+local function arg(p, field)
+  return ARGV[spec + 8 * (p - 1) + field]
+end
+
+local p = 1
+local k = 1
+for g = 1, n_groups do
+  local first = p
+  local admitted = 1
+  while p <= n_policies and tonumber(arg(p, 1)) == g do
+    local window_ms = tonumber(arg(p, 2))
+    local total = 0
+    first_key[p] = k
+    for s = k, k + tonumber(arg(p, 6)) - 1 do
+      if arg(p, 4) == '1' then
+        local c
+        c, buckets_now[p] = counter_count(KEYS[s], window_ms, tonumber(arg(p, 5)))
+        total = total + c
+      elseif arg(p, 4) == '2' then
+        total = total + weighted_count(KEYS[s], window_ms)
+      else
+        redis.call('ZREMRANGEBYSCORE', KEYS[s], 0, now - window_ms)
+        total = total + redis.call('ZCARD', KEYS[s])
+      end
+    end
+    -- Negative adjustments (refunds) never take a window below empty
+    counts[p] = math.max(0, math.floor(total))
+    if counts[p] + tonumber(arg(p, 8)) > tonumber(arg(p, 3)) then
+      admitted = 0
+    end
+    k = k + tonumber(arg(p, 6))
+    p = p + 1
+  end
+
+  if admitted == 1 then
+    local member = ARGV[2 + g]
+    for q = first, p - 1 do
+      local key = KEYS[first_key[q] + tonumber(arg(q, 7)) - 1]
+      local cost = tonumber(arg(q, 8))
+      if arg(q, 4) == '1' then
+        redis.call('HINCRBY', key, string.format('%d', buckets_now[q]), cost)
+      elseif arg(q, 4) == '2' then
+        redis.call('ZADD', key, now, member .. string.format('%d', cost))
+      else
+        redis.call('ZADD', key, now, member)
+      end
+      redis.call('PEXPIRE', key, tonumber(arg(q, 2)) * 2)
+      counts[q] = counts[q] + cost
+    end
+  end
+  reply[g] = admitted
+end
+
+local function oldest_score(key, rank)
+  local entry = redis.call('ZRANGE', key, rank, rank, 'WITHSCORES')
+  if entry[2] then
+    return tonumber(entry[2])
+  end
+  return 0
+end
+
+-- Weighted log: score of the entry after whose expiry `need` units are free
+local function weighted_reset(key, need)
+  local entries = redis.call('ZRANGE', key, 0, -1, 'WITHSCORES')
+  local freed = 0
+  for j = 1, #entries, 2 do
+    freed = freed + units(entries[j])
+    if freed >= need then
+      return tonumber(entries[j + 1])
+    end
+  end
+  return 0
+end
+
+for q = 1, n_policies do
+  reply[n_groups + q] = counts[q]
+  local window_ms = tonumber(arg(q, 2))
+  local shards = tonumber(arg(q, 6))
+  local reset = 0
+  if arg(q, 4) == '1' then
+    local bucket_ms = window_ms / tonumber(arg(q, 5))
+    reset = (math.floor(now / bucket_ms) + 1) * bucket_ms
+  elseif arg(q, 4) == '2' and shards == 1 then
+    local need = math.max(1, counts[q] + tonumber(arg(q, 8)) - tonumber(arg(q, 3)))
+    reset = weighted_reset(KEYS[first_key[q]], need)
+    if reset > 0 then
+      reset = reset + window_ms
+    end
+  else
+    -- Across shards the order is unknown; the earliest oldest entry is the estimate
+    local rank = 0
+    if shards == 1 then
+      rank = math.max(0, counts[q] - tonumber(arg(q, 3)))
+    end
+    for s = first_key[q], first_key[q] + shards - 1 do
+      local score = oldest_score(KEYS[s], rank)
+      if score > 0 and (reset == 0 or score < reset) then
+        reset = score
+      end
+    end
+    if reset > 0 then
+      reset = reset + window_ms
+    end
+  end
+  reply[n_groups + n_policies + q] = math.floor(reset)
+end
+return reply
+"""
+
+# Rolls back consumption made by _MULTI_CHECK_LUA (cluster mode, see
+# SlidingWindowRateLimiterTx.check_and_consume_batch).
+# KEYS = keys to roll back (one slot); ARGV = (member, algorithm, bucket, cost) per key
+_UNDO_LUA = """
+for i = 1, #KEYS do
+  local member, algorithm, bucket, cost = ARGV[4 * i - 3], ARGV[4 * i - 2], ARGV[4 * i - 1], ARGV[4 * i]
+  if algorithm == '1' then
+    if redis.call('HINCRBY', KEYS[i], bucket, -tonumber(cost)) <= 0 then
+      redis.call('HDEL', KEYS[i], bucket)
+    end
+  elseif algorithm == '2' then
+    redis.call('ZREM', KEYS[i], member .. cost)
+  else
+    redis.call('ZREM', KEYS[i], member)
+  end
+end
+return #KEYS
+"""
+
+# Post-hoc correction of COST policies (POST /rate-limit/adjust): adds `delta`
+# units (negative = refund) without an admission check, booked at the time the
+# request was charged (its counter bucket, or a log entry with the charge's
+# score) so the correction leaves the window together with the charge. Keys
+# whose charge already left the window are skipped.
+# KEYS  = one key per policy (the write shard)
+# ARGV  = now_ms, charged_at_ms, member, then (window_ms, algorithm, buckets) per key, delta last
+# Reply = number of keys adjusted
+_ADJUST_LUA = """
+local now = tonumber(ARGV[1])
+local at = tonumber(ARGV[2])
+local delta = tonumber(ARGV[#ARGV])
+local adjusted = 0
+for i = 1, #KEYS do
+  local window_ms = tonumber(ARGV[3 * i + 1])
+  if at > now - window_ms then
+    if ARGV[3 * i + 2] == '1' then
+      local bucket = string.format('%d', math.floor(at / (window_ms / tonumber(ARGV[3 * i + 3]))))
+      if redis.call('HINCRBY', KEYS[i], bucket, delta) == 0 then
+        redis.call('HDEL', KEYS[i], bucket)
+      end
+    else
+      redis.call('ZADD', KEYS[i], at, ARGV[3] .. ARGV[#ARGV])
+    end
+    redis.call('PEXPIRE', KEYS[i], window_ms * 2)
+    adjusted = adjusted + 1
+  end
+end
+return adjusted
+"""
+
+# Per-process salt for spreading writes over shards (see pick_shard)
+_SHARD_SALT = random.getrandbits(32)
+_shard_seq = itertools.count()
+
+# Sliding-log members: a random per-process nonce plus a per-process sequence,
+# packed into 10 bytes (see _new_member). The score already holds the timestamp,
+# so the member only has to be unique: two requests admitted in the same
+# millisecond get distinct entries, and a cluster rollback removes only its own.
+_MEMBER_NONCE = os.urandom(6)
+_member_seq = itertools.count()
+
+
+def shard_keys(key: str, shards: int) -> List[str]:
+    """
+    Redis keys a policy's window is striped over; unsharded policies keep `key`.
+
+    For hash-tagged keys the shard number goes inside the tag
+    (`rl:{global:s3}`), so shards land in different cluster slots.
+    """
+    if shards <= 1:
+        return [key]
+    start = key.find("{")
+    end = key.find("}", start + 1)
+    if start >= 0 and end > start + 1:
+        return [f"{key[:end]}:s{i}{key[end:]}" for i in range(shards)]
+    return [f"{key}:s{i}" for i in range(shards)]
+
+
+def pick_shard(shards: int) -> int:
+    """Shard index for the next write, spread evenly by hashing a per-request sequence."""
+    if shards <= 1:
+        return 0
+    return zlib.crc32(b"%d" % next(_shard_seq), _SHARD_SALT) % shards
+
+
+class Decision(NamedTuple):
+    """Outcome of evaluating a single policy key."""
+
+    allowed: bool
+    count: int
+    reset_ms: int = 0  # epoch ms when the policy frees its next slot (0 = unknown)
+
+
+def _reset_from_entries(entries, window_ms: int) -> int:
+    """Reset time from a ZRANGE ... WITHSCORES reply of the blocking entry (0 if none)."""
+    if not entries:
+        return 0
+    return int(entries[0][1]) + window_ms
+
+
+def _new_member() -> bytes:
+    """Compact unique ZSET member; the 32-bit sequence wraps long after any window expires."""
+    return _MEMBER_NONCE + (next(_member_seq) & 0xFFFFFFFF).to_bytes(4, "big")
+
+
+def _algorithm_code(lim: "EffectiveLimit") -> int:
+    if lim.limit_unit == "COST" and lim.algorithm != SLIDING_COUNTER:
+        return _WEIGHTED_LOG
+    return _ALGORITHM_CODES[lim.algorithm]
+
+
+def _fits(count: int, lim: "EffectiveLimit", limit: Optional[int] = None) -> bool:
+    """Whether the request's cost still fits next to `count` (limit defaults to the policy's)."""
+    return count + lim.cost <= (lim.limit if limit is None else limit)
+
+
+def _multi_check_args(
+    groups: Sequence[Sequence["EffectiveLimit"]],
+    now_ms: int,
+    members: Sequence[bytes] = (),
+) -> Tuple[List[str], list]:
+    """KEYS and ARGV for _MULTI_CHECK_LUA; one group of limits per request."""
+    keys: List[str] = []
+    members = list(members) or [_new_member() for _ in groups]
+    specs: list = []
+    for g, limits in enumerate(groups, start=1):
+        for lim in limits:
+            shards = max(1, lim.shards)
+            keys.extend(shard_keys(lim.key, shards))
+            specs.extend(
+                (
+                    g,
+                    lim.window_seconds * 1000,
+                    lim.limit,
+                    _algorithm_code(lim),
+                    max(1, lim.buckets),
+                    shards,
+                    pick_shard(shards) + 1,
+                    lim.cost,
+                )
+            )
+    return keys, [now_ms, len(groups), *members, *specs]
+
+
+def _decisions_from_reply(
+    groups: Sequence[Sequence["EffectiveLimit"]], reply: list
+) -> List[List[Decision]]:
+    n_policies = (len(reply) - len(groups)) // 2
+    counts = iter(reply[len(groups):len(groups) + n_policies])
+    resets = iter(reply[len(groups) + n_policies:])
+    results: List[List[Decision]] = []
+    for admitted, limits in zip(reply, groups):
+        admitted = bool(int(admitted))
+        decisions: List[Decision] = []
+        for lim in limits:
+            count = int(next(counts))
+            decisions.append(Decision(admitted or _fits(count, lim), count, int(next(resets))))
+        results.append(decisions)
+    return results
+
+
+class _SlotCall(NamedTuple):
+    """The part of a batch that lives in one cluster slot."""
+
+    groups: List[List["EffectiveLimit"]]  # slot-local limits, one list per request
+    origin: List[Tuple[int, List[int]]]  # (request index, policy indexes) per list
+
+
+def _slot_local_limit(lim: "EffectiveLimit") -> Tuple["EffectiveLimit", int]:
+    """
+    On a cluster the shards of a policy live in different slots, so a single
+    script cannot sum them. Each request is checked against the shard it
+    writes to, with an even share of the limit; the returned scale turns the
+    shard count back into a policy-wide estimate.
+    """
+    if lim.shards <= 1:
+        return lim, 1
+    key = shard_keys(lim.key, lim.shards)[pick_shard(lim.shards)]
+    return dataclasses.replace(lim, key=key, limit=-(-lim.limit // lim.shards), shards=1), lim.shards
+
+
+def _plan_slot_calls(
+    groups: Sequence[Sequence["EffectiveLimit"]],
+) -> Tuple[List[_SlotCall], List[List[int]]]:
+    """Split a batch into one script call per slot; also returns the count scale per policy."""
+    by_slot: Dict[int, Dict[int, Tuple[list, list]]] = {}
+    scales: List[List[int]] = []
+    for g, limits in enumerate(groups):
+        row = []
+        for i, lim in enumerate(limits):
+            local, scale = _slot_local_limit(lim)
+            row.append(scale)
+            sub = by_slot.setdefault(key_slot(local.key.encode()), {}).setdefault(g, ([], []))
+            sub[0].append(local)
+            sub[1].append(i)
+        scales.append(row)
+
+    calls = [
+        _SlotCall([lims for lims, _ in subs.values()], [(g, idx) for g, (_, idx) in subs.items()])
+        for subs in by_slot.values()
+    ]
+    return calls, scales
+
+
+def _slot_call_args(call: _SlotCall, members: Sequence[bytes], now_ms: int) -> Tuple[List[str], list]:
+    return _multi_check_args(call.groups, now_ms, [members[g] for g, _ in call.origin])
+
+
+def _merge_slot_replies(
+    groups: Sequence[Sequence["EffectiveLimit"]],
+    calls: Sequence[_SlotCall],
+    replies: Sequence[list],
+    scales: Sequence[Sequence[int]],
+) -> Tuple[List[List[Decision]], List[Tuple[_SlotCall, List[int]]]]:
+    """
+    Combine per-slot replies: a request is admitted only if every slot
+    admitted it. Returns the decisions and, per slot call, the sub-groups
+    that were consumed for requests another slot rejected (to be undone).
+    """
+    admitted = [True] * len(groups)
+    counts = [[0] * len(limits) for limits in groups]
+    resets = [[0] * len(limits) for limits in groups]
+    local_limits = [[None] * len(limits) for limits in groups]
+    for call, reply in zip(calls, replies):
+        n = len(call.groups)
+        m = (len(reply) - n) // 2
+        flat_counts = iter(reply[n:n + m])
+        flat_resets = iter(reply[n + m:])
+        for j, (g, idx) in enumerate(call.origin):
+            if not int(reply[j]):
+                admitted[g] = False
+            for i, local in zip(idx, call.groups[j]):
+                counts[g][i] = int(next(flat_counts))
+                resets[g][i] = int(next(flat_resets))
+                local_limits[g][i] = local
+
+    undo: List[Tuple[_SlotCall, List[int]]] = []
+    for call, reply in zip(calls, replies):
+        subs = [j for j, (g, _) in enumerate(call.origin) if int(reply[j]) and not admitted[g]]
+        if subs:
+            undo.append((call, subs))
+            for j in subs:
+                g, idx = call.origin[j]
+                for i, local in zip(idx, call.groups[j]):
+                    counts[g][i] -= local.cost
+
+    decisions = [
+        [
+            Decision(
+                admitted[g] or _fits(counts[g][i], local_limits[g][i]),
+                counts[g][i] * scales[g][i],
+                resets[g][i],
+            )
+            for i in range(len(limits))
+        ]
+        for g, limits in enumerate(groups)
+    ]
+    return decisions, undo
+
+
+def _undo_args(
+    call: _SlotCall, subs: Sequence[int], members: Sequence[bytes], now_ms: int
+) -> Tuple[List[str], list]:
+    """KEYS and ARGV for _UNDO_LUA, rolling back the given sub-groups of a slot call."""
+    keys: List[str] = []
+    args: list = []
+    for j in subs:
+        member = members[call.origin[j][0]]
+        for lim in call.groups[j]:
+            window_ms = lim.window_seconds * 1000
+            # Same bucket index as counter_count in _MULTI_CHECK_LUA
+            bucket = math.floor(now_ms / (window_ms / max(1, lim.buckets)))
+            keys.append(lim.key)
+            args.extend((member, _algorithm_code(lim), "%d" % bucket, lim.cost))
+    return keys, args
+
+
+def _adjust_args(
+    limits: Sequence["EffectiveLimit"], delta: int, now_ms: int, charged_at_ms: Optional[int] = None
+) -> Tuple[List[str], list]:
+    """
+    KEYS and ARGV for _ADJUST_LUA; sharded policies are adjusted on one shard.
+    Without `charged_at_ms` (and never later than now) the delta is booked now.
+    """
+    keys: List[str] = []
+    at = now_ms if charged_at_ms is None else min(charged_at_ms, now_ms)
+    args: list = [now_ms, at, _new_member()]
+    for lim in limits:
+        shards = max(1, lim.shards)
+        keys.append(shard_keys(lim.key, shards)[pick_shard(shards)])
+        args.extend((lim.window_seconds * 1000, _algorithm_code(lim), max(1, lim.buckets)))
+    return keys, args + ["%d" % delta]
+
+
+def _weighted_entries(entries) -> List[Tuple[int, float]]:
+    """(units, score) of weighted-log ZRANGE ... WITHSCORES entries (see _MULTI_CHECK_LUA's units())."""
+    return [(int(member[10:] or 1), score) for member, score in entries]
+
+
+def _queue_peek(pipe, limits: Sequence["EffectiveLimit"], now_ms: int) -> None:
+    """Queue read-only commands reporting each policy's usage (see _peek_decisions)."""
+    for lim in limits:
+        window_start = f"({now_ms - lim.window_seconds * 1000}"
+        for k in shard_keys(lim.key, max(1, lim.shards)):
+            if lim.algorithm == SLIDING_COUNTER:
+                pipe.hgetall(k)
+            elif _algorithm_code(lim) == _WEIGHTED_LOG:
+                pipe.zrangebyscore(k, window_start, "+inf", withscores=True)
+            else:
+                pipe.zcount(k, window_start, "+inf")
+                pipe.zrangebyscore(k, window_start, "+inf", start=0, num=1, withscores=True)
+
+
+def _peek_decisions(
+    limits: Sequence["EffectiveLimit"], results: list, now_ms: int
+) -> List[Decision]:
+    """
+    Decisions for _queue_peek's replies: whether one more request would be
+    admitted now, the current count and the reset time. Counters use the
+    script's weighted estimate; a sliding log resets when its oldest entry
+    leaves the window.
+    """
+    replies = iter(results)
+    decisions: List[Decision] = []
+    for lim in limits:
+        window_ms = lim.window_seconds * 1000
+        shards = max(1, lim.shards)
+        if lim.algorithm == SLIDING_COUNTER:
+            buckets = max(1, lim.buckets)
+            bucket_ms = window_ms / buckets
+            cur = math.floor(now_ms / bucket_ms)
+            weight = 1 - (now_ms - cur * bucket_ms) / bucket_ms
+            total = 0.0
+            for _ in range(shards):
+                for idx, value in next(replies).items():
+                    idx = int(idx)
+                    if idx > cur - buckets:
+                        total += int(value)
+                    elif idx == cur - buckets:
+                        total += int(value) * weight
+            count = max(0, math.floor(total))
+            reset_ms = int((cur + 1) * bucket_ms)
+        elif _algorithm_code(lim) == _WEIGHTED_LOG:
+            entries = sorted(
+                (e for _ in range(shards) for e in _weighted_entries(next(replies))),
+                key=lambda e: e[1],
+            )
+            count = max(0, sum(units for units, _ in entries))
+            need, freed, reset_ms = max(1, count + lim.cost - lim.limit), 0, 0
+            for units, score in entries:
+                freed += units
+                if freed >= need:
+                    reset_ms = int(score) + window_ms
+                    break
+        else:
+            count, oldest = 0, []
+            for _ in range(shards):
+                count += int(next(replies))
+                oldest.extend(next(replies))
+            reset_ms = _reset_from_entries(sorted(oldest, key=lambda e: e[1])[:1], window_ms)
+        decisions.append(Decision(_fits(count, lim), count, reset_ms))
+    return decisions
 
 
 class SlidingWindowRateLimiterTx:
     """
     Sliding window log rate limiter using Redis WATCH/MULTI/EXEC
     for atomicity (no Lua needed).
+
+    `check_and_consume_many` is the scripted alternative: it evaluates all
+    keys of a request in one server-side call, with no WATCH retries.
+
+    With `cluster=True` (redis.cluster.RedisCluster) the scripted calls are
+    split per hash slot; see `check_and_consume_batch`.
     """
 
-    def __init__(self, redis_client: redis.Redis):
+    def __init__(self, redis_client: redis.Redis, cluster: bool = False):
         self.redis = redis_client
+        self.cluster = cluster
+        # Registered once; redis-py calls it via EVALSHA and reloads on NOSCRIPT.
+        self._multi_check = self.redis.register_script(_MULTI_CHECK_LUA)
+        self._adjust = None  # registered on first use (see adjust)
+        if cluster:
+            self._undo = self.redis.register_script(_UNDO_LUA)
+
+        # Contention counters for check_and_consume (see stats())
+        self._stats_lock = threading.Lock()
+        self.watch_retries = 0
+        self.contention_fallbacks = 0
+        # Optional callback receiving the WatchError retries of each check_and_consume call
+        self.retry_observer: Optional[Callable[[int], None]] = None
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return {
+                "watchRetries": self.watch_retries,
+                "contentionFallbacks": self.contention_fallbacks,
+            }
 
     def check_and_consume(
         self,
@@ -26,13 +613,32 @@ class SlidingWindowRateLimiterTx:
         If high contention prevents a commit after `max_retries`,
         returns (False, -1) as a conservative fallback.
         """
+        allowed, count, _ = self.check_and_consume_detailed(key, window_seconds, limit, max_retries)
+        return allowed, count
+
+    def check_and_consume_detailed(
+        self,
+        key: str,
+        window_seconds: int,
+        limit: int,
+        max_retries: int = 5,
+    ) -> Decision:
+        """
+        check_and_consume, also returning when the key frees its next slot.
 
-        for _ in range(max_retries):
+        The reset time is read in the same round trip as the decision (the
+        oldest entry is queued inside MULTI; a rejection reads the entry
+        that keeps the key at its limit before UNWATCH).
+        """
+        window_ms = window_seconds * 1000
+
+        for attempt in range(max_retries):
             now_ms = int(time.time() * 1000)
-            window_start_ms = now_ms - window_seconds * 1000
+            window_start_ms = now_ms - window_ms
             ttl_seconds = window_seconds * 2
 
-            with self.redis.pipeline() as pipe:
+            # transaction=True also selects WATCH support on RedisCluster pipelines
+            with self.redis.pipeline(transaction=True) as pipe:
                 try:
                     # Watch the key for concurrent modifications
                     pipe.watch(key)
@@ -44,23 +650,224 @@ class SlidingWindowRateLimiterTx:
 
                     # If already at or above limit → reject without modifying
                     if current >= limit:
+                        rank = current - limit
+                        blocking = pipe.zrange(key, rank, rank, withscores=True)
                         pipe.unwatch()
-                        return False, current
+                        self._observe_retries(attempt)
+                        return Decision(False, current, _reset_from_entries(blocking, window_ms))
 
                     # Now start transactional block for the write
                     pipe.multi()
-                    pipe.zadd(key, {now_ms: now_ms})
+                    pipe.zadd(key, {_new_member(): now_ms})
                     pipe.expire(key, ttl_seconds)
+                    pipe.zrange(key, 0, 0, withscores=True)
 
                     # EXEC – if key changed since WATCH, this raises WatchError or returns None
-                    pipe.execute()
+                    results = pipe.execute()
 
                     # Commit succeeded
-                    return True, current + 1
+                    self._observe_retries(attempt)
+                    return Decision(True, current + 1, _reset_from_entries(results[-1], window_ms))
 
                 except redis.WatchError:
                     # Key changed between WATCH and EXEC, retry
+                    with self._stats_lock:
+                        self.watch_retries += 1
                     continue
 
         # Could not commit after max_retries → fail conservative
-        return False, -1
+        with self._stats_lock:
+            self.contention_fallbacks += 1
+        self._observe_retries(max_retries)
+        return Decision(False, -1)
+
+    def _observe_retries(self, retries: int) -> None:
+        if self.retry_observer is not None:
+            self.retry_observer(retries)
+
+    def check_and_consume_sharded(
+        self,
+        key: str,
+        window_seconds: int,
+        limit: int,
+        shards: int,
+    ) -> Decision:
+        """
+        Sliding log striped over `shards` sub-keys, for high-fan-in policies.
+
+        Trims and counts every shard in one pipeline, then adds the request to
+        a single shard picked by hashing, so writes (and on a cluster, the
+        keys themselves) spread across Redis shards. There is no WATCH across
+        shards: concurrent requests may each see the last free slot, so the
+        limit can be exceeded by at most the number of requests in flight.
+        The reset time is estimated from the oldest entry over all shards.
+        """
+        keys = shard_keys(key, shards)
+        window_ms = window_seconds * 1000
+        now_ms = int(time.time() * 1000)
+        window_start_ms = now_ms - window_ms
+
+        with self.redis.pipeline(transaction=False) as pipe:
+            for k in keys:
+                pipe.zremrangebyscore(k, 0, window_start_ms)
+                pipe.zcard(k)
+                pipe.zrange(k, 0, 0, withscores=True)
+            results = pipe.execute()
+        current = sum(int(c) for c in results[1::3])
+        oldest = [entry for entries in results[2::3] for entry in entries]
+        reset_ms = _reset_from_entries(sorted(oldest, key=lambda e: e[1])[:1], window_ms)
+
+        if current >= limit:
+            return Decision(False, current, reset_ms)
+
+        target = keys[pick_shard(len(keys))]
+        with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(target, {_new_member(): now_ms})
+            pipe.expire(target, window_seconds * 2)
+            pipe.execute()
+        return Decision(True, current + 1, reset_ms or now_ms + window_ms)
+
+    def peek(self, limits: Sequence["EffectiveLimit"]) -> List[Decision]:
+        """
+        Current usage of each policy without consuming (sliding log or counter).
+
+        One non-transactional pipeline of reads, so nothing is trimmed or
+        written; `allowed` says whether a request would fit right now.
+        """
+        if not limits:
+            return []
+        now_ms = int(time.time() * 1000)
+        with self.redis.pipeline(transaction=False) as pipe:
+            _queue_peek(pipe, limits, now_ms)
+            results = pipe.execute()
+        return _peek_decisions(limits, results, now_ms)
+
+    def check_and_consume_many(self, limits: Sequence["EffectiveLimit"]) -> List[Decision]:
+        """
+        Evaluate all policy keys of one request in a single round trip.
+
+        Consumption is all-or-nothing: if any key is at its limit, no key is
+        consumed. A key is reported as allowed when it had capacity left,
+        so callers can still tell which policies caused the rejection.
+        """
+        if not limits:
+            return []
+        return self.check_and_consume_batch([limits])[0]
+
+    def check_and_consume_batch(
+        self, groups: Sequence[Sequence["EffectiveLimit"]]
+    ) -> List[List[Decision]]:
+        """
+        Evaluate the policies of several requests in one script call.
+
+        Groups are evaluated in order, each all-or-nothing as in
+        `check_and_consume_many`; returns one list of decisions per group.
+
+        On a cluster, keys in different slots cannot share a script call, so
+        there is one call per slot and a request admitted by some slots but
+        rejected by another has its consumption rolled back. A later request
+        in the same batch may still have been rejected because of that
+        rolled-back consumption (conservative, never over-admits).
+        """
+        if not any(groups):
+            return [[] for _ in groups]
+
+        now_ms = int(time.time() * 1000)
+        if not self.cluster:
+            keys, args = _multi_check_args(groups, now_ms)
+            reply = self._multi_check(keys=keys, args=args)
+            return _decisions_from_reply(groups, reply)
+
+        members = [_new_member() for _ in groups]
+        calls, scales = _plan_slot_calls(groups)
+        replies = []
+        for call in calls:
+            keys, args = _slot_call_args(call, members, now_ms)
+            replies.append(self._multi_check(keys=keys, args=args))
+        decisions, undo = _merge_slot_replies(groups, calls, replies, scales)
+        for call, subs in undo:
+            keys, args = _undo_args(call, subs, members, now_ms)
+            self._undo(keys=keys, args=args)
+        return decisions
+
+    def adjust(
+        self, limits: Sequence["EffectiveLimit"], delta: int, charged_at_ms: Optional[int] = None
+    ) -> None:
+        """
+        Add `delta` units to COST policies after the fact (actual minus
+        charged cost; negative gives units back), without an admission
+        check. `charged_at_ms` (epoch ms) is when the request was charged:
+        the delta is booked at that time so it expires with the charge.
+        One script call, or one per policy on a cluster.
+        """
+        if not limits or not delta:
+            return
+        if self._adjust is None:
+            self._adjust = self.redis.register_script(_ADJUST_LUA)
+        now_ms = int(time.time() * 1000)
+        for part in [limits] if not self.cluster else [[lim] for lim in limits]:
+            keys, args = _adjust_args(part, delta, now_ms, charged_at_ms)
+            self._adjust(keys=keys, args=args)
+
+
+class SlidingWindowCounterRateLimiter:
+    """
+    Sliding window counter rate limiter (constant memory and time per key).
+
+    Instead of one ZSET member per request it keeps a small HASH of
+    sub-bucket counts and estimates the window as the sum of the full
+    buckets plus a time-weighted share of the oldest one. The estimate
+    assumes requests in that oldest bucket were evenly spread, so it is
+    approximate; use the sliding log where exact per-user limits matter.
+
+    Uses the same script as SlidingWindowRateLimiterTx.check_and_consume_many,
+    so both algorithms can be mixed atomically within one request.
+    """
+
+    def __init__(self, redis_client: redis.Redis, cluster: bool = False):
+        self.redis = redis_client
+        self.cluster = cluster
+        self._multi_check = self.redis.register_script(_MULTI_CHECK_LUA)
+
+    def check_and_consume(
+        self,
+        key: str,
+        window_seconds: int,
+        limit: int,
+        buckets: int = 1,
+        shards: int = 1,
+    ) -> Tuple[bool, int]:
+        """
+        Returns (allowed, estimated_count_after_operation).
+
+        `buckets` splits the window into that many sub-buckets; 1 gives the
+        classic weighted previous/current window estimate. `shards` stripes
+        the counter over that many sub-keys (see shard_keys).
+        """
+        allowed, count, _ = self.check_and_consume_detailed(key, window_seconds, limit, buckets, shards)
+        return allowed, count
+
+    def check_and_consume_detailed(
+        self,
+        key: str,
+        window_seconds: int,
+        limit: int,
+        buckets: int = 1,
+        shards: int = 1,
+    ) -> Decision:
+        """check_and_consume, also returning the next bucket boundary as reset time."""
+        now_ms = int(time.time() * 1000)
+        shards = max(1, shards)
+        keys = shard_keys(key, shards)
+        scale = 1
+        if self.cluster and shards > 1:
+            # Shards are in different slots: check the write shard against its share
+            keys = [keys[pick_shard(shards)]]
+            limit, scale, shards = -(-limit // shards), shards, 1
+        reply = self._multi_check(
+            keys=keys,
+            args=[now_ms, 1, _new_member(), 1, window_seconds * 1000, limit,
+                  _ALGORITHM_CODES[SLIDING_COUNTER], max(1, buckets),
+                  shards, pick_shard(shards) + 1, 1],
+        )
+        return Decision(bool(int(reply[0])), int(reply[1]) * scale, int(reply[2]))
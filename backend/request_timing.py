@@ -0,0 +1,59 @@
+# backend/request_timing.py
+import time
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+# Timing of the request being handled, if Server-Timing is on for it. Set by
+# begin(); code deeper in the call (resolver, engines) reaches it through
+# mark() and note(), which do nothing when it is unset.
+_current: ContextVar[Optional["ServerTiming"]] = ContextVar("server_timing", default=None)
+
+
+class ServerTiming:
+    """Spans and notes of one request, rendered as a Server-Timing header value."""
+
+    __slots__ = ("started", "last", "entries")
+
+    def __init__(self):
+        self.started = self.last = time.perf_counter()
+        # (name, duration ms or None, description or None)
+        self.entries: List[Tuple[str, Optional[float], Optional[str]]] = []
+
+    def mark(self, name: str) -> None:
+        """Close a span `name` covering the time since the previous mark."""
+        now = time.perf_counter()
+        self.entries.append((name, (now - self.last) * 1000, None))
+        self.last = now
+
+    def note(self, name: str, desc: str) -> None:
+        self.entries.append((name, None, desc))
+
+    def header(self) -> str:
+        parts = []
+        for name, dur, desc in self.entries + [("total", (time.perf_counter() - self.started) * 1000, None)]:
+            part = name
+            if dur is not None:
+                part += f";dur={dur:.3f}"
+            if desc is not None:
+                part += f';desc="{desc}"'
+            parts.append(part)
+        return ", ".join(parts)
+
+
+def begin() -> ServerTiming:
+    """Start timing the current request (in this context)."""
+    timing = ServerTiming()
+    _current.set(timing)
+    return timing
+
+
+def mark(name: str) -> None:
+    timing = _current.get()
+    if timing is not None:
+        timing.mark(name)
+
+
+def note(name: str, desc: str) -> None:
+    timing = _current.get()
+    if timing is not None:
+        timing.note(name, desc)
@@ -0,0 +1,94 @@
+# backend/stream_protocol.py
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+import msgpack
+
+# Wire format of /rate-limit/stream. Every WebSocket binary message is a
+# msgpack array of frames, so a gateway can coalesce checks per send.
+#
+# check frame:  [id, userId, modelId, tenantId?, apiKey?, modelTier?, cost?]
+# result frame: [id, allowed, limit, count, windowSeconds, retryAfterMs, resetAt, cause, chargedAt]
+# error frame:  [id, None, detail]
+#
+# `id` is any msgpack value chosen by the caller; results carry it back
+# because messages are answered as they complete, not in order.
+
+
+class StreamCheck(NamedTuple):
+    """
+    One check frame. Has the RateLimitRequest fields the resolvers read, so
+    it stands in for the pydantic model without per-field validation.
+    """
+
+    id: Any
+    userId: str
+    modelId: str
+    tenantId: Optional[str] = None
+    apiKey: Optional[str] = None
+    modelTier: Optional[str] = None
+    cost: int = 1
+
+
+def _check_frame(frame) -> StreamCheck:
+    if not isinstance(frame, list) or not 3 <= len(frame) <= 7:
+        raise ValueError("frame must be [id, userId, modelId, tenantId?, apiKey?, modelTier?, cost?]")
+    check = StreamCheck(*frame)
+    if not check.userId or not check.modelId:
+        raise ValueError("userId and modelId are required")
+    if not all(v is None or isinstance(v, str) for v in check[1:6]):
+        raise ValueError("identity fields must be strings")
+    if check.cost is None:
+        check = check._replace(cost=1)
+    elif not isinstance(check.cost, int) or isinstance(check.cost, bool) or check.cost < 1:
+        raise ValueError("cost must be at least 1")
+    return check
+
+
+def decode_checks(message: bytes, max_frames: int) -> Tuple[List[StreamCheck], List[list]]:
+    """
+    (valid checks, error frames for the invalid ones) of one message.
+
+    Raises ValueError if the message as a whole is unusable: not msgpack,
+    not an array, or more than `max_frames` frames.
+    """
+    try:
+        frames = msgpack.unpackb(message, raw=False)
+    except (msgpack.UnpackException, ValueError) as e:
+        raise ValueError(f"message is not msgpack: {e}")
+    if not isinstance(frames, list):
+        raise ValueError("message must be an array of check frames")
+    if len(frames) > max_frames:
+        raise ValueError(f"message of {len(frames)} frames exceeds the maximum of {max_frames}")
+
+    checks: List[StreamCheck] = []
+    errors: List[list] = []
+    for frame in frames:
+        try:
+            checks.append(_check_frame(frame))
+        except (TypeError, ValueError) as e:
+            frame_id = frame[0] if isinstance(frame, list) and frame else None
+            errors.append(error_frame(frame_id, str(e)))
+    return checks, errors
+
+
+def result_frame(check_id, response) -> list:
+    """Result frame of a RateLimitResponse."""
+    return [
+        check_id,
+        response.allowed,
+        response.limit,
+        response.count,
+        response.windowSeconds,
+        response.retryAfterMs,
+        response.resetAt,
+        response.cause,
+        response.chargedAt,
+    ]
+
+
+def error_frame(check_id, detail: str) -> list:
+    return [check_id, None, detail]
+
+
+def encode_frames(frames: List[list]) -> bytes:
+    return msgpack.packb(frames, use_bin_type=True)
@@ -63,3 +63,11 @@ def mock_policies():
             scope="TENANT"
         ),
     ]
+
+
+@pytest.fixture
+def lua_redis():
+    """In-process Redis that runs the real Lua scripts (needs fakeredis[lua])."""
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    return fakeredis.FakeRedis()
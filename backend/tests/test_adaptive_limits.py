@@ -0,0 +1,82 @@
+from unittest.mock import MagicMock
+
+from adaptive_limits import DECREASED, AdaptiveLimits
+from policy_resolver import EffectiveLimit
+
+
+def _limit(key="rl:tenant:1", limit=100, group="gpu-a"):
+    return EffectiveLimit(key=key, window_seconds=60, limit=limit, label="TENANT", scope="TENANT",
+                          adaptive_group=group)
+
+
+def _adaptive(replies=None, **kwargs):
+    """AdaptiveLimits whose feedback script returns `replies` in turn; returns (adaptive, script, client)."""
+    client = MagicMock()
+    script = MagicMock(side_effect=replies or [])
+    client.register_script.return_value = script
+    return AdaptiveLimits(client, **kwargs), script, client
+
+
+class TestAdaptiveLimits:
+    """Unit tests for AIMD-scaled limits."""
+
+    def test_static_policies_pass_through(self):
+        """Requests without adaptive policies get the same list back."""
+        adaptive, _, _ = _adaptive()
+        limits = [_limit(group=None)]
+        assert adaptive.apply(limits) is limits
+
+    def test_feedback_is_one_script_call(self):
+        """A report sends the AIMD parameters and updates the local scale."""
+        adaptive, script, _ = _adaptive([[b"0.7", -1]], decrease=0.7, increase=0.05, min_scale=0.1)
+
+        scale, action = adaptive.feedback("gpu-a", unhealthy=True)
+
+        kwargs = script.call_args.kwargs
+        assert kwargs["keys"] == ["rl:adaptive:gpu-a"]
+        assert kwargs["args"][1:6] == [1, 0.7, 0.05, 0.1, 1000]
+        assert (scale, action) == (0.7, DECREASED)
+        assert adaptive.scale("gpu-a") == 0.7 and adaptive.decreases == 1
+
+    def test_scaled_limit_keeps_configured_one(self):
+        """Adaptive policies are enforced at floor(limit * scale), never below 1."""
+        adaptive, _, _ = _adaptive([[b"0.35", -1], [b"0.001", -1]])
+        adaptive.feedback("gpu-a", unhealthy=True)
+
+        scaled, static = adaptive.apply([_limit(), _limit(key="rl:global", group=None)])
+        assert (scaled.limit, scaled.configured_limit) == (35, 100)
+        assert static.limit == 100 and static.configured_limit is None
+
+        adaptive.feedback("gpu-a", unhealthy=True)
+        assert adaptive.apply([_limit(limit=10)])[0].limit == 1
+
+    def test_thresholds(self):
+        """Latency or error rate over its threshold is unhealthy; missing signals are ignored."""
+        adaptive, _, _ = _adaptive(latency_threshold_ms=500, error_rate_threshold=0.1)
+        assert adaptive.unhealthy(800, None)
+        assert adaptive.unhealthy(None, 0.2)
+        assert not adaptive.unhealthy(300, 0.01)
+
+    def test_refresh_reads_scales_of_seen_groups(self):
+        """Every group a check has used is reloaded; a missing hash means full limits."""
+        adaptive, _, client = _adaptive([[b"0.5", -1], [b"0.55", 1]])
+        adaptive.apply([_limit(group="gpu-a"), _limit(key="rl:tenant:2", group="gpu-b")])
+        adaptive.feedback("gpu-a", unhealthy=True)
+        adaptive.feedback("gpu-b", unhealthy=False)
+        client.pipeline.return_value.execute.return_value = [None, b"0.4"]
+
+        adaptive.refresh()
+
+        assert adaptive.scales() == {"gpu-a": 1.0, "gpu-b": 0.4}
+        assert adaptive.increases == 1
+
+    def test_reports_track_a_bounded_number_of_groups(self):
+        """Reports for unknown groups stop adding local entries at max_groups; checks still add theirs."""
+        adaptive, _, _ = _adaptive([[b"0.7", -1]] * 4, max_groups=2)
+        for group in ("spam-1", "spam-2", "spam-3"):
+            adaptive.feedback(group, unhealthy=True)
+
+        assert set(adaptive.scales()) == {"spam-1", "spam-2"}
+        adaptive.feedback("spam-1", unhealthy=True)
+        adaptive.apply([_limit(group="gpu-a")])
+        assert set(adaptive.scales()) == {"spam-1", "spam-2", "gpu-a"}
@@ -0,0 +1,61 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from async_policy_resolver import AsyncPolicyResolver
+from policy_resolver import POLICIES_SQL, RESOLVE_SQL
+from models import RateLimitRequest
+
+
+class TestAsyncPolicyResolver:
+    """Unit tests for the asyncpg-backed resolver."""
+
+    @pytest.fixture
+    def resolver_and_pool(self):
+        resolver = AsyncPolicyResolver("mock_dsn")
+        pool = MagicMock()
+        pool.fetch = AsyncMock()
+        resolver._pool = pool
+        return resolver, pool
+
+    @staticmethod
+    def _ctx_row(**policy):
+        row = {
+            "ctx_tenant_id": 1,
+            "ctx_user_id": 2,
+            "ctx_api_key_id": None,
+            "ctx_model_id": 1,
+            "ctx_model_default_tier_id": 1,
+            "ctx_explicit_tier_id": None,
+            "id": None,
+        }
+        row.update(policy)
+        return row
+
+    def test_cold_resolve_uses_single_statement(self, resolver_and_pool):
+        """A cold resolve runs RESOLVE_SQL once and labels tiers."""
+        resolver, pool = resolver_and_pool
+        pool.fetch.return_value = [
+            self._ctx_row(id=4, scope="MODEL_TIER", model_tier_id=1, tier_name="premium",
+                          window_seconds=3600, limit_value=1000),
+        ]
+        body = RateLimitRequest(userId="ent-user-1", modelId="gpt-4o", tenantId="enterprise_co")
+
+        limits = asyncio.run(resolver.resolve(body))
+
+        pool.fetch.assert_awaited_once()
+        assert pool.fetch.await_args.args[0] == RESOLVE_SQL
+        assert pool.fetch.await_args.args[1:] == ("enterprise_co", "ent-user-1", None, "gpt-4o", None)
+        assert limits[0].label == "PREMIUM_TIER"
+
+    def test_warm_resolve_uses_policy_statement(self, resolver_and_pool):
+        """With cached identities only POLICIES_SQL runs."""
+        resolver, pool = resolver_and_pool
+        pool.fetch.side_effect = [[self._ctx_row()], []]
+        body = RateLimitRequest(userId="ent-user-1", modelId="gpt-4o", tenantId="enterprise_co")
+
+        asyncio.run(resolver.resolve(body))
+        asyncio.run(resolver.resolve(body))
+
+        last = pool.fetch.await_args_list[-1]
+        assert last.args[0] == POLICIES_SQL
+        assert last.args[1:] == (1, 2, None, 1, 1)
@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+from audit_log import DecisionAuditLog, audit_files, read_audit_file
+from policy_resolver import EffectiveLimit
+
+
+def _decision(allowed=True, key="rl:user:1"):
+    policy = EffectiveLimit(key=key, window_seconds=60, limit=10, label="USER", scope="USER")
+    evaluated = [{"policy": policy, "allowed": allowed, "count": 3, "resetMs": 0}]
+    result = SimpleNamespace(allowed=allowed, cause=None if allowed else "USER exceeded")
+    return evaluated, result
+
+
+class TestDecisionAuditLog:
+    """Unit tests for the queued, batched decision audit log."""
+
+    def test_records_are_written_in_batches(self, tmp_path):
+        """Nothing is written by record(); flush() appends the queued records to one file."""
+        audit = DecisionAuditLog(str(tmp_path))
+        audit.record("check", *_decision())
+        audit.record("check_batch", *_decision(allowed=False))
+        assert not list(tmp_path.iterdir())
+
+        audit.flush()
+        records = list(read_audit_file(audit_files(str(tmp_path))[0]))
+        assert [r[1:4] for r in records] == [
+            ["check", True, None],
+            ["check_batch", False, "USER exceeded"],
+        ]
+        assert records[0][4] == [["rl:user:1", 3, 10, True]]
+        assert audit.stats()["records"] == 2
+
+    def test_sampling_per_outcome(self, tmp_path):
+        """Allowed and denied decisions are sampled at their own rates."""
+        audit = DecisionAuditLog(str(tmp_path), sample_rate=0.1, deny_sample_rate=1.0, random_fn=lambda: 0.5)
+        audit.record("check", *_decision())
+        audit.record("check", *_decision(allowed=False))
+        assert audit.stats()["queued"] == 1
+
+    def test_overflow_is_dropped_and_counted(self, tmp_path):
+        """A full queue drops new decisions instead of blocking the caller."""
+        audit = DecisionAuditLog(str(tmp_path), queue_size=2)
+        for _ in range(5):
+            audit.record("check", *_decision())
+        assert audit.stats()["queued"] == 2
+        assert audit.stats()["dropped"] == 3
+
+    def test_rotation_keeps_newest_files(self, tmp_path):
+        """Files rotate at max_file_bytes and only max_files of them are kept."""
+        audit = DecisionAuditLog(str(tmp_path), max_file_bytes=1, max_files=2)
+        for i in range(4):
+            audit.record("check", *_decision(key=f"rl:user:{i}"))
+            audit.flush()
+        files = audit_files(str(tmp_path))
+        assert len(files) == 2 and audit.stats()["files"] == 4
+        assert [list(read_audit_file(f))[0][4][0][0] for f in files] == ["rl:user:2", "rl:user:3"]
+
+    def test_worker_drains_queue_on_stop(self, tmp_path):
+        """stop() writes what is still queued."""
+        audit = DecisionAuditLog(str(tmp_path), flush_seconds=60)
+        audit.start()
+        audit.record("check", *_decision())
+        audit.stop()
+        assert len(list(read_audit_file(audit_files(str(tmp_path))[0]))) == 1
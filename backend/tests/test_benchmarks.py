@@ -0,0 +1,94 @@
+import json
+import random
+from unittest.mock import MagicMock
+
+from benchmarks import bench_check, bench_memory
+from rate_limiter import Decision
+
+
+class TestBenchmarkHelpers:
+    """Unit tests for the check-path benchmark helpers (no Redis needed)."""
+
+    def test_workload_fanout_and_shared_keys(self):
+        """One per-user key plus fanout - 1 keys shared by every request."""
+        workload = bench_check.Workload(prefix="rl:bench:t", keys=10, fanout=3, shards=4)
+        limits = workload.policies_for(7)
+
+        assert [l.key for l in limits] == ["rl:bench:t:user:7", "rl:bench:t:shared:1", "rl:bench:t:shared:2"]
+        assert [l.shards for l in limits] == [1, 4, 4]
+
+    def test_workload_skew(self):
+        """A high Zipf exponent concentrates traffic on the first keys; 0 is uniform."""
+        rng = random.Random(1)
+        hot = bench_check.Workload(prefix="p", keys=100, skew=2.0)
+        flat = bench_check.Workload(prefix="p", keys=100, skew=0.0)
+
+        hot_share = sum(hot.pick_user(rng) == 0 for _ in range(2000)) / 2000
+        flat_share = sum(flat.pick_user(rng) == 0 for _ in range(2000)) / 2000
+
+        assert hot_share > 0.5
+        assert flat_share < 0.05
+
+    def test_outcome_classification(self):
+        """(False, -1) from any policy is a contention fallback."""
+        ok = Decision(True, 1)
+        assert bench_check.outcome([ok, Decision(True, 2)]) == bench_check.ALLOWED
+        assert bench_check.outcome([ok, Decision(False, 9)]) == bench_check.DENIED
+        assert bench_check.outcome([ok, Decision(False, -1)]) == bench_check.FALLBACK
+
+    def test_run_threads_and_summary(self):
+        """Every request is timed once and the summary reports percentiles and rates."""
+        calls = iter(range(10_000))
+
+        def make_op(rng):
+            return lambda: bench_check.FALLBACK if next(calls) % 4 == 0 else bench_check.ALLOWED
+
+        latencies, outcomes, elapsed = bench_check.run_threads(4, 100, make_op, seed=1)
+        summary = bench_check.summarize(latencies, outcomes, elapsed,
+                                        {"watchRetries": 50, "contentionFallbacks": 25})
+
+        assert summary["requests"] == 100
+        assert summary["fallbacks"] == 25
+        assert summary["fallbackRate"] == 0.25
+        assert summary["watchRetriesPerRequest"] == 0.5
+        assert summary["latencyMs"]["p50"] <= summary["latencyMs"]["p99"] <= summary["latencyMs"]["max"]
+        json.dumps(summary)
+
+    def test_compare_reports_deltas(self):
+        """Deltas are relative to the baseline run."""
+        base = {"opsPerSec": 100.0, "latencyMs": {"p50": 1.0, "p99": 2.0, "p999": 4.0},
+                "fallbackRate": 0.0}
+        current = {"opsPerSec": 150.0, "latencyMs": {"p50": 0.5, "p99": 2.0, "p999": 4.0},
+                   "fallbackRate": 0.0}
+
+        lines = bench_check.compare(current, base)
+
+        assert "+50.0%" in lines[1]
+        assert "-50.0%" in lines[2]
+
+
+class TestMemoryReport:
+    """Unit tests for the per-entry memory report (Redis mocked)."""
+
+    def test_measure_reports_bytes_per_entry_and_cleans_up(self):
+        """MEMORY USAGE is divided by the entries written; the key is deleted afterwards."""
+        client = MagicMock()
+        client.memory_usage.return_value = 1_600_000
+        client.object.return_value = b"skiplist"
+
+        row = bench_memory.measure(client, "rl:bench:mem:t", 20_000, "compact")
+
+        assert row == {"encoding": "compact", "entries": 20_000, "objectEncoding": "skiplist",
+                       "bytes": 1_600_000, "bytesPerEntry": 80.0}
+        pipe = client.pipeline.return_value.__enter__.return_value
+        written = [m for call in pipe.zadd.call_args_list for m in call.args[1]]
+        assert len(set(written)) == 20_000
+        client.delete.assert_called_once_with("rl:bench:mem:t:compact:20000")
+
+    def test_report_compares_against_decimal_members(self):
+        """Each encoding is compared with the old decimal-timestamp member at the same size."""
+        rows = [
+            {"encoding": "tx-ms", "entries": 1000, "objectEncoding": "skiplist", "bytesPerEntry": 100.0},
+            {"encoding": "compact", "entries": 1000, "objectEncoding": "skiplist", "bytesPerEntry": 90.0},
+        ]
+        assert bench_memory.report(rows)[2].endswith("-10.0%")
@@ -0,0 +1,85 @@
+import threading
+import time
+
+import request_timing
+from check_profiler import CheckProfiler
+from request_timing import ServerTiming
+
+
+class TestServerTiming:
+    """Unit tests for per-request Server-Timing spans."""
+
+    def test_header_lists_spans_notes_and_total(self):
+        """Marks become dur= spans, notes desc= entries, and total closes the header."""
+        timing = ServerTiming()
+        timing.mark("resolve")
+        timing.note("resolve-source", "index")
+        timing.mark("evaluate")
+        parts = timing.header().split(", ")
+        assert [p.split(";")[0] for p in parts] == ["resolve", "resolve-source", "evaluate", "total"]
+        assert parts[0].startswith("resolve;dur=")
+        assert parts[1] == 'resolve-source;desc="index"'
+
+    def test_module_helpers_are_noops_without_timing(self):
+        """mark()/note() outside a timed request record nothing and do not fail."""
+        done = []
+
+        def run():
+            request_timing.mark("resolve")
+            request_timing.note("watch-retries", "2")
+            done.append(True)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        assert done == [True]
+
+
+class TestCheckProfiler:
+    """Unit tests for the per-check profiler."""
+
+    def test_disabled_profiler_does_nothing(self, tmp_path):
+        """With both triggers at 0, begin() returns None and no thread is started."""
+        profiler = CheckProfiler(str(tmp_path))
+        assert not profiler.enabled
+        assert profiler.begin() is None
+        profiler.end(None)
+        assert profiler._thread is None
+
+    def test_every_nth_check_is_cprofiled(self, tmp_path):
+        """Every Nth check is written as a pstats file."""
+        profiler = CheckProfiler(str(tmp_path), every_n=2)
+        try:
+            for _ in range(4):
+                profiler.end(profiler.begin())
+        finally:
+            profiler.stop()
+        files = sorted(p.name for p in tmp_path.iterdir())
+        assert len(files) == 2 and all(f.endswith(".prof") for f in files)
+        assert profiler.stats()["profiles"] == 2
+
+    def test_slow_check_is_stack_sampled(self, tmp_path):
+        """A check running past slow_ms is written as collapsed stacks."""
+
+        def slow_check():
+            time.sleep(0.05)
+
+        profiler = CheckProfiler(str(tmp_path), slow_ms=5, interval=0.001)
+        try:
+            profiled = profiler.begin()
+            slow_check()
+            profiler.end(profiled)
+        finally:
+            profiler.stop()
+        files = list(tmp_path.iterdir())
+        assert len(files) == 1 and files[0].name.endswith(".folded")
+        assert "test_check_profiler.py:slow_check" in files[0].read_text()
+
+    def test_fast_checks_are_not_written(self, tmp_path):
+        """Checks finishing under slow_ms leave no profile behind."""
+        profiler = CheckProfiler(str(tmp_path), slow_ms=1000)
+        try:
+            profiler.end(profiler.begin())
+        finally:
+            profiler.stop()
+        assert not list(tmp_path.iterdir())
@@ -0,0 +1,160 @@
+import asyncio
+
+import pytest
+import redis
+from redis.crc import REDIS_CLUSTER_HASH_SLOTS, key_slot
+
+from async_rate_limiter import AsyncSlidingWindowRateLimiterTx
+from policy_resolver import EffectiveLimit, PolicyResolver
+from rate_limiter import SlidingWindowRateLimiterTx, shard_keys
+
+
+class ClusterStandIn:
+    """
+    In-process stand-in for a multi-node Redis Cluster.
+
+    Each node is a separate fakeredis server owning an equal range of hash
+    slots. Script calls run the real Lua on the node owning their keys'
+    slot and, as on a real cluster, fail with CROSSSLOT when keys span
+    slots. Needs fakeredis[lua]; tests using it are skipped without.
+    """
+
+    def __init__(self, nodes: int = 3):
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        self.nodes = [fakeredis.FakeRedis(server=fakeredis.FakeServer()) for _ in range(nodes)]
+        self.calls = [0] * nodes
+
+    def node_for(self, keys):
+        slots = {key_slot(k.encode()) for k in keys}
+        if len(slots) != 1:
+            raise redis.ResponseError("CROSSSLOT Keys in request don't hash to the same slot")
+        index = slots.pop() * len(self.nodes) // REDIS_CLUSTER_HASH_SLOTS
+        self.calls[index] += 1
+        return self.nodes[index]
+
+    def zcard(self, key):
+        node = self.nodes[key_slot(key.encode()) * len(self.nodes) // REDIS_CLUSTER_HASH_SLOTS]
+        return node.zcard(key)
+
+    def register_script(self, lua):
+        scripts = [node.register_script(lua) for node in self.nodes]
+
+        def call(keys, args):
+            return scripts[self.nodes.index(self.node_for(keys))](keys=keys, args=args)
+
+        return call
+
+
+class AsyncClusterStandIn(ClusterStandIn):
+    """The same stand-in with awaitable script calls, for redis.asyncio code."""
+
+    def register_script(self, lua):
+        script = super().register_script(lua)
+
+        async def call(keys, args):
+            return script(keys=keys, args=args)
+
+        return call
+
+
+def _tagged(entity, limit, window_seconds=60, **kwargs):
+    return EffectiveLimit(key=f"rl:{{{entity}}}", window_seconds=window_seconds, limit=limit,
+                          label=entity, scope="TENANT", **kwargs)
+
+
+class TestClusterKeyLayout:
+    """Hash-tagged keys for Redis Cluster."""
+
+    def test_resolver_hash_tags_policy_keys(self):
+        """With hash_tags the policy entity is the tag; derived keys share its slot."""
+        resolver = PolicyResolver.__new__(PolicyResolver)
+        resolver.hash_tags = True
+
+        assert resolver._redis_key_for_policy({"scope": "TENANT", "tenant_id": 7}) == "rl:{tenant:7}"
+        assert resolver._redis_key_for_policy(
+            {"scope": "USER_MODEL", "user_id": 1, "model_id": 2}
+        ) == "rl:{user:1:model:2}"
+        counter = resolver._redis_key_for_policy({"scope": "GLOBAL", "algorithm": "SLIDING_COUNTER"})
+        assert counter == "rl:{global}:swc"
+        assert key_slot(counter.encode()) == key_slot(b"rl:{global}")
+
+    def test_default_keys_are_unchanged(self):
+        """Standalone Redis keeps the original key names."""
+        resolver = PolicyResolver.__new__(PolicyResolver)
+        assert resolver._redis_key_for_policy({"scope": "TENANT", "tenant_id": 7}) == "rl:tenant:7"
+
+    def test_shards_of_tagged_key_spread_over_slots(self):
+        """The shard number goes inside the hash tag."""
+        keys = shard_keys("rl:{global}:swc", 4)
+        assert keys[0] == "rl:{global:s0}:swc"
+        assert len({key_slot(k.encode()) for k in keys}) == 4
+
+
+class TestClusterEvaluation:
+    """Scripted evaluation split per slot, against the multi-node stand-in."""
+
+    def test_single_script_call_is_rejected_by_cluster(self):
+        """Without cluster mode a multi-slot request fails with CROSSSLOT."""
+        limiter = SlidingWindowRateLimiterTx(ClusterStandIn())
+        with pytest.raises(redis.ResponseError, match="CROSSSLOT"):
+            limiter.check_and_consume_many([_tagged("user:1:model:1", 10), _tagged("global", 100)])
+
+    def test_request_is_evaluated_per_slot(self):
+        """Each slot gets its own script call."""
+        cluster = ClusterStandIn()
+        limiter = SlidingWindowRateLimiterTx(cluster, cluster=True)
+        limits = [_tagged("user:1:model:1", 10), _tagged("tenant:1", 50), _tagged("global", 100)]
+
+        decisions = limiter.check_and_consume_many(limits)
+
+        assert [(d.allowed, d.count) for d in decisions] == [(True, 1), (True, 1), (True, 1)]
+        assert sum(cluster.calls) == len({key_slot(lim.key.encode()) for lim in limits}) == 3
+
+    def test_rejection_in_one_slot_rolls_back_the_others(self):
+        """All-or-nothing holds across slots: admitted slots are undone."""
+        cluster = ClusterStandIn()
+        limiter = SlidingWindowRateLimiterTx(cluster, cluster=True)
+        limits = [_tagged("user:1:model:1", 1), _tagged("global", 100)]
+
+        limiter.check_and_consume_many(limits)
+        decisions = limiter.check_and_consume_many(limits)
+
+        assert [(d.allowed, d.count) for d in decisions] == [(False, 1), (True, 1)]
+        assert cluster.zcard("rl:{global}") == 1
+
+    def test_batch_groups_share_slot_calls(self):
+        """A batch makes one call per slot, not per request."""
+        cluster = ClusterStandIn()
+        limiter = SlidingWindowRateLimiterTx(cluster, cluster=True)
+        groups = [[_tagged(f"user:{i}:model:1", 10), _tagged("global", 100)] for i in range(5)]
+
+        results = limiter.check_and_consume_batch(groups)
+
+        assert all(d.allowed for decisions in results for d in decisions)
+        assert results[-1][1].count == 5
+        slots = {key_slot(lim.key.encode()) for group in groups for lim in group}
+        assert sum(cluster.calls) == len(slots)
+
+    def test_sharded_policy_uses_per_shard_share(self):
+        """Sharded policies check their write shard against limit / shards."""
+        cluster = ClusterStandIn()
+        limiter = SlidingWindowRateLimiterTx(cluster, cluster=True)
+        lim = _tagged("global", 8, shards=4)
+
+        admitted = sum(limiter.check_and_consume_many([lim])[0].allowed for _ in range(200))
+
+        assert admitted == 8
+        assert all(cluster.zcard(k) == 2 for k in shard_keys("rl:{global}", 4))
+
+    def test_async_engine_rolls_back_across_slots(self):
+        """The asyncio engine gathers slot calls and undoes partial admissions."""
+        cluster = AsyncClusterStandIn()
+        limiter = AsyncSlidingWindowRateLimiterTx(cluster, cluster=True)
+        limits = [_tagged("user:1:model:1", 1), _tagged("global", 100)]
+
+        asyncio.run(limiter.check_and_consume_many(limits))
+        decisions = asyncio.run(limiter.check_and_consume_many(limits))
+
+        assert [d.allowed for d in decisions] == [False, True]
+        assert cluster.zcard("rl:{global}") == 1
@@ -0,0 +1,72 @@
+import pytest
+from unittest.mock import MagicMock
+
+from concurrency_limiter import ConcurrencyLimiter, InvalidLease, decode_lease, encode_lease
+from policy_resolver import CONCURRENCY, EffectiveLimit
+
+
+def _limit(key, limit, window_seconds=30, scope="TENANT"):
+    return EffectiveLimit(key=key, window_seconds=window_seconds, limit=limit, label=scope,
+                          scope=scope, limit_type=CONCURRENCY)
+
+
+def _limiter(replies, cluster=False):
+    """ConcurrencyLimiter whose acquire script returns `replies` in turn; returns (limiter, acquire, release)."""
+    client = MagicMock()
+    acquire, release = MagicMock(side_effect=replies), MagicMock(return_value=1)
+    client.register_script.side_effect = [acquire, release]
+    return ConcurrencyLimiter(client, cluster=cluster), acquire, release
+
+
+class TestConcurrencyLimiter:
+    """Unit tests for in-flight leases."""
+
+    def test_acquire_is_one_script_call(self):
+        """All keys, limits and lease timeouts go to one call; the lease id names the keys."""
+        limiter, acquire, _ = _limiter([[1, 3, 1, 5000, 6000]])
+        limits = [_limit("rl:tenant:1:conc", 4), _limit("rl:global:conc", 100, window_seconds=60, scope="GLOBAL")]
+
+        lease_id, decisions = limiter.acquire(limits)
+
+        kwargs = acquire.call_args.kwargs
+        assert kwargs["keys"] == ["rl:tenant:1:conc", "rl:global:conc"]
+        assert kwargs["args"][2:] == [4, 30_000, 100, 60_000]
+        assert decisions == [(True, 3, 5000), (True, 1, 6000)]
+        lease, keys = decode_lease(lease_id)
+        assert lease == kwargs["args"][1] and keys == kwargs["keys"]
+
+    def test_rejection_reports_which_policy_is_full(self):
+        """No lease; policies that still had a free slot stay allowed."""
+        limiter, _, _ = _limiter([[0, 4, 7, 5000, 6000]])
+
+        lease_id, decisions = limiter.acquire([_limit("rl:tenant:1:conc", 4), _limit("rl:global:conc", 100)])
+
+        assert lease_id is None
+        assert [d.allowed for d in decisions] == [False, True]
+
+    def test_cluster_rolls_back_admitted_slots(self):
+        """On a cluster a slot that admitted is released when another slot rejects."""
+        limiter, _, release = _limiter([[1, 2, 5000], [0, 4, 6000]], cluster=True)
+        limits = [_limit("rl:{global}:conc", 100, scope="GLOBAL"), _limit("rl:{tenant:1}:conc", 4)]
+
+        lease_id, decisions = limiter.acquire(limits)
+
+        assert lease_id is None
+        assert decisions == [(True, 1, 5000), (False, 4, 6000)]
+        release.assert_called_once()
+        assert release.call_args.kwargs["keys"] == ["rl:{global}:conc"]
+
+    def test_release_removes_lease_from_its_keys(self):
+        """Release needs only the lease id."""
+        limiter, _, release = _limiter([])
+        lease_id = encode_lease("ab" * 16, ["rl:tenant:1:conc", "rl:global:conc"])
+
+        assert limiter.release(lease_id) == 1
+        release.assert_called_once_with(keys=["rl:tenant:1:conc", "rl:global:conc"], args=["ab" * 16])
+
+    def test_foreign_lease_ids_are_rejected(self):
+        """Lease ids naming non-concurrency keys, or malformed ones, are refused."""
+        with pytest.raises(InvalidLease):
+            decode_lease(encode_lease("ab" * 16, ["rl:tenant:1"]))
+        with pytest.raises(InvalidLease):
+            decode_lease("not-a-lease")
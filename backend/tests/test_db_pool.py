@@ -0,0 +1,95 @@
+import threading
+import pytest
+import psycopg2
+from unittest.mock import MagicMock, patch
+from db_pool import PgConnectionPool, PoolTimeout
+
+
+def _fake_conn():
+    conn = MagicMock()
+    conn.closed = 0
+    return conn
+
+
+class TestPgConnectionPool:
+    """Unit tests for the thread-safe Postgres connection pool."""
+
+    @pytest.fixture
+    def connect(self):
+        with patch('db_pool.psycopg2.connect', side_effect=lambda *a, **k: _fake_conn()) as mock_connect:
+            yield mock_connect
+
+    def test_opens_min_size_connections_eagerly(self, connect):
+        """min_size connections are opened at construction in autocommit mode."""
+        pool = PgConnectionPool("dsn", min_size=2, max_size=4)
+        assert connect.call_count == 2
+        assert pool.stats()["idle"] == 2
+        conn = pool.acquire()
+        assert conn.autocommit is True
+
+    def test_reuses_released_connection(self, connect):
+        """A released connection is handed out again."""
+        pool = PgConnectionPool("dsn", min_size=1, max_size=2)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+        assert first is second
+        assert connect.call_count == 1
+
+    def test_grows_up_to_max_then_times_out(self, connect):
+        """Acquire beyond max_size waits and raises PoolTimeout."""
+        pool = PgConnectionPool("dsn", min_size=0, max_size=2, acquire_timeout=0.05)
+        pool.acquire()
+        pool.acquire()
+        assert pool.stats()["saturation"] == 1.0
+        with pytest.raises(PoolTimeout):
+            pool.acquire()
+        assert pool.stats()["timeouts"] == 1
+
+    def test_waiter_gets_released_connection(self, connect):
+        """A blocked acquire is woken by a release."""
+        pool = PgConnectionPool("dsn", min_size=1, max_size=1, acquire_timeout=2)
+        held = pool.acquire()
+        got = []
+        t = threading.Thread(target=lambda: got.append(pool.acquire()))
+        t.start()
+        pool.release(held)
+        t.join(timeout=2)
+        assert got == [held]
+
+    def test_broken_connection_is_discarded(self, connect):
+        """OperationalError inside the block drops the connection."""
+        pool = PgConnectionPool("dsn", min_size=1, max_size=1)
+        with pytest.raises(psycopg2.OperationalError):
+            with pool.connection() as conn:
+                raise psycopg2.OperationalError("server closed the connection")
+        conn.close.assert_called_once()
+        assert pool.stats()["size"] == 0
+        with pool.connection() as fresh:
+            assert fresh is not conn
+
+    def test_stale_connection_failing_health_check_is_replaced(self, connect):
+        """Idle connections are probed and replaced if the probe fails."""
+        pool = PgConnectionPool("dsn", min_size=1, max_size=1, health_check_interval=0)
+        stale = pool._idle[0][0]
+        stale.cursor.return_value.__enter__.return_value.execute.side_effect = psycopg2.OperationalError()
+
+        conn = pool.acquire()
+
+        assert conn is not stale
+        assert pool.stats()["reconnects"] == 1
+
+    def test_connection_released_after_close_is_closed(self, connect):
+        """A connection still borrowed when the pool closes is closed on release."""
+        pool = PgConnectionPool("dsn", min_size=1, max_size=1)
+        with pool.connection() as conn:
+            pool.close()
+            conn.close.assert_not_called()
+        conn.close.assert_called_once()
+        assert pool.stats()["size"] == 0
+
+    def test_invalid_sizes_rejected(self, connect):
+        """min_size may not exceed max_size."""
+        with pytest.raises(ValueError):
+            PgConnectionPool("dsn", min_size=3, max_size=2)
@@ -0,0 +1,147 @@
+import pytest
+
+from degraded_mode import (
+    FAIL_CLOSED,
+    FAIL_OPEN,
+    CircuitBreaker,
+    LocalRateLimiter,
+    parse_modes,
+)
+from policy_resolver import EffectiveLimit
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _limit(key, limit, scope="USER_MODEL", window_seconds=60):
+    return EffectiveLimit(key=key, window_seconds=window_seconds, limit=limit, label=scope, scope=scope)
+
+
+class TestCircuitBreaker:
+    """Unit tests for the Redis circuit breaker."""
+
+    def test_opens_after_consecutive_failures(self):
+        """Failures below the threshold keep it closed; reaching it opens the breaker."""
+        breaker = CircuitBreaker(failure_threshold=3, reset_seconds=5, clock=FakeClock())
+        breaker.record_failure()
+        breaker.record_failure()
+        assert breaker.allow()
+
+        breaker.record_failure()
+
+        assert breaker.state == CircuitBreaker.OPEN
+        assert not breaker.allow()
+        assert breaker.stats() == {"state": "open", "failures": 3, "trips": 1}
+
+    def test_success_resets_failure_count(self):
+        """Only consecutive failures count."""
+        breaker = CircuitBreaker(failure_threshold=2, clock=FakeClock())
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_single_probe_after_reset_timeout(self):
+        """After reset_seconds one caller probes; the rest keep skipping Redis."""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=5, clock=clock)
+        breaker.record_failure()
+
+        clock.now += 5
+        assert breaker.allow()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert not breaker.allow()
+
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.allow()
+
+    def test_failed_probe_reopens(self):
+        """A failing probe opens the breaker for another reset period."""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=5, clock=clock)
+        breaker.record_failure()
+        clock.now += 5
+        breaker.allow()
+
+        breaker.record_failure()
+
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.trips == 2
+        clock.now += 4
+        assert not breaker.allow()
+
+
+class TestLocalRateLimiter:
+    """Unit tests for the per-process degraded-mode limiter."""
+
+    def test_limit_is_divided_by_node_count(self):
+        """Each of `nodes` processes admits its share of the limit."""
+        limiter = LocalRateLimiter(nodes=4, clock=FakeClock(1_000_040.0))
+        lim = _limit("rl:u", 10)
+
+        admitted = sum(limiter.check([lim])[0].allowed for _ in range(10))
+
+        assert admitted == 3  # ceil(10 / 4)
+
+    def test_previous_window_is_weighted(self):
+        """The previous window counts in proportion to its overlap."""
+        clock = FakeClock(1_000_040.0)  # 20 s into a 60 s window
+        limiter = LocalRateLimiter(clock=clock)
+        lim = _limit("rl:u", 10)
+        for _ in range(9):
+            limiter.check([lim])
+
+        clock.now += 60  # same offset in the next window: 2/3 of 9 still counts
+        decision = limiter.check([lim])[0]
+
+        assert decision.allowed
+        assert decision.count == 7
+
+    def test_cost_policies_count_units(self):
+        """COST policies are charged the request's cost against their local share."""
+        from dataclasses import replace
+        limiter = LocalRateLimiter(nodes=2, clock=FakeClock(1_000_040.0))
+        lim = replace(_limit("rl:t:cost", 1000), limit_unit="COST", cost=300)
+
+        decisions = [limiter.check([lim])[0] for _ in range(2)]
+
+        assert [d.allowed for d in decisions] == [True, False]  # 300 + 300 > 500
+        assert decisions[0].count == 600
+
+    def test_fail_open_and_closed_per_scope(self):
+        """Scopes can skip counting (open) or reject (closed) while degraded."""
+        limiter = LocalRateLimiter(modes={"GLOBAL": FAIL_OPEN, "TENANT": FAIL_CLOSED})
+
+        open_only = limiter.check([_limit("rl:global", 1, "GLOBAL")] * 3)
+        closed = limiter.check([_limit("rl:tenant:1", 100, "TENANT")], retry_at_ms=123)
+
+        assert all(d.allowed for d in open_only)
+        assert closed[0] == (False, 100, 123)
+
+    def test_rejection_consumes_nothing(self):
+        """All-or-nothing: a rejected request does not count against the other policies."""
+        limiter = LocalRateLimiter(modes={"TENANT": FAIL_CLOSED}, clock=FakeClock(1_000_040.0))
+        user = _limit("rl:u", 1)
+
+        limiter.check([user, _limit("rl:tenant:1", 100, "TENANT")])
+
+        assert limiter.check([user])[0].allowed
+
+    def test_key_count_is_bounded(self):
+        """Beyond max_keys the oldest keys are dropped."""
+        limiter = LocalRateLimiter(max_keys=10, clock=FakeClock(1_000_040.0))
+        for i in range(25):
+            limiter.check([_limit(f"rl:u:{i}", 5)])
+        assert len(limiter._windows) == 10
+
+    def test_parse_modes(self):
+        """Scope names are normalized; unknown modes are rejected."""
+        assert parse_modes("global=open, USER_MODEL=Local,") == {"GLOBAL": "open", "USER_MODEL": "local"}
+        with pytest.raises(ValueError):
+            parse_modes("GLOBAL=maybe")
@@ -1,7 +1,16 @@
+import time
 import pytest
 from unittest.mock import patch, MagicMock
 from fastapi.testclient import TestClient
 from policy_resolver import EffectiveLimit
+from rate_limiter import Decision
+
+
+@pytest.fixture(autouse=True)
+def empty_blocked_cache():
+    """Rejections cached by one test must not answer the next one."""
+    from main import blocked_cache
+    blocked_cache.clear()
 
 
 class TestRateLimitCheckEndpoint:
@@ -35,7 +44,7 @@ class TestRateLimitCheckEndpoint:
     def test_check_rate_limit_allowed(self, client):
         """Test successful rate limit check (allowed)."""
         with patch('main.policy_resolver.resolve') as mock_resolve, \
-             patch('main.rate_limiter.check_and_consume') as mock_consume:
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_consume:
             
             # Mock policy resolution
             mock_resolve.return_value = [
@@ -49,7 +58,7 @@ class TestRateLimitCheckEndpoint:
             ]
             
             # Mock rate limiter returning allowed
-            mock_consume.return_value = (True, 1)
+            mock_consume.return_value = Decision(True, 1)
             
             response = client.post(
                 "/rate-limit/check",
@@ -70,7 +79,7 @@ class TestRateLimitCheckEndpoint:
     def test_check_rate_limit_blocked(self, client):
         """Test rate limit check (blocked)."""
         with patch('main.policy_resolver.resolve') as mock_resolve, \
-             patch('main.rate_limiter.check_and_consume') as mock_consume:
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_consume:
             
             mock_resolve.return_value = [
                 EffectiveLimit(
@@ -83,7 +92,7 @@ class TestRateLimitCheckEndpoint:
             ]
             
             # Mock rate limiter returning blocked
-            mock_consume.return_value = (False, 11)
+            mock_consume.return_value = Decision(False, 11)
             
             response = client.post(
                 "/rate-limit/check",
@@ -104,7 +113,7 @@ class TestRateLimitCheckEndpoint:
     def test_check_rate_limit_multiple_policies(self, client):
         """Test with multiple policies (all passing)."""
         with patch('main.policy_resolver.resolve') as mock_resolve, \
-             patch('main.rate_limiter.check_and_consume') as mock_consume:
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_consume:
             
             mock_resolve.return_value = [
                 EffectiveLimit(
@@ -124,7 +133,7 @@ class TestRateLimitCheckEndpoint:
             ]
             
             # All policies pass
-            mock_consume.side_effect = [(True, 10), (True, 50)]
+            mock_consume.side_effect = [Decision(True, 10), Decision(True, 50)]
             
             response = client.post(
                 "/rate-limit/check",
@@ -143,11 +152,732 @@ class TestRateLimitCheckEndpoint:
             assert "fulfilled" in data
             assert len(data["fulfilled"]) > 0
 
+    def test_check_rate_limit_script_engine(self, client):
+        """Script engine evaluates all policies in one call."""
+        with patch('main.RL_ENGINE', 'script'), \
+             patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_many') as mock_many, \
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_consume:
+
+            mock_resolve.return_value = [
+                EffectiveLimit(
+                    key="rl:user:1:model:1",
+                    window_seconds=3600,
+                    limit=10,
+                    label="USER_MODEL",
+                    scope="USER_MODEL"
+                ),
+                EffectiveLimit(
+                    key="rl:global",
+                    window_seconds=3600,
+                    limit=1000,
+                    label="GLOBAL",
+                    scope="GLOBAL"
+                ),
+            ]
+            mock_many.return_value = [Decision(False, 10), Decision(True, 5)]
+
+            response = client.post(
+                "/rate-limit/check",
+                json={"userId": "user-1", "modelId": "gpt-4o"}
+            )
+
+            assert response.status_code == 200
+            data = response.json()
+            assert data["allowed"] is False
+            assert data["limit"] == 10
+            assert "USER_MODEL exceeded" in data["cause"]
+            mock_many.assert_called_once()
+            mock_consume.assert_not_called()
+
+    def test_memory_engine_counts_in_process(self, client):
+        """RL_ENGINE=memory answers checks and peeks without touching Redis."""
+        from memory_rate_limiter import InMemoryRateLimiter
+
+        with patch('main.RL_ENGINE', 'memory'), \
+             patch('main.memory_rate_limiter', InMemoryRateLimiter()), \
+             patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_consume, \
+             patch('main.rate_limiter.peek') as mock_peek:
+
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:user:1:model:1", window_seconds=60, limit=2,
+                               label="USER_MODEL", scope="USER_MODEL"),
+            ]
+            body = {"userId": "user-1", "modelId": "gpt-4o"}
+            results = [client.post("/rate-limit/check", json=body).json() for _ in range(3)]
+            peek = client.post("/rate-limit/peek", json=body).json()
+
+            mock_consume.assert_not_called()
+            mock_peek.assert_not_called()
+
+        assert [r["allowed"] for r in results] == [True, True, False]
+        assert peek["policies"][0]["remaining"] == 0
+
+    def test_counter_policy_uses_counter_engine(self, client):
+        """In tx mode SLIDING_COUNTER policies go to the counter engine."""
+        with patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_log, \
+             patch('main.counter_rate_limiter.check_and_consume_detailed') as mock_counter:
+
+            mock_resolve.return_value = [
+                EffectiveLimit(
+                    key="rl:user:1:model:1",
+                    window_seconds=3600,
+                    limit=10,
+                    label="USER_MODEL",
+                    scope="USER_MODEL"
+                ),
+                EffectiveLimit(
+                    key="rl:global:swc",
+                    window_seconds=3600,
+                    limit=1000000,
+                    label="GLOBAL",
+                    scope="GLOBAL",
+                    algorithm="SLIDING_COUNTER",
+                    buckets=4
+                ),
+            ]
+            mock_log.return_value = Decision(True, 1)
+            mock_counter.return_value = Decision(True, 500)
+
+            response = client.post(
+                "/rate-limit/check",
+                json={"userId": "user-1", "modelId": "gpt-4o"}
+            )
+
+            assert response.status_code == 200
+            assert response.json()["allowed"] is True
+            mock_counter.assert_called_once_with(
+                key="rl:global:swc", window_seconds=3600, limit=1000000, buckets=4, shards=1
+            )
+            mock_log.assert_called_once()
+
+    def test_tx_engine_routes_sharded_policies(self, client):
+        """In tx mode a sharded sliding-log policy uses the sharded check."""
+        with patch('main.RL_ENGINE', 'tx'), \
+             patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_sharded') as mock_sharded, \
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_log:
+
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:global", window_seconds=3600, limit=1000000,
+                               label="GLOBAL", scope="GLOBAL", shards=8),
+            ]
+            mock_sharded.return_value = Decision(True, 12)
+
+            response = client.post(
+                "/rate-limit/check",
+                json={"userId": "user-1", "modelId": "gpt-4o"}
+            )
+
+            assert response.json()["allowed"] is True
+            mock_sharded.assert_called_once_with(
+                key="rl:global", window_seconds=3600, limit=1000000, shards=8
+            )
+            mock_log.assert_not_called()
+
+    def test_leased_policy_skips_redis_and_refunds_on_reject(self, client):
+        """Leased policies are served locally and refunded when Redis rejects."""
+        lease_manager = MagicMock()
+        lease_manager.handles.side_effect = lambda p: p.scope == "GLOBAL"
+        lease_manager.consume.return_value = [Decision(True, 10)]
+        with patch('main.lease_manager', lease_manager), \
+             patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_consume:
+
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:user:1:model:1", window_seconds=3600, limit=10,
+                               label="USER_MODEL", scope="USER_MODEL"),
+                EffectiveLimit(key="rl:global", window_seconds=3600, limit=1000000,
+                               label="GLOBAL", scope="GLOBAL"),
+            ]
+            mock_consume.return_value = Decision(False, 10)
+
+            response = client.post(
+                "/rate-limit/check",
+                json={"userId": "user-1", "modelId": "gpt-4o"}
+            )
+
+            assert response.json()["allowed"] is False
+            mock_consume.assert_called_once()
+            assert mock_consume.call_args.kwargs["key"] == "rl:user:1:model:1"
+            refunded = list(lease_manager.refund.call_args.args[0])
+            assert [p.key for p in refunded] == ["rl:global"]
+
+    def test_metrics_endpoint(self, client):
+        """/metrics exposes check latency and per-scope decisions in Prometheus format."""
+        with patch('main.RL_ENGINE', 'tx'), \
+             patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_consume:
+
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:tenant:1", window_seconds=60, limit=10,
+                               label="TENANT", scope="TENANT"),
+            ]
+            mock_consume.return_value = Decision(True, 1)
+            client.post("/rate-limit/check", json={"userId": "user-1", "modelId": "gpt-4o"})
+
+        response = client.get("/metrics")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        body = response.text
+        assert 'rl_check_duration_seconds_count{endpoint="check"}' in body
+        assert 'rl_policy_decisions_total{outcome="allowed",scope="TENANT"}' in body
+        assert "rl_db_pool_saturation" in body
+        assert "rl_identity_cache_hit_ratio" in body
+
+    def test_blocked_response_carries_retry_after(self, client):
+        """A rejection reports when the failing policy frees up, in the body and headers."""
+        now_ms = int(time.time() * 1000)
+        with patch('main.RL_ENGINE', 'tx'), \
+             patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_consume:
+
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:user:1:model:1", window_seconds=60, limit=10,
+                               label="USER_MODEL", scope="USER_MODEL"),
+            ]
+            mock_consume.return_value = Decision(False, 10, now_ms + 2500)
+            response = client.post("/rate-limit/check", json={"userId": "user-1", "modelId": "gpt-4o"})
+
+        data = response.json()
+        assert data["allowed"] is False
+        assert data["resetAt"] == now_ms + 2500
+        assert 0 < data["retryAfterMs"] <= 2500
+        assert response.headers["Retry-After"] == "3"
+        assert response.headers["RateLimit-Limit"] == "10"
+        assert response.headers["RateLimit-Remaining"] == "0"
+
+    def test_blocked_key_is_rejected_from_cache_until_reset(self, client):
+        """After Redis rejects a key, repeats are answered locally until its reset time."""
+        now_ms = int(time.time() * 1000)
+        with patch('main.RL_ENGINE', 'tx'), \
+             patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_consume, \
+             patch('main.time.time') as mock_time:
+
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:apikey:1", window_seconds=60, limit=10,
+                               label="API_KEY", scope="API_KEY"),
+            ]
+            mock_time.return_value = now_ms / 1000
+            mock_consume.return_value = Decision(False, 10, now_ms + 2000)
+            body = {"userId": "user-1", "modelId": "gpt-4o", "apiKey": "k"}
+            first = client.post("/rate-limit/check", json=body).json()
+            cached = client.post("/rate-limit/check", json=body).json()
+
+            assert mock_consume.call_count == 1
+            assert cached["allowed"] is False
+            assert cached["resetAt"] == first["resetAt"] == now_ms + 2000
+
+            mock_time.return_value = (now_ms + 2000) / 1000
+            mock_consume.return_value = Decision(True, 10, now_ms + 60_000)
+            assert client.post("/rate-limit/check", json=body).json()["allowed"] is True
+            assert mock_consume.call_count == 2
+
+    def test_allowed_response_has_rate_limit_headers(self, client):
+        """Admitted checks report the primary policy's remaining quota, without Retry-After."""
+        with patch('main.RL_ENGINE', 'tx'), \
+             patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_consume:
+
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:tenant:1", window_seconds=60, limit=10,
+                               label="TENANT", scope="TENANT"),
+            ]
+            mock_consume.return_value = Decision(True, 4, int(time.time() * 1000) + 60_000)
+            response = client.post("/rate-limit/check", json={"userId": "user-1", "modelId": "gpt-4o"})
+
+        assert response.json()["retryAfterMs"] is None
+        assert response.headers["RateLimit-Remaining"] == "6"
+        assert response.headers["RateLimit-Reset"] == "60"
+        assert "Retry-After" not in response.headers
+
+    def test_peek_does_not_consume(self, client):
+        """/rate-limit/peek reports remaining capacity per policy without consuming."""
+        now_ms = int(time.time() * 1000)
+        with patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.peek') as mock_peek, \
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_consume, \
+             patch('main.rate_limiter.check_and_consume_many') as mock_many:
+
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:user:1:model:1", window_seconds=60, limit=10,
+                               label="USER_MODEL", scope="USER_MODEL"),
+                EffectiveLimit(key="rl:global", window_seconds=60, limit=100,
+                               label="GLOBAL", scope="GLOBAL"),
+            ]
+            mock_peek.return_value = [Decision(False, 10, now_ms + 5000), Decision(True, 40, now_ms + 1000)]
+            response = client.post("/rate-limit/peek", json={"userId": "user-1", "modelId": "gpt-4o"})
+
+            mock_consume.assert_not_called()
+            mock_many.assert_not_called()
+
+        data = response.json()
+        assert data["allowed"] is False
+        assert 0 < data["retryAfterMs"] <= 5000
+        assert [(p["label"], p["remaining"]) for p in data["policies"]] == [
+            ("USER_MODEL", 0), ("GLOBAL", 60)
+        ]
+        assert data["policies"][1]["resetAt"] == now_ms + 1000
+
+    def test_acquire_and_release_concurrency_lease(self, client):
+        """/rate-limit/acquire returns a lease id for CONCURRENCY policies; /release frees it."""
+        from concurrency_limiter import encode_lease
+        from policy_resolver import CONCURRENCY
+        lease_id = encode_lease("ab" * 16, ["rl:tenant:1:conc"])
+        with patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.concurrency_limiter.acquire') as mock_acquire, \
+             patch('main.concurrency_limiter.release') as mock_release:
+
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:tenant:1:conc", window_seconds=30, limit=4,
+                               label="TENANT", scope="TENANT", limit_type=CONCURRENCY),
+            ]
+            mock_acquire.return_value = (lease_id, [Decision(True, 3, 0)])
+            mock_release.return_value = 1
+            acquired = client.post("/rate-limit/acquire", json={"userId": "user-1", "modelId": "gpt-4o"})
+            released = client.post("/rate-limit/release", json={"leaseId": lease_id})
+
+            assert mock_resolve.call_args.kwargs["limit_type"] == CONCURRENCY
+            mock_release.assert_called_once_with(lease_id)
+
+        data = acquired.json()
+        assert data["allowed"] is True
+        assert data["leaseId"] == lease_id
+        assert data["policies"][0]["remaining"] == 1
+        assert released.json() == {"released": True}
+
+    def test_acquire_rejected_when_no_slot_free(self, client):
+        """A full concurrency policy yields no lease, a cause and Retry-After."""
+        from policy_resolver import CONCURRENCY
+        now_ms = int(time.time() * 1000)
+        with patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.concurrency_limiter.acquire') as mock_acquire:
+
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:tier:2:conc", window_seconds=30, limit=8,
+                               label="MODEL_TIER", scope="MODEL_TIER", limit_type=CONCURRENCY),
+            ]
+            mock_acquire.return_value = (None, [Decision(False, 8, now_ms + 4000)])
+            response = client.post("/rate-limit/acquire", json={"userId": "user-1", "modelId": "gpt-4o"})
+
+        data = response.json()
+        assert data["allowed"] is False
+        assert data["leaseId"] is None
+        assert "MODEL_TIER concurrency exceeded: 8/8 in flight" in data["cause"]
+        assert response.headers["Retry-After"] == "4"
+
+    def test_release_rejects_unknown_lease(self, client):
+        """Lease ids this service did not issue are refused with 400."""
+        response = client.post("/rate-limit/release", json={"leaseId": "bogus"})
+        assert response.status_code == 400
+
+    def test_check_charges_cost_to_cost_policies(self, client):
+        """The request's cost reaches COST policies; REQUESTS policies still count 1."""
+        with patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_many') as mock_many, \
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_consume:
+
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:tenant:1:cost", window_seconds=60, limit=100000,
+                               label="TENANT", scope="TENANT", limit_unit="COST"),
+                EffectiveLimit(key="rl:user:1:model:1", window_seconds=60, limit=10,
+                               label="USER_MODEL", scope="USER_MODEL"),
+            ]
+            mock_many.return_value = [Decision(True, 32000, 0)]
+            mock_consume.return_value = Decision(True, 1, 0)
+            response = client.post("/rate-limit/check",
+                                   json={"userId": "user-1", "modelId": "gpt-4o", "cost": 32000})
+
+            weighted = mock_many.call_args.args[0]
+            assert [(p.key, p.cost) for p in weighted] == [("rl:tenant:1:cost", 32000)]
+            assert mock_consume.call_args.kwargs["key"] == "rl:user:1:model:1"
+
+        assert response.json()["allowed"] is True
+
+    def test_adjust_charges_difference_to_cost_policies(self, client):
+        """/rate-limit/adjust applies actualCost - cost to COST policies only."""
+        with patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.adjust') as mock_adjust:
+
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:tenant:1:cost", window_seconds=60, limit=100000,
+                               label="TENANT", scope="TENANT", limit_unit="COST"),
+                EffectiveLimit(key="rl:global", window_seconds=60, limit=100,
+                               label="GLOBAL", scope="GLOBAL"),
+            ]
+            response = client.post("/rate-limit/adjust", json={
+                "userId": "user-1", "modelId": "gpt-4o", "cost": 4000, "actualCost": 1200,
+                "chargedAt": 1700000000000,
+            })
+
+            limits, delta, charged_at = mock_adjust.call_args.args
+            assert [p.key for p in limits] == ["rl:tenant:1:cost"]
+            assert delta == -2800
+            assert charged_at == 1700000000000
+
+        assert response.json() == {"delta": -2800, "keys": ["rl:tenant:1:cost"]}
+
+    def test_refund_requires_charge_time(self, client):
+        """Giving units back without the check's chargedAt is refused; /check reports it for COST policies."""
+        refund = client.post("/rate-limit/adjust", json={
+            "userId": "user-1", "modelId": "gpt-4o", "cost": 4000, "actualCost": 1200,
+        })
+        assert refund.status_code == 400
+
+        with patch('main.RL_ENGINE', 'tx'), \
+             patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_consume, \
+             patch('main.rate_limiter.check_and_consume_many') as mock_many:
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:tenant:1:cost", window_seconds=60, limit=100000,
+                               label="TENANT", scope="TENANT", limit_unit="COST"),
+            ]
+            mock_consume.return_value = Decision(True, 4000)
+            mock_many.return_value = [Decision(True, 4000)]
+            before = int(time.time() * 1000)
+            check = client.post("/rate-limit/check", json={"userId": "user-1", "modelId": "gpt-4o", "cost": 4000})
+
+        assert check.json()["allowed"] is True
+        assert before <= check.json()["chargedAt"] <= int(time.time() * 1000)
+
+    def test_invalid_cost_is_rejected(self, client):
+        """Costs below 1 are refused with 400."""
+        response = client.post("/rate-limit/check", json={"userId": "u", "modelId": "m", "cost": 0})
+        assert response.status_code == 400
+
+    def test_stream_answers_frames_by_id(self, client):
+        """/rate-limit/stream evaluates a msgpack message as one batch and echoes frame ids."""
+        import msgpack
+        with patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_batch') as mock_batch:
+
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:user:1:model:1", window_seconds=60, limit=1,
+                               label="USER_MODEL", scope="USER_MODEL"),
+            ]
+            mock_batch.return_value = [[Decision(True, 1, 0)], [Decision(False, 1, 0)]]
+            with client.websocket_connect("/rate-limit/stream") as ws:
+                ws.send_bytes(msgpack.packb([["a", "user-1", "gpt-4o"], ["b", "user-1", "gpt-4o"], ["c", ""]]))
+                frames = msgpack.unpackb(ws.receive_bytes())
+
+            mock_resolve.assert_called_once()
+            assert len(mock_batch.call_args.args[0]) == 2
+
+        by_id = {f[0]: f for f in frames}
+        assert by_id["a"][1:5] == [True, 1, 1, 60]
+        assert by_id["b"][1] is False and "USER_MODEL exceeded" in by_id["b"][7]
+        assert by_id["c"][1] is None
+
+    def test_stream_results_carry_charge_time_for_refunds(self, client):
+        """A COST check over the stream reports chargedAt, which /rate-limit/adjust accepts for a refund."""
+        import msgpack
+        from memory_rate_limiter import InMemoryRateLimiter
+
+        engine = InMemoryRateLimiter(stripes=1)
+        policy = EffectiveLimit(key="rl:tenant:1:cost", window_seconds=60, limit=100000,
+                                label="TENANT", scope="TENANT", limit_unit="COST")
+        with patch('main.RL_ENGINE', 'memory'), \
+             patch('main.memory_rate_limiter', engine), \
+             patch('main.policy_resolver.resolve', return_value=[policy]):
+            before = int(time.time() * 1000)
+            with client.websocket_connect("/rate-limit/stream") as ws:
+                ws.send_bytes(msgpack.packb([["a", "user-1", "gpt-4o", None, None, None, 4000]]))
+                [frame] = msgpack.unpackb(ws.receive_bytes())
+
+            assert frame[1] is True
+            charged_at = frame[8]
+            assert before <= charged_at <= int(time.time() * 1000)
+
+            refund = client.post("/rate-limit/adjust", json={
+                "userId": "user-1", "modelId": "gpt-4o", "cost": 4000, "actualCost": 1200,
+                "chargedAt": charged_at,
+            })
+
+        assert refund.status_code == 200
+        assert refund.json()["delta"] == -2800
+        assert engine.peek([policy])[0].count == 1200
+
+    def test_stream_evaluation_error_is_answered_per_frame(self, client):
+        """An evaluation error answers each check of the message with an error frame."""
+        import msgpack
+        import redis
+        from degraded_mode import CircuitBreaker
+
+        with patch('main.RL_ENGINE', 'tx'), \
+             patch('main.redis_breaker', CircuitBreaker()), \
+             patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_batch') as mock_batch:
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:user:1:model:1", window_seconds=60, limit=1,
+                               label="USER_MODEL", scope="USER_MODEL"),
+            ]
+            mock_batch.side_effect = redis.ResponseError("NOSCRIPT")
+            with client.websocket_connect("/rate-limit/stream") as ws:
+                ws.send_bytes(msgpack.packb([["a", "user-1", "gpt-4o"], ["b", "user-2", "gpt-4o"]]))
+                frames = msgpack.unpackb(ws.receive_bytes())
+
+        assert sorted(f[0] for f in frames) == ["a", "b"]
+        assert all(f[1] is None and "NOSCRIPT" in f[2] for f in frames)
+
+    def test_redis_outage_switches_to_local_limiter(self, client):
+        """Connection errors open the breaker; checks are then answered locally without Redis."""
+        import redis
+        from degraded_mode import CircuitBreaker, LocalRateLimiter
+
+        breaker = CircuitBreaker(failure_threshold=2, reset_seconds=60)
+        with patch('main.RL_ENGINE', 'tx'), \
+             patch('main.redis_breaker', breaker), \
+             patch('main.local_rate_limiter', LocalRateLimiter(modes={"GLOBAL": "open"})), \
+             patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_consume:
+
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:user:1:model:1", window_seconds=60, limit=2,
+                               label="USER_MODEL", scope="USER_MODEL"),
+                EffectiveLimit(key="rl:global", window_seconds=60, limit=1,
+                               label="GLOBAL", scope="GLOBAL"),
+            ]
+            mock_consume.side_effect = redis.ConnectionError("down")
+            body = {"userId": "user-1", "modelId": "gpt-4o"}
+            results = [client.post("/rate-limit/check", json=body).json() for _ in range(4)]
+
+            assert mock_consume.call_count == 2  # breaker opened after two failures
+            peek = client.post("/rate-limit/peek", json=body)
+
+        assert [r["allowed"] for r in results] == [True, True, False, False]
+        assert "USER_MODEL exceeded" in results[2]["cause"]
+        assert breaker.state == CircuitBreaker.OPEN
+        assert peek.status_code == 503
+
+    def test_failed_probe_of_any_kind_reopens_breaker(self):
+        """A half-open probe that raises something other than a connection error reopens the breaker."""
+        import redis
+        import main
+        from degraded_mode import CircuitBreaker
+
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+        breaker.record_failure()
+
+        def probe():
+            raise redis.ResponseError("NOSCRIPT")
+
+        with patch('main.redis_breaker', breaker):
+            with pytest.raises(redis.ResponseError):
+                main._with_breaker(probe, lambda: None)
+
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.trips == 1
+
+    def test_script_errors_do_not_open_breaker(self):
+        """Repeated data errors reach the caller but leave the breaker closed."""
+        import redis
+        import main
+        from degraded_mode import CircuitBreaker
+
+        breaker = CircuitBreaker(failure_threshold=5)
+
+        def evaluate():
+            raise redis.ResponseError("WRONGTYPE Operation against a key holding the wrong kind of value")
+
+        with patch('main.redis_breaker', breaker):
+            for _ in range(10):
+                with pytest.raises(redis.ResponseError):
+                    main._with_breaker(evaluate, lambda: None)
+
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.failures == 0
+
+    def test_cancelled_calls_do_not_open_breaker(self):
+        """Cancellation is not a Redis failure."""
+        import asyncio
+        import main
+        from degraded_mode import CircuitBreaker
+
+        breaker = CircuitBreaker(failure_threshold=1)
+
+        async def evaluate():
+            raise asyncio.CancelledError()
+
+        with patch('main.redis_breaker', breaker):
+            with pytest.raises(asyncio.CancelledError):
+                asyncio.run(main._with_breaker_async(evaluate, lambda: None))
+
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_batch_refunds_leases_when_redis_fails(self, client):
+        """Lease units taken before a failed Redis call are given back before the fallback."""
+        import redis
+        from degraded_mode import CircuitBreaker, LocalRateLimiter
+
+        lease_manager = MagicMock()
+        lease_manager.handles.side_effect = lambda p: p.scope == "GLOBAL"
+        lease_manager.consume.return_value = [Decision(True, 10)]
+        with patch('main.RL_ENGINE', 'tx'), \
+             patch('main.lease_manager', lease_manager), \
+             patch('main.redis_breaker', CircuitBreaker()), \
+             patch('main.local_rate_limiter', LocalRateLimiter()), \
+             patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_batch') as mock_batch:
+
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:user:1:model:1", window_seconds=3600, limit=10,
+                               label="USER_MODEL", scope="USER_MODEL"),
+                EffectiveLimit(key="rl:global", window_seconds=3600, limit=1000000,
+                               label="GLOBAL", scope="GLOBAL"),
+            ]
+            mock_batch.side_effect = redis.ConnectionError("down")
+            response = client.post("/rate-limit/check-batch", json=[{"userId": "user-1", "modelId": "gpt-4o"}])
+
+        assert response.status_code == 200
+        refunded = list(lease_manager.refund.call_args.args[0])
+        assert [p.key for p in refunded] == ["rl:global"]
+
+    def test_decisions_are_audited(self, client, tmp_path):
+        """With an audit log configured, each check queues its decision for the writer."""
+        from audit_log import DecisionAuditLog, audit_files, read_audit_file
+
+        audit = DecisionAuditLog(str(tmp_path))
+        with patch('main.audit_log', audit), \
+             patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_consume:
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:audit", window_seconds=60, limit=1, label="USER", scope="USER"),
+            ]
+            mock_consume.side_effect = [Decision(True, 1), Decision(False, 1, 0)]
+            body = {"userId": "user-1", "modelId": "gpt-4o"}
+            client.post("/rate-limit/check", json=body)
+            client.post("/rate-limit/check", json=body)
+
+        assert audit.stats()["queued"] == 2
+        audit.flush()
+        records = list(read_audit_file(audit_files(str(tmp_path))[0]))
+        assert [(r[1], r[2]) for r in records] == [("check", True), ("check", False)]
+        assert records[1][4] == [["rl:audit", 1, 1, False]]
+        assert "USER exceeded" in records[1][3]
+
+    def test_cached_rejection_reports_only_the_blocking_policy(self, client, tmp_path):
+        """Policies skipped on a blocked-cache hit reach neither the metrics nor the audit log."""
+        import metrics
+        from audit_log import DecisionAuditLog, audit_files, read_audit_file
+
+        def allowed_global():
+            return metrics.REGISTRY.get_sample_value(
+                "rl_policy_decisions_total", {"scope": "GLOBAL", "outcome": "allowed"}
+            ) or 0
+
+        audit = DecisionAuditLog(str(tmp_path))
+        with patch('main.RL_ENGINE', 'tx'), \
+             patch('main.audit_log', audit), \
+             patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_consume:
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:global", window_seconds=60, limit=100, label="GLOBAL", scope="GLOBAL"),
+                EffectiveLimit(key="rl:apikey:1", window_seconds=60, limit=10, label="API_KEY", scope="API_KEY"),
+            ]
+            reset_ms = int(time.time() * 1000) + 30_000
+            mock_consume.side_effect = lambda key, **kw: (
+                Decision(True, 1) if key == "rl:global" else Decision(False, 10, reset_ms)
+            )
+            body = {"userId": "user-1", "modelId": "gpt-4o", "apiKey": "k"}
+            client.post("/rate-limit/check", json=body)
+            calls = mock_consume.call_count
+            before = allowed_global()
+
+            cached = client.post("/rate-limit/check", json=body).json()
+
+            assert mock_consume.call_count == calls
+            assert cached["allowed"] is False
+            assert allowed_global() == before
+
+        audit.flush()
+        records = list(read_audit_file(audit_files(str(tmp_path))[0]))
+        assert records[-1][4] == [["rl:apikey:1", 10, 10, False]]
+
+    def test_server_timing_switched_on_at_runtime(self, client):
+        """POST /admin/diagnostics turns the Server-Timing header on and off."""
+        with patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_consume, \
+             patch('main.server_timing_enabled', False):
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:timing", window_seconds=60, limit=10, label="USER", scope="USER"),
+            ]
+            mock_consume.return_value = Decision(True, 1)
+            body = {"userId": "user-1", "modelId": "gpt-4o"}
+            off = client.post("/rate-limit/check", json=body)
+            status = client.post("/admin/diagnostics", json={"serverTiming": True}).json()
+            on = client.post("/rate-limit/check", json=body)
+
+        assert "server-timing" not in off.headers
+        assert status["serverTiming"] is True
+        spans = [part.split(";")[0] for part in on.headers["server-timing"].split(", ")]
+        assert spans == ["resolve", "evaluate", "build", "total"]
+
+    def test_feedback_shrinks_adaptive_limits(self, client):
+        """An unhealthy report scales adaptive policies down; the response shows both limits."""
+        from main import adaptive_limits
+
+        with patch.object(adaptive_limits, '_feedback', return_value=[b"0.5", -1]) as mock_feedback, \
+             patch.dict(adaptive_limits._scales, clear=True), \
+             patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_consume:
+            mock_resolve.return_value = [
+                EffectiveLimit(key="rl:adaptive", window_seconds=60, limit=100, label="TENANT",
+                               scope="TENANT", adaptive_group="gpu-a"),
+            ]
+            mock_consume.return_value = Decision(True, 1)
+            feedback = client.post("/rate-limit/feedback", json={"group": "gpu-a", "latencyMs": 5000})
+            check = client.post("/rate-limit/check", json={"userId": "user-1", "modelId": "gpt-4o"})
+
+        assert feedback.json() == {"group": "gpu-a", "scale": 0.5, "action": "decreased"}
+        assert mock_feedback.call_args.kwargs["args"][1] == 1
+        assert mock_consume.call_args.kwargs["limit"] == 50
+        assert (check.json()["limit"], check.json()["configuredLimit"]) == (50, 100)
+
+    def test_feedback_requires_a_signal(self, client):
+        """A report without latency, error rate or health is rejected."""
+        response = client.post("/rate-limit/feedback", json={"group": "gpu-a"})
+        assert response.status_code == 400
+
+    def test_feedback_for_unknown_group_is_rejected(self, client):
+        """Once policies are loaded, reports for a group no enabled policy uses get 404."""
+        from main import adaptive_limits
+        from policy_index import PolicyIndex
+
+        index = PolicyIndex()
+        index.replace([{"id": 1, "scope": "GLOBAL", "enabled": True, "adaptive_group": "gpu-a",
+                        "tenant_id": None, "user_id": None, "api_key_id": None,
+                        "model_id": None, "model_tier_id": None}])
+        with patch('main.policy_resolver.policy_index', index), \
+             patch.object(adaptive_limits, '_feedback', return_value=[b"0.7", -1]) as mock_feedback, \
+             patch.dict(adaptive_limits._scales, clear=True):
+            unknown = client.post("/rate-limit/feedback", json={"group": "gpu-z", "healthy": False})
+            known = client.post("/rate-limit/feedback", json={"group": "gpu-a", "healthy": False})
+
+            assert unknown.status_code == 404
+            assert known.status_code == 200
+            assert mock_feedback.call_count == 1
+            assert set(adaptive_limits.scales()) == {"gpu-a"}
+
+    def test_invalidate_identity_cache(self, client):
+        """Admin endpoint forwards to the resolver invalidation hooks."""
+        with patch('main.policy_resolver.invalidate_api_key') as mock_invalidate:
+            response = client.post(
+                "/admin/identity-cache/invalidate",
+                json={"apiKey": "hash_free_key"}
+            )
+        assert response.status_code == 200
+        mock_invalidate.assert_called_once_with("hash_free_key")
+
     def test_health_endpoint(self, client):
         """Test /health endpoint."""
         response = client.get("/health")
         assert response.status_code == 200
         assert response.json()["status"] == "ok"
+        assert "saturation" in response.json()["dbPool"]
 
 
 class TestPolicySelection:
@@ -162,7 +892,7 @@ class TestPolicySelection:
     def test_primary_policy_minimum_left_capacity(self, client):
         """Test that primary policy is selected by minimum remaining capacity."""
         with patch('main.policy_resolver.resolve') as mock_resolve, \
-             patch('main.rate_limiter.check_and_consume') as mock_consume:
+             patch('main.rate_limiter.check_and_consume_detailed') as mock_consume:
             
             # Two policies: one with 10 left, one with 100 left
             # The one with 10 left should be primary (tighter constraint)
@@ -184,7 +914,7 @@ class TestPolicySelection:
             ]
             
             # Tier has 90 left (100-10), Tenant has 10 left (50-40)
-            mock_consume.side_effect = [(True, 10), (True, 40)]
+            mock_consume.side_effect = [Decision(True, 10), Decision(True, 40)]
             
             response = client.post(
                 "/rate-limit/check",
@@ -200,3 +930,72 @@ class TestPolicySelection:
             # Primary should be TENANT (minimum left=10)
             assert data["limit"] == 50
             assert data["count"] == 40
+
+
+class TestAsyncEvaluation:
+    """Tests for the async evaluation path used when RL_ASYNC=1."""
+
+    def test_tx_mode_evaluates_each_policy(self):
+        """tx mode dispatches to the concurrent per-policy evaluation."""
+        import asyncio
+        from unittest.mock import AsyncMock
+        import main
+
+        policies = [
+            EffectiveLimit(key="rl:a", window_seconds=60, limit=10, label="A", scope="TENANT"),
+        ]
+        with patch('main.RL_ENGINE', 'tx'), \
+             patch('main.async_rate_limiter.check_and_consume_each',
+                   new=AsyncMock(return_value=[Decision(True, 3)])):
+            evaluated = asyncio.run(main._evaluate_policies_async(policies))
+
+        assert evaluated == [{"policy": policies[0], "allowed": True, "count": 3, "resetMs": 0}]
+
+
+class TestBatchEndpoint:
+    """Integration tests for /rate-limit/check-batch."""
+
+    @pytest.fixture
+    def client(self):
+        from main import app
+        return TestClient(app)
+
+    def test_batch_resolves_once_per_identity_and_preserves_order(self, client):
+        """Duplicate identities are resolved once; one engine call for the batch."""
+        tenant_policy = EffectiveLimit(key="rl:tenant:1", window_seconds=60, limit=2,
+                                       label="TENANT", scope="TENANT")
+        with patch('main.policy_resolver.resolve') as mock_resolve, \
+             patch('main.rate_limiter.check_and_consume_batch') as mock_batch:
+            mock_resolve.return_value = [tenant_policy]
+            mock_batch.return_value = [
+                [Decision(True, 1)], [Decision(True, 2)], [Decision(False, 2)]
+            ]
+
+            body = {"userId": "u1", "modelId": "gpt-4o", "tenantId": "t1"}
+            response = client.post("/rate-limit/check-batch", json=[body, body, body])
+
+        assert response.status_code == 200
+        data = response.json()
+        assert [d["allowed"] for d in data] == [True, True, False]
+        assert data[1]["count"] == 2
+        mock_resolve.assert_called_once()
+        mock_batch.assert_called_once()
+        assert len(mock_batch.call_args.args[0]) == 3
+
+    def test_batch_rejects_invalid_entry(self, client):
+        """An entry without userId fails the batch with its index."""
+        response = client.post(
+            "/rate-limit/check-batch",
+            json=[{"userId": "u1", "modelId": "m"}, {"userId": "", "modelId": "m"}],
+        )
+        assert response.status_code == 400
+        assert "requests[1]" in response.json()["detail"]
+
+    def test_batch_size_limit(self, client):
+        """Oversized batches are refused."""
+        with patch('main.RL_MAX_BATCH_SIZE', 1):
+            response = client.post(
+                "/rate-limit/check-batch",
+                json=[{"userId": "u1", "modelId": "m"}, {"userId": "u2", "modelId": "m"}],
+            )
+        assert response.status_code == 413
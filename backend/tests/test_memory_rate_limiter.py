@@ -0,0 +1,217 @@
+import threading
+import time
+
+from memory_rate_limiter import InMemoryRateLimiter, _Log
+from policy_resolver import EffectiveLimit
+from rate_limiter import SLIDING_COUNTER
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _limit(key, limit, window_seconds=60, **kwargs):
+    return EffectiveLimit(
+        key=key, window_seconds=window_seconds, limit=limit, label="USER_MODEL", scope="USER_MODEL", **kwargs
+    )
+
+
+class TestInMemoryRateLimiter:
+    """Unit tests for the in-process ring-buffer engine."""
+
+    def test_check_and_consume_admits_up_to_limit(self):
+        """Same contract as the Redis engine: (allowed, count after the operation)."""
+        limiter = InMemoryRateLimiter(clock=FakeClock())
+
+        results = [limiter.check_and_consume("rl:u", 60, 3) for _ in range(4)]
+
+        assert results == [(True, 1), (True, 2), (True, 3), (False, 3)]
+
+    def test_window_slides(self):
+        """Entries leave the window exactly window_seconds after they were added."""
+        clock = FakeClock()
+        limiter = InMemoryRateLimiter(clock=clock)
+        limiter.check_and_consume("rl:u", 60, 2)
+        clock.now += 30
+        limiter.check_and_consume("rl:u", 60, 2)
+
+        clock.now += 30  # first entry expires
+        assert limiter.check_and_consume("rl:u", 60, 2) == (True, 2)
+        assert limiter.check_and_consume("rl:u", 60, 2) == (False, 2)
+
+    def test_reset_is_when_blocking_entry_expires(self):
+        """A rejected key resets when the entry holding it at the limit leaves the window."""
+        clock = FakeClock()
+        limiter = InMemoryRateLimiter(clock=clock)
+        limiter.check_and_consume("rl:u", 60, 2)
+        clock.now += 10
+        limiter.check_and_consume("rl:u", 60, 2)
+
+        decision = limiter.check_and_consume_detailed("rl:u", 60, 2)
+        wall = limiter._now()[1]
+
+        assert not decision.allowed
+        assert abs(decision.reset_ms - (wall + 50_000)) <= 5
+
+    def test_ring_buffer_grows_up_to_limit(self):
+        """Capacity starts small, doubles on demand and never exceeds the limit."""
+        log = _Log(16)
+        for t in range(40):
+            log.append(t, 40)
+        assert len(log.times) == 40
+        log.trim(29)
+        assert log.size == 10 and log.at(0) == 30
+
+    def test_many_is_all_or_nothing(self):
+        """A rejected policy means no policy of the request consumes."""
+        limiter = InMemoryRateLimiter(clock=FakeClock())
+        user, tenant = _limit("rl:u", 10), _limit("rl:t", 1)
+        limiter.check_and_consume_many([tenant])
+
+        decisions = limiter.check_and_consume_many([user, tenant])
+
+        assert [d.allowed for d in decisions] == [True, False]
+        assert limiter.peek([user])[0].count == 0
+
+    def test_sliding_counter_weights_previous_bucket(self):
+        """SLIDING_COUNTER policies use the same weighted estimate as the Redis script."""
+        clock = FakeClock(1_000_040.0)  # 20 s into a 60 s bucket
+        limiter = InMemoryRateLimiter(clock=clock)
+        lim = _limit("rl:c", 10, algorithm=SLIDING_COUNTER)
+        for _ in range(9):
+            limiter.check_and_consume_many([lim])
+
+        clock.now += 60  # same offset, next bucket: 2/3 of 9 still counts
+        decision = limiter.check_and_consume_many([lim])[0]
+
+        assert decision.allowed
+        assert decision.count == 7
+
+    def test_cost_policies_consume_their_cost(self):
+        """COST logs and counters sum units; a request fails once its cost does not fit."""
+        from policy_resolver import with_cost
+        limiter = InMemoryRateLimiter(clock=FakeClock())
+        log = _limit("rl:t:cost", 1000, limit_unit="COST")
+        counter = _limit("rl:g:cost", 1000, limit_unit="COST", algorithm=SLIDING_COUNTER)
+
+        first = limiter.check_and_consume_many(with_cost([log, counter], 600))
+        second = limiter.check_and_consume_many(with_cost([log, counter], 500))
+
+        assert [d.count for d in first] == [600, 600]
+        assert [d.allowed for d in second] == [False, False]
+
+    def test_adjust_refunds_units(self):
+        """A negative adjustment frees units for the rest of the window."""
+        from policy_resolver import with_cost
+        limiter = InMemoryRateLimiter(clock=FakeClock())
+        log = _limit("rl:t:cost", 1000, limit_unit="COST")
+        limiter.check_and_consume_many(with_cost([log], 900))
+
+        limiter.adjust([log], -600)
+
+        decision = limiter.check_and_consume_many(with_cost([log], 500))[0]
+        assert (decision.allowed, decision.count) == (True, 800)
+
+    def test_refund_expires_with_its_charge(self):
+        """A refund booked at the charge's time leaves the window with it, for logs and counters."""
+        from policy_resolver import with_cost
+        clock = FakeClock()
+        limiter = InMemoryRateLimiter(clock=clock)
+        log = _limit("rl:t:cost", 1000, limit_unit="COST")
+        counter = _limit("rl:g:cost", 1000, limit_unit="COST", algorithm=SLIDING_COUNTER, buckets=6)
+        charged_at = int(time.time() * 1000)
+        limiter.check_and_consume_many(with_cost([log, counter], 900))
+
+        clock.now += 30
+        limiter.adjust([log, counter], -600, charged_at_ms=charged_at - 30_000)
+        assert [d.count for d in limiter.peek([log, counter])] == [300, 300]
+
+        clock.now += 40  # past the first window: charge and refund are both gone
+        decisions = limiter.check_and_consume_many(with_cost([log, counter], 1000))
+        assert [(d.allowed, d.count) for d in decisions] == [(True, 1000), (True, 1000)]
+
+    def test_peek_does_not_consume_or_create_keys(self):
+        """peek reports usage without counting and without allocating state."""
+        limiter = InMemoryRateLimiter(clock=FakeClock())
+        limiter.check_and_consume("rl:u", 60, 5)
+
+        decisions = limiter.peek([_limit("rl:u", 5), _limit("rl:other", 5)])
+
+        assert [d.count for d in decisions] == [1, 0]
+        assert limiter.stats()["keys"] == 1
+
+    def test_idle_keys_are_evicted(self):
+        """A sweep drops keys whose window has emptied."""
+        clock = FakeClock()
+        limiter = InMemoryRateLimiter(stripes=1, sweep_every=10, clock=clock)
+        for i in range(5):
+            limiter.check_and_consume(f"rl:u:{i}", 1, 5)
+
+        clock.now += 2
+        for _ in range(5):
+            limiter.check_and_consume("rl:live", 60, 100)
+
+        assert limiter.stats()["keys"] == 1
+        assert limiter.evictions == 5
+
+    def test_key_count_is_bounded(self):
+        """Live keys beyond max_keys are dropped oldest first."""
+        limiter = InMemoryRateLimiter(stripes=2, max_keys=10, clock=FakeClock())
+        for i in range(50):
+            limiter.check_and_consume(f"rl:u:{i}", 60, 5)
+        assert limiter.stats()["keys"] <= 12
+
+    def test_over_cap_evicts_oldest_without_full_sweep(self):
+        """At the cap each new key evicts only the oldest one; idle keys wait for the sweep."""
+        clock = FakeClock()
+        limiter = InMemoryRateLimiter(stripes=1, max_keys=3, sweep_every=1000, clock=clock)
+        for i in range(3):
+            limiter.check_and_consume(f"rl:u:{i}", 1, 5)
+        clock.now += 2  # all three are idle now
+
+        limiter.check_and_consume("rl:new", 60, 5)
+
+        assert list(limiter._stripes[0].windows) == ["rl:u:1", "rl:u:2", "rl:new"]
+        assert limiter.evictions == 1
+
+    def test_over_cap_keeps_busy_keys(self):
+        """Past the cap, idle and least recently used keys go before a saturated hot key."""
+        clock = FakeClock()
+        limiter = InMemoryRateLimiter(stripes=1, max_keys=100, sweep_every=10_000, clock=clock)
+        for _ in range(5):
+            limiter.check_and_consume("rl:global", 3600, 5)
+
+        for i in range(100):
+            limiter.check_and_consume(f"rl:u:{i}", 1, 5)
+            clock.now += 2
+
+        assert limiter.check_and_consume("rl:global", 3600, 5) == (False, 5)
+
+        for i in range(100, 300):  # live keys only: the LRU one goes
+            limiter.check_and_consume(f"rl:u:{i}", 3600, 5)
+            limiter.check_and_consume("rl:global", 3600, 5)
+
+        assert limiter.check_and_consume("rl:global", 3600, 5) == (False, 5)
+        assert limiter.stats()["keys"] == 100
+
+    def test_concurrent_checks_never_exceed_limit(self):
+        """Striped locks keep check-and-consume atomic across threads."""
+        limiter = InMemoryRateLimiter(stripes=4)
+        lims = [_limit("rl:shared", 100), _limit("rl:tenant", 1000)]
+        admitted = []
+
+        def worker():
+            for _ in range(100):
+                admitted.append(limiter.check_and_consume_many(lims)[0].allowed)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert sum(admitted) == 100
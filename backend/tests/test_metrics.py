@@ -0,0 +1,71 @@
+from unittest.mock import MagicMock
+
+from prometheus_client import CollectorRegistry
+
+import metrics
+from policy_resolver import EffectiveLimit
+from rate_limiter import SlidingWindowRateLimiterTx
+from ttl_cache import TTLCache
+
+
+def _policy(scope):
+    return EffectiveLimit(key=f"rl:{scope.lower()}", window_seconds=60, limit=10,
+                          label=scope, scope=scope)
+
+
+class TestMetrics:
+    """Unit tests for the Prometheus instrumentation."""
+
+    def test_record_decisions_by_scope_and_outcome(self):
+        """Each evaluated policy increments its pre-bound scope/outcome counter."""
+        before = metrics.REGISTRY.get_sample_value(
+            "rl_policy_decisions_total", {"scope": "TENANT", "outcome": "denied"}
+        ) or 0
+
+        metrics.record_decisions([
+            {"policy": _policy("TENANT"), "allowed": False, "count": 10},
+            {"policy": _policy("GLOBAL"), "allowed": True, "count": 3},
+        ])
+
+        assert metrics.REGISTRY.get_sample_value(
+            "rl_policy_decisions_total", {"scope": "TENANT", "outcome": "denied"}
+        ) == before + 1
+
+    def test_stats_collector_reads_components_at_scrape_time(self):
+        """Cache, pool and engine counters are exposed without request-path hooks."""
+        cache = TTLCache()
+        cache.set("k", 1)
+        cache.get("k")
+        cache.get("missing")
+        pool_stats = {"size": 3, "inUse": 2, "idle": 1, "waiting": 0, "maxSize": 10,
+                      "saturation": 0.2, "timeouts": 4, "reconnects": 1}
+        registry = CollectorRegistry()
+        registry.register(metrics.StatsCollector(
+            identity_cache=cache,
+            pool_stats=lambda: pool_stats,
+            engine_stats={"sync": lambda: {"watchRetries": 7, "contentionFallbacks": 2}},
+            blocked_cache=cache,
+        ))
+
+        assert registry.get_sample_value("rl_identity_cache_hit_ratio") == 0.5
+        assert registry.get_sample_value("rl_db_pool_connections", {"state": "in_use"}) == 2
+        assert registry.get_sample_value("rl_db_pool_timeouts_total") == 4
+        assert registry.get_sample_value("rl_watch_retries_total", {"engine": "sync"}) == 7
+        assert registry.get_sample_value("rl_contention_fallbacks_total", {"engine": "sync"}) == 2
+        assert registry.get_sample_value("rl_blocked_cache_hits_total") == 1
+        assert registry.get_sample_value("rl_blocked_cache_entries") == 1
+
+    def test_retry_observer_gets_retries_per_call(self, redis_mock):
+        """The engine reports each call's WatchError retries to the observer."""
+        import redis
+        pipe = MagicMock()
+        pipe.zcard.return_value = 0
+        pipe.execute.side_effect = [redis.WatchError(), redis.WatchError(), [1, True, []]]
+        redis_mock.pipeline.return_value.__enter__.return_value = pipe
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+        observed = []
+        limiter.retry_observer = observed.append
+
+        limiter.check_and_consume("rl:hot", 60, 10)
+
+        assert observed == [2]
@@ -0,0 +1,116 @@
+from datetime import datetime
+from unittest.mock import MagicMock
+
+from policy_index import PolicyIndex, PolicyIndexRefresher
+
+
+def _row(id, scope, enabled=True, updated_at=datetime(2026, 1, 1), **targets):
+    row = {"id": id, "scope": scope, "enabled": enabled, "updated_at": updated_at,
+           "tenant_id": None, "user_id": None, "api_key_id": None,
+           "model_id": None, "model_tier_id": None,
+           "window_seconds": 60, "limit_value": 10, "tier_name": None}
+    row.update(targets)
+    return row
+
+
+IDS = dict(tenant_id=1, user_id=2, api_key_id=3, model_id=4, model_tier_id=5)
+
+
+class TestPolicyIndex:
+    """Unit tests for the in-memory policy index."""
+
+    def test_matches_like_policy_query(self):
+        """Same predicates and order as POLICIES_SQL: precedence, then id."""
+        index = PolicyIndex()
+        index.replace([
+            _row(1, "GLOBAL"),
+            _row(9, "TENANT", tenant_id=1),
+            _row(3, "TENANT", tenant_id=1),
+            _row(4, "TENANT", tenant_id=2),
+            _row(5, "USER_MODEL", user_id=2, model_id=4),
+            _row(6, "USER_MODEL", user_id=2, model_id=99),
+            _row(7, "MODEL_TIER", model_tier_id=5),
+            _row(8, "API_KEY", api_key_id=3),
+            _row(2, "MODEL", model_id=4),
+        ])
+
+        assert [p["id"] for p in index.policies(**IDS)] == [5, 8, 3, 9, 2, 7, 1]
+
+    def test_null_ids_never_match(self):
+        """Rows with a NULL target, and requests without that id, do not match."""
+        index = PolicyIndex()
+        index.replace([_row(1, "TENANT"), _row(2, "API_KEY", api_key_id=3)])
+
+        assert index.policies(**dict(IDS, api_key_id=None, tenant_id=None)) == []
+
+    def test_apply_updates_and_disables(self):
+        """Changed rows replace old ones; disabled rows leave the index."""
+        index = PolicyIndex()
+        index.replace([_row(1, "GLOBAL"), _row(2, "TENANT", tenant_id=1)])
+
+        changed = index.apply([
+            _row(1, "GLOBAL", limit_value=99, updated_at=datetime(2026, 1, 2)),
+            _row(2, "TENANT", enabled=False, tenant_id=1, updated_at=datetime(2026, 1, 3)),
+        ])
+
+        assert changed == 2
+        assert [(p["id"], p["limit_value"]) for p in index.policies(**IDS)] == [(1, 99)]
+        assert index.watermark == datetime(2026, 1, 3)
+        assert (len(index), index.id_sum) == (1, 1)
+
+
+    def test_tracks_adaptive_groups_of_enabled_policies(self):
+        """adaptive_groups follows the enabled rows."""
+        index = PolicyIndex()
+        index.replace([_row(1, "GLOBAL", adaptive_group="gpu-a"), _row(2, "TENANT", tenant_id=1)])
+        assert index.adaptive_groups == {"gpu-a"}
+
+        index.apply([_row(1, "GLOBAL", enabled=False, adaptive_group="gpu-a", updated_at=datetime(2026, 1, 2))])
+        assert index.adaptive_groups == frozenset()
+
+class TestPolicyIndexRefresher:
+    """Unit tests for the background refresh logic (driven synchronously)."""
+
+    def test_first_refresh_loads_snapshot_then_applies_changes(self):
+        """A full load first, then only rows changed since the watermark (minus the overlap)."""
+        index = PolicyIndex()
+        loader = MagicMock()
+        loader.load_policy_snapshot.return_value = [_row(1, "GLOBAL")]
+        loader.load_policy_changes.return_value = ([_row(2, "TENANT", tenant_id=1)], 2, 3)
+        refresher = PolicyIndexRefresher(index, loader, overlap_seconds=10, clock=lambda: 0.0)
+
+        refresher.refresh()
+        refresher.refresh()
+
+        loader.load_policy_changes.assert_called_once_with(datetime(2025, 12, 31, 23, 59, 50))
+        assert [p["id"] for p in index.policies(**IDS)] == [2, 1]
+        assert refresher.stats()["fullReloads"] == 1
+
+    def test_deleted_rows_trigger_full_reload(self):
+        """A count/id-sum mismatch after applying changes reloads the table."""
+        index = PolicyIndex()
+        loader = MagicMock()
+        loader.load_policy_snapshot.side_effect = [[_row(1, "GLOBAL"), _row(2, "GLOBAL")], [_row(1, "GLOBAL")]]
+        loader.load_policy_changes.return_value = ([], 1, 1)
+        refresher = PolicyIndexRefresher(index, loader, clock=lambda: 0.0)
+
+        refresher.refresh()
+        refresher.refresh()
+
+        assert [p["id"] for p in index.policies(**IDS)] == [1]
+        assert refresher.full_reloads == 2
+
+    def test_failed_refresh_keeps_snapshot(self):
+        """Errors are counted and the previous snapshot keeps serving."""
+        index = PolicyIndex()
+        index.replace([_row(1, "GLOBAL")])
+        loader = MagicMock()
+        loader.load_policy_snapshot.side_effect = RuntimeError("db down")
+        refresher = PolicyIndexRefresher(index, loader, interval=0.01)
+
+        refresher.start()
+        refresher._stop.wait(0.05)
+        refresher.stop()
+
+        assert refresher.errors >= 1 and refresher.last_error == "db down"
+        assert [p["id"] for p in index.policies(**IDS)] == [1]
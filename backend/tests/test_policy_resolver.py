@@ -25,38 +25,93 @@ class TestPolicyResolver:
 
     @pytest.fixture
     def mock_resolver(self):
-        """Create resolver with mocked DB connection."""
+        """Resolver whose cursor is a mock; returns (resolver, cursor)."""
         with patch('policy_resolver.psycopg2.connect') as mock_connect:
             mock_conn = MagicMock()
+            mock_conn.closed = 0
             mock_connect.return_value = mock_conn
             resolver = PolicyResolver("mock_dsn")
-            return resolver, mock_conn
-
-    def test_get_tenant_id_found(self, mock_resolver):
-        """Test retrieving existing tenant ID."""
-        resolver, mock_conn = mock_resolver
-        mock_cursor = MagicMock()
-        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
-        mock_cursor.fetchone.return_value = (1,)
-        
-        with patch.object(resolver, '_fetch_one', return_value={'id': 1}):
-            tenant_id = resolver._get_tenant_id("enterprise_co")
-        
-        assert tenant_id == 1
+        cursor = MagicMock()
+        cursor.connection.prepared = set()
+        mock_conn.cursor.return_value.__enter__.return_value = cursor
+        return resolver, cursor
 
-    def test_get_tenant_id_not_found(self, mock_resolver):
-        """Test tenant not found returns None."""
-        resolver, _ = mock_resolver
-        with patch.object(resolver, '_fetch_one', return_value=None):
-            tenant_id = resolver._get_tenant_id("nonexistent")
-        
-        assert tenant_id is None
+    @staticmethod
+    def _ids_row(tenant_id=1, user_id=2, api_key_id=None, model_id=1, tier_id=1):
+        """A resolve row carrying only the resolved ids (no policy matched)."""
+        return {
+            "ctx_tenant_id": tenant_id,
+            "ctx_user_id": user_id,
+            "ctx_api_key_id": api_key_id,
+            "ctx_model_id": model_id,
+            "ctx_model_default_tier_id": tier_id,
+            "ctx_explicit_tier_id": None,
+            "id": None,
+        }
+
+    @staticmethod
+    def _statements(cursor):
+        return [c.args[0].split()[1] for c in cursor.execute.call_args_list if c.args[0].startswith("EXECUTE")]
+
+    def test_identities_resolved_by_prepared_statement(self, mock_resolver):
+        """Names are passed to the resolve statement and the ids it finds are cached."""
+        resolver, cursor = mock_resolver
+        cursor.fetchall.return_value = [self._ids_row()]
+        body = RateLimitRequest(userId="ent-user-1", modelId="gpt-4o", tenantId="enterprise_co")
+
+        resolver.resolve(body)
+
+        execute = cursor.execute.call_args_list[-1]
+        assert execute.args[0].startswith("EXECUTE rl_resolve")
+        assert execute.args[1] == ("enterprise_co", "ent-user-1", None, "gpt-4o", None)
+        assert resolver.identity_cache.get(("tenant", "enterprise_co")) == 1
+        assert resolver.identity_cache.get(("user", 1, "ent-user-1")) == 2
+
+    def test_missing_names_are_passed_as_null(self, mock_resolver):
+        """Absent request fields become NULL parameters."""
+        resolver, cursor = mock_resolver
+        cursor.fetchall.return_value = [self._ids_row(tenant_id=None, user_id=None)]
+
+        resolver.resolve(RateLimitRequest(userId="u1", modelId="gpt-4o"))
+
+        assert cursor.execute.call_args_list[-1].args[1] == (None, "u1", None, "gpt-4o", None)
+
+    def test_identity_lookups_are_cached(self, mock_resolver):
+        """Once ids are cached, resolves run the policy statement instead."""
+        resolver, cursor = mock_resolver
+        cursor.fetchall.side_effect = [[self._ids_row(api_key_id=7)], [], []]
+        body = RateLimitRequest(userId="u1", modelId="gpt-4o", tenantId="t", apiKey="hash_key")
+
+        resolver.resolve(body)
+        resolver.resolve(body)
+        resolver.resolve(body)
+
+        assert self._statements(cursor) == ["rl_resolve", "rl_policies", "rl_policies"]
+
+    def test_unknown_identity_is_negatively_cached(self, mock_resolver):
+        """Unknown names are cached as negative entries."""
+        resolver, cursor = mock_resolver
+        cursor.fetchall.side_effect = [[self._ids_row(tenant_id=None, user_id=None, model_id=None, tier_id=None)], []]
+        body = RateLimitRequest(userId="u1", modelId="nope", tenantId="nonexistent")
+
+        resolver.resolve(body)
+        resolver.resolve(body)
 
-    def test_get_tenant_id_none_input(self, mock_resolver):
-        """Test None input returns None."""
-        resolver, _ = mock_resolver
-        tenant_id = resolver._get_tenant_id(None)
-        assert tenant_id is None
+        assert self._statements(cursor) == ["rl_resolve", "rl_policies"]
+        assert cursor.execute.call_args_list[-1].args[1] == (None, None, None, None, None)
+
+    def test_invalidate_tenant_drops_its_users(self, mock_resolver):
+        """Invalidating a tenant also drops users cached under it."""
+        resolver, cursor = mock_resolver
+        cursor.fetchall.return_value = [self._ids_row(tenant_id=3)]
+        body = RateLimitRequest(userId="ent-user-1", modelId="gpt-4o", tenantId="enterprise_co")
+
+        resolver.resolve(body)
+        resolver.invalidate_tenant("enterprise_co")
+
+        assert resolver.identity_cache.get(("user", 3, "ent-user-1"), None) is None
+        resolver.resolve(body)
+        assert self._statements(cursor) == ["rl_resolve", "rl_resolve"]
 
     def test_redis_key_for_policy_global(self):
         """Test Redis key generation for GLOBAL scope."""
@@ -82,6 +137,72 @@ class TestPolicyResolver:
         key = resolver._redis_key_for_policy(policy)
         assert key == "rl:user:5:model:3"
 
+    def test_redis_key_for_counter_policy(self):
+        """Counter policies get their own key suffix (HASH, not ZSET)."""
+        policy = {"scope": "GLOBAL", "algorithm": "SLIDING_COUNTER"}
+        resolver = PolicyResolver.__new__(PolicyResolver)
+
+        assert resolver._redis_key_for_policy(policy) == "rl:global:swc"
+
+    def test_effective_limit_carries_algorithm(self):
+        """Policy rows map algorithm and counter_buckets onto EffectiveLimit."""
+        resolver = PolicyResolver.__new__(PolicyResolver)
+        limits = resolver._to_effective_limits([
+            {"id": 1, "scope": "GLOBAL", "window_seconds": 3600, "limit_value": 10,
+             "algorithm": "SLIDING_COUNTER", "counter_buckets": 12},
+            {"id": 2, "scope": "TENANT", "tenant_id": 1, "window_seconds": 60,
+             "limit_value": 5, "algorithm": "SLIDING_LOG", "counter_buckets": None},
+        ])
+        assert (limits[0].algorithm, limits[0].buckets) == ("SLIDING_COUNTER", 12)
+        assert (limits[1].algorithm, limits[1].buckets) == ("SLIDING_LOG", 1)
+
+    def test_effective_limit_carries_shards(self):
+        """The shards column maps onto EffectiveLimit; NULL means a single key."""
+        resolver = PolicyResolver.__new__(PolicyResolver)
+        limits = resolver._to_effective_limits([
+            {"id": 1, "scope": "GLOBAL", "window_seconds": 3600, "limit_value": 10, "shards": 16},
+            {"id": 2, "scope": "TENANT", "tenant_id": 1, "window_seconds": 60,
+             "limit_value": 5, "shards": None},
+        ])
+        assert [l.shards for l in limits] == [16, 1]
+        assert limits[0].key == "rl:global"
+
+    def test_limit_type_selects_policies(self):
+        """Rate and concurrency policies are resolved separately; concurrency keys get their own suffix."""
+        resolver = PolicyResolver.__new__(PolicyResolver)
+        rows = [
+            {"id": 1, "scope": "GLOBAL", "window_seconds": 60, "limit_value": 100},
+            {"id": 2, "scope": "MODEL_TIER", "model_tier_id": 2, "window_seconds": 30,
+             "limit_value": 8, "limit_type": "CONCURRENCY"},
+        ]
+
+        rate = resolver._to_effective_limits(rows)
+        concurrency = resolver._to_effective_limits(rows, limit_type="CONCURRENCY")
+
+        assert [l.key for l in rate] == ["rl:global"]
+        assert [(l.key, l.limit_type) for l in concurrency] == [("rl:modeltier:2:conc", "CONCURRENCY")]
+
+    def test_cost_policies_take_request_cost(self):
+        """COST policies get their own key and the request's cost; REQUESTS policies stay at 1."""
+        from policy_resolver import with_cost
+        resolver = PolicyResolver.__new__(PolicyResolver)
+        limits = with_cost(resolver._to_effective_limits([
+            {"id": 1, "scope": "GLOBAL", "window_seconds": 60, "limit_value": 100000, "limit_unit": "COST"},
+            {"id": 2, "scope": "TENANT", "tenant_id": 1, "window_seconds": 60, "limit_value": 5},
+        ]), 4096)
+
+        assert [(l.key, l.cost) for l in limits] == [("rl:global:cost", 4096), ("rl:tenant:1", 1)]
+
+    def test_adaptive_group_is_carried_over(self):
+        """adaptive_group comes from the policy row; the key stays the same as for a static policy."""
+        resolver = PolicyResolver.__new__(PolicyResolver)
+        limits = resolver._to_effective_limits([
+            {"id": 1, "scope": "GLOBAL", "window_seconds": 60, "limit_value": 100, "adaptive_group": "gpu-a"},
+            {"id": 2, "scope": "TENANT", "tenant_id": 1, "window_seconds": 60, "limit_value": 5},
+        ])
+
+        assert [(l.key, l.adaptive_group) for l in limits] == [("rl:global", "gpu-a"), ("rl:tenant:1", None)]
+
     def test_redis_key_for_policy_model_tier(self):
         """Test Redis key generation for MODEL_TIER scope."""
         policy = {"scope": "MODEL_TIER", "model_tier_id": 2}
@@ -89,3 +210,102 @@ class TestPolicyResolver:
         
         key = resolver._redis_key_for_policy(policy)
         assert key == "rl:modeltier:2"
+
+
+class TestResolve:
+    """Tests for single-statement policy resolution."""
+
+    @pytest.fixture
+    def resolver_and_cursor(self):
+        """Resolver whose cursor is a mock; returns (resolver, cursor)."""
+        with patch('policy_resolver.psycopg2.connect') as mock_connect:
+            mock_conn = MagicMock()
+            mock_conn.closed = 0
+            mock_connect.return_value = mock_conn
+            resolver = PolicyResolver("mock_dsn")
+        cursor = MagicMock()
+        cursor.connection.prepared = set()
+        mock_conn.cursor.return_value.__enter__.return_value = cursor
+        return resolver, cursor
+
+    @staticmethod
+    def _ctx(**overrides):
+        row = {
+            "ctx_tenant_id": 1,
+            "ctx_user_id": 2,
+            "ctx_api_key_id": None,
+            "ctx_model_id": 1,
+            "ctx_model_default_tier_id": 1,
+            "ctx_explicit_tier_id": 1,
+        }
+        row.update(overrides)
+        return row
+
+    @staticmethod
+    def _executed(cursor):
+        return [c.args[0].split()[0:2] for c in cursor.execute.call_args_list]
+
+    def test_cold_resolve_is_one_statement(self, resolver_and_cursor):
+        """Identities, policies and tier labels come from a single EXECUTE."""
+        resolver, cursor = resolver_and_cursor
+        cursor.fetchall.return_value = [
+            dict(self._ctx(), id=5, scope="MODEL_TIER", model_tier_id=1,
+                 tier_name="premium", window_seconds=3600, limit_value=1000),
+            dict(self._ctx(), id=1, scope="GLOBAL", model_tier_id=None,
+                 tier_name=None, window_seconds=3600, limit_value=1000000),
+        ]
+        body = RateLimitRequest(userId="ent-user-1", modelId="gpt-4o",
+                                tenantId="enterprise_co", modelTier="premium")
+
+        limits = resolver.resolve(body)
+
+        assert self._executed(cursor) == [["PREPARE", "rl_resolve"], ["EXECUTE", "rl_resolve"]]
+        assert [l.label for l in limits] == ["PREMIUM_TIER", "GLOBAL"]
+        assert limits[0].key == "rl:modeltier:1"
+
+    def test_statement_prepared_once_per_connection(self, resolver_and_cursor):
+        """Subsequent cold resolves only EXECUTE."""
+        resolver, cursor = resolver_and_cursor
+        cursor.fetchall.return_value = [dict(self._ctx(), id=None)]
+
+        resolver.resolve(RateLimitRequest(userId="u1", modelId="m1"))
+        resolver.resolve(RateLimitRequest(userId="u2", modelId="m2"))
+
+        verbs = [v[0] for v in self._executed(cursor)]
+        assert verbs == ["PREPARE", "EXECUTE", "EXECUTE"]
+
+    def test_warm_cache_uses_policy_statement(self, resolver_and_cursor):
+        """Once ids are cached only the policy statement runs."""
+        resolver, cursor = resolver_and_cursor
+        cursor.fetchall.side_effect = [[dict(self._ctx(), id=None)], []]
+        body = RateLimitRequest(userId="ent-user-1", modelId="gpt-4o",
+                                tenantId="enterprise_co", modelTier="premium")
+
+        assert resolver.resolve(body) == []
+        resolver.resolve(body)
+
+        last = cursor.execute.call_args_list[-1]
+        assert last.args[0].startswith("EXECUTE rl_policies")
+        # tenant_id, user_id, api_key_id, model_id, model_tier_id
+        assert last.args[1] == (1, 2, None, 1, 1)
+
+    def test_warm_cache_uses_loaded_policy_index(self, resolver_and_cursor):
+        """With a loaded policy index, warm resolves run no SQL at all."""
+        from policy_index import PolicyIndex
+
+        resolver, cursor = resolver_and_cursor
+        cursor.fetchall.return_value = [dict(self._ctx(), id=None)]
+        body = RateLimitRequest(userId="ent-user-1", modelId="gpt-4o",
+                                tenantId="enterprise_co", modelTier="premium")
+        resolver.resolve(body)
+        resolver.policy_index = PolicyIndex()
+        resolver.policy_index.replace([
+            {"id": 7, "scope": "TENANT", "tenant_id": 1, "enabled": True,
+             "window_seconds": 60, "limit_value": 50, "tier_name": None},
+        ])
+        executed = cursor.execute.call_count
+
+        limits = resolver.resolve(body)
+
+        assert cursor.execute.call_count == executed
+        assert [(l.key, l.limit) for l in limits] == [("rl:tenant:1", 50)]
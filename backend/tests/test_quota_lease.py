@@ -0,0 +1,172 @@
+import asyncio
+import threading
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from policy_resolver import EffectiveLimit
+from quota_lease import AsyncQuotaLeaseManager, QuotaLeaseManager
+
+
+def _global(limit=1_000_000):
+    return EffectiveLimit(key="rl:global", window_seconds=3600, limit=limit,
+                          label="GLOBAL", scope="GLOBAL")
+
+
+class TestQuotaLeaseManager:
+    """Unit tests for local quota leasing."""
+
+    @pytest.fixture
+    def manager(self, redis_mock):
+        acquire, give_back = MagicMock(), MagicMock()
+        redis_mock.register_script.side_effect = [acquire, give_back]
+        mgr = QuotaLeaseManager(redis_mock, min_chunk=3, max_chunk=100, lease_seconds=1.0)
+        return mgr, acquire, give_back
+
+    def test_handles_only_configured_high_limit_scopes(self, manager):
+        """Only listed scopes at or above min_limit are leased."""
+        mgr, _, _ = manager
+        assert mgr.handles(_global())
+        assert not mgr.handles(_global(limit=100))
+        assert not mgr.handles(EffectiveLimit(key="rl:user:1:model:1", window_seconds=60,
+                                              limit=10**6, label="U", scope="USER_MODEL"))
+
+    def test_serves_from_lease_without_redis(self, manager):
+        """One acquire serves a whole chunk from memory."""
+        mgr, acquire, _ = manager
+        acquire.return_value = [3, 503]
+
+        decisions = [mgr.consume([_global()])[0] for _ in range(3)]
+
+        assert all(d.allowed for d in decisions)
+        assert [d.count for d in decisions] == [501, 502, 503]
+        acquire.assert_called_once()
+        assert acquire.call_args.kwargs["keys"] == ["rl:global:lease"]
+
+    def test_renewal_returns_unused_units(self, manager):
+        """An expired lease hands back what it did not use before renewing."""
+        mgr, acquire, give_back = manager
+        acquire.return_value = [3, 3]
+        with patch("quota_lease.time.monotonic", return_value=100.0):
+            mgr.consume([_global()])
+        with patch("quota_lease.time.monotonic", return_value=102.0):
+            mgr.consume([_global()])
+
+        old_member, new_member = give_back.call_args.kwargs["args"]
+        assert old_member.endswith(":3")
+        assert new_member.endswith(":1")
+        assert acquire.call_count == 2
+
+    def test_denied_grant_rejects_and_backs_off(self, manager):
+        """No capacity left: reject, and do not ask Redis again during the backoff."""
+        mgr, acquire, _ = manager
+        acquire.return_value = [0, 1_000_000]
+
+        assert mgr.consume([_global()])[0].allowed is False
+        assert mgr.consume([_global()])[0].allowed is False
+        acquire.assert_called_once()
+
+    def test_backoff_entry_is_dropped_once_it_expires(self, manager):
+        """An elapsed backoff is forgotten and the key asks Redis again."""
+        mgr, acquire, _ = manager
+        acquire.side_effect = [[0, 1_000_000], [3, 3]]
+        with patch("quota_lease.time.monotonic", return_value=100.0):
+            assert mgr.consume([_global()])[0].allowed is False
+        assert "rl:global" in mgr._exhausted_until
+
+        with patch("quota_lease.time.monotonic", return_value=101.0):
+            assert mgr.consume([_global()])[0].allowed is True
+
+        assert mgr._exhausted_until == {}
+        assert acquire.call_count == 2
+
+    def test_all_or_nothing_across_leased_policies(self, manager):
+        """If one leased policy rejects, units taken from the others are refunded."""
+        mgr, acquire, _ = manager
+        tenant = EffectiveLimit(key="rl:tenant:1", window_seconds=3600, limit=50_000,
+                                label="TENANT", scope="TENANT")
+        acquire.side_effect = [[3, 3], [0, 50_000]]
+
+        decisions = mgr.consume([_global(), tenant])
+
+        assert [d.allowed for d in decisions] == [True, False]
+        assert mgr._leases["rl:global"].used == 0
+
+    def test_release_all_returns_leases(self, manager):
+        """Shutdown hands every unused unit back."""
+        mgr, acquire, give_back = manager
+        acquire.return_value = [3, 3]
+        mgr.consume([_global()])
+
+        mgr.release_all()
+
+        give_back.assert_called_once()
+        assert mgr._leases == {}
+
+    def test_renewal_runs_outside_the_lock(self, manager):
+        """Redis is called without holding the lock; concurrent callers wait for one renewal."""
+        mgr, acquire, _ = manager
+        in_acquire, proceed = threading.Event(), threading.Event()
+
+        def slow_acquire(**kwargs):
+            assert not mgr._lock.locked()
+            in_acquire.set()
+            proceed.wait(1)
+            return [10, 10]
+
+        acquire.side_effect = slow_acquire
+        results = []
+        first = threading.Thread(target=lambda: results.append(mgr.consume([_global()])[0]))
+        first.start()
+        in_acquire.wait(1)
+        second = threading.Thread(target=lambda: results.append(mgr.consume([_global()])[0]))
+        second.start()
+        mgr.refund([_global()])  # the lock is free while Redis is busy
+        proceed.set()
+        first.join(1)
+        second.join(1)
+
+        assert [d.allowed for d in results] == [True, True]
+        acquire.assert_called_once()
+        assert mgr._leases["rl:global"].used == 2
+
+    def test_failed_renewal_refunds_and_lets_others_retry(self, manager):
+        """A Redis error puts back units already taken and clears the in-flight renewal."""
+        mgr, acquire, _ = manager
+        tenant = EffectiveLimit(key="rl:tenant:1", window_seconds=3600, limit=50_000,
+                                label="TENANT", scope="TENANT")
+        acquire.side_effect = [[3, 3], ConnectionError("down"), [3, 3]]
+
+        with pytest.raises(ConnectionError):
+            mgr.consume([_global(), tenant])
+
+        assert mgr._leases["rl:global"].used == 0
+        assert mgr._renewing == {}
+        assert mgr.consume([tenant])[0].allowed
+
+
+class TestAsyncQuotaLeaseManager:
+    """Unit tests for the redis.asyncio lease manager."""
+
+    def test_concurrent_consumers_share_one_renewal(self):
+        """Awaiting callers wait for the renewal in flight instead of starting their own."""
+        client = MagicMock()
+        acquire, give_back = AsyncMock(), AsyncMock()
+        client.register_script.side_effect = [acquire, give_back]
+        mgr = AsyncQuotaLeaseManager(client, min_chunk=3, max_chunk=100)
+
+        async def slow_acquire(**kwargs):
+            await asyncio.sleep(0.01)
+            return [3, 3]
+
+        acquire.side_effect = slow_acquire
+
+        async def run():
+            results = await asyncio.gather(*(mgr.consume([_global()]) for _ in range(4)))
+            await mgr.release_all()
+            return results
+
+        results = asyncio.run(run())
+
+        assert [r[0].allowed for r in results] == [True, True, True, True]
+        assert acquire.await_count == 2
+        give_back.assert_awaited_once()
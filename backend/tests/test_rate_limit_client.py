@@ -0,0 +1,100 @@
+import asyncio
+import json
+import threading
+
+import httpx
+import pytest
+
+from models import RateLimitRequest
+from rate_limit_client import AsyncRateLimitClient, RateLimitClient
+
+
+def _result(allowed=True, retry_after_ms=None):
+    return {
+        "allowed": allowed,
+        "limit": 10,
+        "count": 10 if not allowed else 1,
+        "windowSeconds": 60,
+        "retryAfterMs": retry_after_ms,
+    }
+
+
+class _Service:
+    """check-batch stand-in recording the size of every call."""
+
+    def __init__(self, allowed=True, retry_after_ms=None, status=200):
+        self.allowed = allowed
+        self.retry_after_ms = retry_after_ms
+        self.status = status
+        self.batches = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        assert request.url.path == "/rate-limit/check-batch"
+        body = json.loads(request.content)
+        self.batches.append(body)
+        if self.status != 200:
+            return httpx.Response(self.status, json={"detail": "unavailable"})
+        return httpx.Response(200, json=[_result(self.allowed, self.retry_after_ms) for _ in body])
+
+
+def _req(user="u1"):
+    return RateLimitRequest(userId=user, modelId="gpt-4o")
+
+
+class TestRateLimitClient:
+    """Unit tests for the sync client's batching and rejection cache."""
+
+    def test_concurrent_checks_share_one_call(self):
+        """Checks made within the batch window go out as one check-batch call."""
+        service = _Service()
+        client = RateLimitClient(batch_window=0.2, max_batch=4, transport=httpx.MockTransport(service))
+        results = []
+        threads = [threading.Thread(target=lambda u=u: results.append(client.check(_req(u)))) for u in "abcd"]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(results) == 4 and all(r.allowed for r in results)
+        assert [len(b) for b in service.batches] == [4]
+        assert client.stats()["calls"] == 1
+
+    def test_rejection_with_retry_after_is_served_locally(self):
+        """A rejection is answered from the cache until its retry-after elapses."""
+        service = _Service(allowed=False, retry_after_ms=30_000)
+        with RateLimitClient(batch_window=0, transport=httpx.MockTransport(service)) as client:
+            first = client.check(_req())
+            second = client.check(_req())
+            other = client.check(_req("u2"))
+        assert not first.allowed and not second.allowed and not other.allowed
+        assert 0 < second.retryAfterMs <= 30_000
+        assert len(service.batches) == 2
+        assert client.stats()["cachedRejections"] == 1
+
+    def test_errors_reach_every_caller(self):
+        """An HTTP error of the batch call is raised to the caller."""
+        service = _Service(status=503)
+        with RateLimitClient(batch_window=0, transport=httpx.MockTransport(service)) as client:
+            with pytest.raises(httpx.HTTPStatusError):
+                client.check(_req())
+
+
+class TestAsyncRateLimitClient:
+    """Unit tests for the asyncio client."""
+
+    def test_concurrent_checks_share_one_call(self):
+        """Concurrent awaits are gathered into one call; a full batch is sent at once."""
+        service = _Service(allowed=False, retry_after_ms=5_000)
+
+        async def run():
+            async with AsyncRateLimitClient(
+                batch_window=0.05, max_batch=3, transport=httpx.MockTransport(service)
+            ) as client:
+                results = await asyncio.gather(*(client.check(_req(u)) for u in "abcde"))
+                cached = await client.check(_req("a"))
+                return results, cached, client.stats()
+
+        results, cached, stats = asyncio.run(run())
+        assert len(results) == 5 and not any(r.allowed for r in results)
+        assert sorted(len(b) for b in service.batches) == [2, 3]
+        assert not cached.allowed
+        assert stats == {"checks": 5, "calls": 2, "cachedRejections": 1}
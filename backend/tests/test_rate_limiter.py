@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 from rate_limiter import SlidingWindowRateLimiterTx
 
 
@@ -87,3 +87,503 @@ class TestSlidingWindowRateLimiter:
         # Should return a tuple result even on error
         assert isinstance(allowed, bool)
         assert isinstance(count, int)
+
+
+class TestCheckAndConsumeMany:
+    """Unit tests for the single round-trip multi-policy check."""
+
+    @staticmethod
+    def _limits():
+        from policy_resolver import EffectiveLimit
+        return [
+            EffectiveLimit(key="rl:user:1:model:1", window_seconds=60, limit=10,
+                           label="USER_MODEL", scope="USER_MODEL"),
+            EffectiveLimit(key="rl:global", window_seconds=3600, limit=1000,
+                           label="GLOBAL", scope="GLOBAL"),
+        ]
+
+    def test_script_registered_once(self, redis_mock):
+        """The script is registered at construction and reused per call."""
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+        limiter._multi_check.return_value = [1, 1, 1, 0, 0]
+
+        limiter.check_and_consume_many(self._limits())
+        limiter.check_and_consume_many(self._limits())
+
+        redis_mock.register_script.assert_called_once()
+        assert limiter._multi_check.call_count == 2
+
+    def test_admitted_returns_counts_per_key(self, redis_mock):
+        """All keys are allowed and counts come back in policy order."""
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+        limiter._multi_check.return_value = [1, 4, 250, 1700000060000, 1700003600000]
+
+        decisions = limiter.check_and_consume_many(self._limits())
+
+        assert [(d.allowed, d.count) for d in decisions] == [(True, 4), (True, 250)]
+        assert [d.reset_ms for d in decisions] == [1700000060000, 1700003600000]
+        kwargs = limiter._multi_check.call_args.kwargs
+        assert kwargs["keys"] == ["rl:user:1:model:1", "rl:global"]
+        # now_ms, n_groups, member, then
+        # (group, window_ms, limit, algorithm, buckets, shards, write_shard, cost) per policy
+        assert kwargs["args"][1] == 1
+        assert kwargs["args"][3:] == [1, 60000, 10, 0, 1, 1, 1, 1, 1, 3600000, 1000, 0, 1, 1, 1, 1]
+
+    def test_rejected_marks_only_exhausted_keys(self, redis_mock):
+        """On rejection only keys at their limit are reported as failing."""
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+        limiter._multi_check.return_value = [0, 10, 250, 0, 0]
+
+        decisions = limiter.check_and_consume_many(self._limits())
+
+        assert decisions[0].allowed is False
+        assert decisions[0].count == 10
+        assert decisions[1].allowed is True
+
+    def test_batch_groups_share_one_call(self, redis_mock):
+        """Several requests are evaluated in one call, one group each."""
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+        limits = self._limits()
+        # group 1 admitted, group 2 rejected on its first key
+        limiter._multi_check.return_value = [1, 0, 4, 250, 10, 0, 0, 0]
+
+        results = limiter.check_and_consume_batch([limits, limits[:1]])
+
+        limiter._multi_check.assert_called_once()
+        args = limiter._multi_check.call_args.kwargs["args"]
+        assert args[1] == 2
+        assert args[2] != args[3]  # distinct member per request
+        assert limiter._multi_check.call_args.kwargs["keys"] == [
+            "rl:user:1:model:1", "rl:global", "rl:user:1:model:1"
+        ]
+        assert [(d.allowed, d.count) for d in results[0]] == [(True, 4), (True, 250)]
+        assert [(d.allowed, d.count) for d in results[1]] == [(False, 10)]
+
+    def test_empty_limits_skips_redis(self, redis_mock):
+        """No policies means no script call."""
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+        assert limiter.check_and_consume_many([]) == []
+        limiter._multi_check.assert_not_called()
+
+
+class TestSlidingWindowCounterRateLimiter:
+    """Unit tests for the constant-memory sliding window counter."""
+
+    def test_check_and_consume_passes_counter_args(self, redis_mock):
+        """Single-key call uses the counter algorithm code and bucket count."""
+        from rate_limiter import SlidingWindowCounterRateLimiter
+        limiter = SlidingWindowCounterRateLimiter(redis_mock)
+        limiter._multi_check.return_value = [1, 42, 0]
+
+        allowed, count = limiter.check_and_consume("rl:global:swc", 3600, 1000000, buckets=6)
+
+        assert (allowed, count) == (True, 42)
+        kwargs = limiter._multi_check.call_args.kwargs
+        assert kwargs["keys"] == ["rl:global:swc"]
+        assert kwargs["args"][3:] == [1, 3600000, 1000000, 1, 6, 1, 1, 1]
+
+    def test_check_and_consume_rejected(self, redis_mock):
+        """A rejected estimate is returned as (False, count)."""
+        from rate_limiter import SlidingWindowCounterRateLimiter
+        limiter = SlidingWindowCounterRateLimiter(redis_mock)
+        limiter._multi_check.return_value = [0, 100, 1700000060000]
+
+        assert limiter.check_and_consume("rl:k:swc", 60, 100) == (False, 100)
+
+    def test_mixed_algorithms_in_one_script_call(self, redis_mock):
+        """Counter and log policies share the single multi-key call."""
+        from policy_resolver import EffectiveLimit
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+        limiter._multi_check.return_value = [1, 2, 3, 0, 0]
+        limits = [
+            EffectiveLimit(key="rl:user:1:model:1", window_seconds=60, limit=10,
+                           label="USER_MODEL", scope="USER_MODEL"),
+            EffectiveLimit(key="rl:global:swc", window_seconds=3600, limit=1000000,
+                           label="GLOBAL", scope="GLOBAL",
+                           algorithm="SLIDING_COUNTER", buckets=4),
+        ]
+
+        limiter.check_and_consume_many(limits)
+
+        args = limiter._multi_check.call_args.kwargs["args"]
+        assert args[3:] == [1, 60000, 10, 0, 1, 1, 1, 1, 1, 3600000, 1000000, 1, 4, 1, 1, 1]
+
+
+class TestContentionStats:
+    """WatchError retries and (False, -1) fallbacks are counted."""
+
+    def test_retries_and_fallback_are_counted(self, redis_mock):
+        """Every WatchError is a retry; giving up is a contention fallback."""
+        import redis
+        pipe = MagicMock()
+        pipe.zcard.return_value = 0
+        pipe.execute.side_effect = redis.WatchError()
+        redis_mock.pipeline.return_value.__enter__.return_value = pipe
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+
+        assert limiter.check_and_consume("rl:hot", 60, 10, max_retries=3) == (False, -1)
+        assert limiter.stats() == {"watchRetries": 3, "contentionFallbacks": 1}
+
+    def test_commit_after_retry(self, redis_mock):
+        """A commit after one conflict counts one retry and no fallback."""
+        import redis
+        pipe = MagicMock()
+        pipe.zcard.return_value = 4
+        pipe.execute.side_effect = [redis.WatchError(), [1, True, []]]
+        redis_mock.pipeline.return_value.__enter__.return_value = pipe
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+
+        assert limiter.check_and_consume("rl:hot", 60, 10) == (True, 5)
+        assert limiter.stats() == {"watchRetries": 1, "contentionFallbacks": 0}
+
+
+class TestMemberEncoding:
+    """Sliding-log members are compact and unique per admitted request."""
+
+    def test_members_are_short_and_distinct(self):
+        """10 bytes each, and never repeated within a process."""
+        from rate_limiter import _new_member
+        members = [_new_member() for _ in range(10_000)]
+        assert {len(m) for m in members} == {10}
+        assert len(set(members)) == len(members)
+
+    def test_same_millisecond_requests_get_separate_entries(self, redis_mock):
+        """Two commits in one millisecond add two members with the same score."""
+        pipe = MagicMock()
+        pipe.zcard.return_value = 0
+        pipe.execute.return_value = [1, True, []]
+        redis_mock.pipeline.return_value.__enter__.return_value = pipe
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+
+        with patch("rate_limiter.time.time", return_value=1700000000.0):
+            limiter.check_and_consume("rl:k", 60, 10)
+            limiter.check_and_consume("rl:k", 60, 10)
+
+        (first,), (second,) = (call.args[1].items() for call in pipe.zadd.call_args_list)
+        assert first[0] != second[0]
+        assert first[1] == second[1] == 1700000000000
+
+
+class TestResetAndPeek:
+    """Reset times returned with decisions, and the non-consuming peek."""
+
+    def test_rejection_reads_blocking_entry(self, redis_mock):
+        """A rejected key resets when the entry keeping it at the limit leaves the window."""
+        pipe = MagicMock()
+        pipe.zcard.return_value = 12
+        pipe.zrange.return_value = [(b"m", 1700000005000.0)]
+        redis_mock.pipeline.return_value.__enter__.return_value = pipe
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+
+        decision = limiter.check_and_consume_detailed("rl:hot", 60, 10)
+
+        assert decision == (False, 12, 1700000065000)
+        assert pipe.zrange.call_args.args == ("rl:hot", 2, 2)
+        pipe.multi.assert_not_called()
+
+    def test_commit_returns_oldest_entry_reset(self, redis_mock):
+        """On commit the oldest entry is read inside the same MULTI/EXEC."""
+        pipe = MagicMock()
+        pipe.zcard.return_value = 3
+        pipe.execute.return_value = [1, True, [(b"m", 1700000000000.0)]]
+        redis_mock.pipeline.return_value.__enter__.return_value = pipe
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+
+        assert limiter.check_and_consume_detailed("rl:k", 60, 10) == (True, 4, 1700000060000)
+
+    def test_peek_reads_without_writing(self, redis_mock):
+        """Peek counts in-window entries and estimates counters; nothing is trimmed or added."""
+        from policy_resolver import EffectiveLimit
+        pipe = MagicMock()
+        now_ms = 1700000030000
+        cur = now_ms // 30000  # bucket index for a 60 s window in 2 buckets
+        pipe.execute.return_value = [
+            10, [(b"m", 1700000001000.0)],
+            {str(cur).encode(): b"7", str(cur - 1).encode(): b"4"},
+        ]
+        redis_mock.pipeline.return_value.__enter__.return_value = pipe
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+        limits = [
+            EffectiveLimit(key="rl:u", window_seconds=60, limit=10, label="U", scope="USER_MODEL"),
+            EffectiveLimit(key="rl:g:swc", window_seconds=60, limit=100, label="G", scope="GLOBAL",
+                           algorithm="SLIDING_COUNTER", buckets=2),
+        ]
+
+        with patch("rate_limiter.time.time", return_value=now_ms / 1000):
+            decisions = limiter.peek(limits)
+
+        assert decisions[0] == (False, 10, 1700000061000)
+        assert decisions[1] == (True, 11, (cur + 1) * 30000)
+        pipe.zadd.assert_not_called()
+        pipe.zremrangebyscore.assert_not_called()
+        pipe.hincrby.assert_not_called()
+
+
+class TestCostWeighted:
+    """COST policies consume the request's cost instead of 1."""
+
+    @staticmethod
+    def _limits(cost):
+        from policy_resolver import EffectiveLimit, with_cost
+        return with_cost([
+            EffectiveLimit(key="rl:tenant:1:cost", window_seconds=60, limit=10000,
+                           label="TENANT", scope="TENANT", limit_unit="COST"),
+            EffectiveLimit(key="rl:user:1:model:1", window_seconds=60, limit=10,
+                           label="USER_MODEL", scope="USER_MODEL"),
+        ], cost)
+
+    def test_cost_is_passed_per_policy(self, redis_mock):
+        """COST sliding logs use the weighted-log code; REQUESTS policies still cost 1."""
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+        limiter._multi_check.return_value = [1, 4000, 3, 0, 0]
+
+        decisions = limiter.check_and_consume_many(self._limits(2500))
+
+        args = limiter._multi_check.call_args.kwargs["args"]
+        assert args[3:] == [1, 60000, 10000, 2, 1, 1, 1, 2500, 1, 60000, 10, 0, 1, 1, 1, 1]
+        assert [d.count for d in decisions] == [4000, 3]
+
+    def test_rejection_depends_on_cost(self, redis_mock):
+        """A COST policy fails when the cost does not fit, even below its limit."""
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+        limiter._multi_check.return_value = [0, 8000, 3, 0, 0]
+
+        decisions = limiter.check_and_consume_many(self._limits(2500))
+
+        assert [d.allowed for d in decisions] == [False, True]
+
+    def test_peek_sums_weighted_entries(self, redis_mock):
+        """Weighted-log members carry their units after the 10-byte request member."""
+        pipe = MagicMock()
+        pipe.execute.return_value = [
+            [(b"0123456789" + b"3000", 1700000001000.0), (b"abcdefghij" + b"-500", 1700000002000.0)],
+        ]
+        redis_mock.pipeline.return_value.__enter__.return_value = pipe
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+
+        with patch("rate_limiter.time.time", return_value=1700000030.0):
+            decision = limiter.peek(self._limits(8000)[:1])[0]
+
+        # 2500 used; 8000 more needs 500 freed: the first entry expiring does it
+        assert decision == (False, 2500, 1700000061000)
+
+    def test_adjust_adds_delta_to_write_shard(self, redis_mock):
+        """adjust() is one script call without an admission check."""
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+        limiter.adjust(self._limits(1)[:1], -700)
+
+        kwargs = redis_mock.register_script.return_value.call_args.kwargs
+        assert kwargs["keys"] == ["rl:tenant:1:cost"]
+        assert kwargs["args"][3:] == [60000, 2, 1, "-700"]
+
+    def test_adjust_is_booked_at_charge_time(self, redis_mock):
+        """The delta carries the charge's timestamp, never one later than now."""
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+        with patch("rate_limiter.time.time", return_value=1700000030.0):
+            limiter.adjust(self._limits(1)[:1], -700, charged_at_ms=1700000010000)
+            limiter.adjust(self._limits(1)[:1], 300, charged_at_ms=1700000099000)
+
+        calls = redis_mock.register_script.return_value.call_args_list
+        assert [c.kwargs["args"][:2] for c in calls] == [
+            [1700000030000, 1700000010000],
+            [1700000030000, 1700000030000],
+        ]
+
+
+class TestShardedCounters:
+    """Unit tests for policies striped over several Redis keys."""
+
+    def test_shard_keys(self):
+        """Unsharded policies keep their key; sharded ones get :s<i> sub-keys."""
+        from rate_limiter import shard_keys
+        assert shard_keys("rl:global", 1) == ["rl:global"]
+        assert shard_keys("rl:global", 3) == ["rl:global:s0", "rl:global:s1", "rl:global:s2"]
+
+    def test_pick_shard_spreads_writes(self):
+        """Writes land on every shard and stay in range."""
+        from rate_limiter import pick_shard
+        picks = [pick_shard(8) for _ in range(800)]
+        assert set(picks) == set(range(8))
+        assert pick_shard(1) == 0
+
+    def test_script_args_include_all_shard_keys(self, redis_mock):
+        """A sharded policy passes every shard key and a 1-based write shard."""
+        from policy_resolver import EffectiveLimit
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+        limiter._multi_check.return_value = [1, 7, 0]
+        lim = EffectiveLimit(key="rl:global", window_seconds=60, limit=100,
+                             label="GLOBAL", scope="GLOBAL", shards=4)
+
+        decisions = limiter.check_and_consume_many([lim])
+
+        assert decisions[0].count == 7
+        kwargs = limiter._multi_check.call_args.kwargs
+        assert kwargs["keys"] == [f"rl:global:s{i}" for i in range(4)]
+        assert kwargs["args"][3:9] == [1, 60000, 100, 0, 1, 4]
+        assert 1 <= kwargs["args"][9] <= 4
+
+    def test_sharded_tx_sums_shards_and_writes_one(self, redis_mock):
+        """Counts are summed across shards; the request is added to a single shard."""
+        pipe = MagicMock()
+        pipe.execute.side_effect = [
+            [0, 3, [(b"a", 1700000002000.0)], 0, 4, [(b"b", 1700000001000.0)], 0, 2, []],
+            [1, True],
+        ]
+        redis_mock.pipeline.return_value.__enter__.return_value = pipe
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+
+        decision = limiter.check_and_consume_sharded("rl:global", 60, 100, shards=3)
+
+        assert (decision.allowed, decision.count) == (True, 10)
+        assert decision.reset_ms == 1700000061000  # oldest entry over all shards
+        assert pipe.zcard.call_count == 3
+        pipe.zadd.assert_called_once()
+        assert pipe.zadd.call_args.args[0] in {"rl:global:s0", "rl:global:s1", "rl:global:s2"}
+
+    def test_sharded_tx_rejects_at_limit(self, redis_mock):
+        """No write when the summed count has reached the limit."""
+        pipe = MagicMock()
+        pipe.execute.return_value = [0, 5, [], 0, 5, []]
+        redis_mock.pipeline.return_value.__enter__.return_value = pipe
+        limiter = SlidingWindowRateLimiterTx(redis_mock)
+
+        decision = limiter.check_and_consume_sharded("rl:global", 60, 10, shards=2)
+        assert (decision.allowed, decision.count) == (False, 10)
+        pipe.zadd.assert_not_called()
+
+
+class TestAsyncSlidingWindowRateLimiter:
+    """Unit tests for the asyncio engine."""
+
+    @staticmethod
+    def _limits():
+        from policy_resolver import EffectiveLimit
+        return [
+            EffectiveLimit(key="rl:a", window_seconds=60, limit=10, label="A", scope="USER_MODEL"),
+            EffectiveLimit(key="rl:b", window_seconds=60, limit=5, label="B", scope="TENANT"),
+        ]
+
+    def test_check_and_consume_many_uses_script(self):
+        """The async engine issues the same single script call."""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from async_rate_limiter import AsyncSlidingWindowRateLimiterTx
+
+        client = MagicMock()
+        client.register_script.return_value = AsyncMock(return_value=[0, 3, 5, 0, 0])
+        limiter = AsyncSlidingWindowRateLimiterTx(client)
+
+        decisions = asyncio.run(limiter.check_and_consume_many(self._limits()))
+
+        assert [(d.allowed, d.count) for d in decisions] == [(True, 3), (False, 5)]
+        assert limiter._multi_check.await_args.kwargs["keys"] == ["rl:a", "rl:b"]
+
+    def test_check_and_consume_each_runs_concurrently(self):
+        """Per-policy transactions are gathered, preserving policy order."""
+        import asyncio
+        from async_rate_limiter import AsyncSlidingWindowRateLimiterTx
+        from rate_limiter import Decision
+
+        limiter = AsyncSlidingWindowRateLimiterTx(MagicMock())
+        in_flight = []
+        peak = []
+
+        async def fake_check(key, window_seconds, limit):
+            in_flight.append(key)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.remove(key)
+            return Decision(key == "rl:a", 1)
+
+        limiter.check_and_consume_detailed = fake_check
+        decisions = asyncio.run(limiter.check_and_consume_each(self._limits()))
+
+        assert max(peak) == 2
+        assert [d.allowed for d in decisions] == [True, False]
+
+
+class TestScriptsOnRedis:
+    """The Lua scripts themselves, run on fakeredis instead of a mocked register_script."""
+
+    NOW = 1700000000.0
+
+    @staticmethod
+    def _limit(key, limit, **kwargs):
+        from policy_resolver import EffectiveLimit
+        return EffectiveLimit(key=key, window_seconds=60, limit=limit, label=key, scope="TENANT", **kwargs)
+
+    def _at(self, seconds):
+        # Patches time.time itself, so fakeredis expiries follow the same clock;
+        # inspect keys inside the block
+        return patch("rate_limiter.time.time", return_value=self.NOW + seconds)
+
+    def test_multi_key_check_is_all_or_nothing(self, lua_redis):
+        """A rejection on one key consumes none of the others."""
+        limiter = SlidingWindowRateLimiterTx(lua_redis)
+        limits = [self._limit("rl:user:1", 1), self._limit("rl:global", 100)]
+
+        with self._at(0):
+            first = limiter.check_and_consume_many(limits)
+        with self._at(1):
+            second = limiter.check_and_consume_many(limits)
+            global_entries = lua_redis.zcard("rl:global")
+
+        assert [(d.allowed, d.count) for d in first] == [(True, 1), (True, 1)]
+        assert [(d.allowed, d.count) for d in second] == [(False, 1), (True, 1)]
+        assert global_entries == 1
+        assert second[0].reset_ms == int(self.NOW * 1000) + 60_000
+
+    def test_sliding_counter_counts_buckets_and_expires(self, lua_redis):
+        """Counter policies keep bucket counts in a hash and free them once out of the window."""
+        from rate_limiter import SLIDING_COUNTER
+        limiter = SlidingWindowRateLimiterTx(lua_redis)
+        lim = self._limit("rl:global:swc", 3, algorithm=SLIDING_COUNTER, buckets=6)
+
+        with self._at(0):
+            admitted = [limiter.check_and_consume_many([lim])[0].allowed for _ in range(4)]
+        with self._at(75):  # the charged bucket no longer overlaps the window
+            later = limiter.check_and_consume_many([lim])[0]
+            buckets = lua_redis.hlen("rl:global:swc")
+
+        assert admitted == [True, True, True, False]
+        assert (later.allowed, later.count) == (True, 1)
+        assert buckets == 1  # the expired bucket was dropped
+
+    def test_cost_charge_and_refund_expire_together(self, lua_redis):
+        """Weighted logs sum units; a refund booked at the charge time leaves the window with it."""
+        from policy_resolver import with_cost
+        limiter = SlidingWindowRateLimiterTx(lua_redis)
+        lim = self._limit("rl:tenant:1:cost", 1000, limit_unit="COST")
+
+        with self._at(0):
+            charged = limiter.check_and_consume_many(with_cost([lim], 900))[0]
+        with self._at(30):
+            limiter.adjust([lim], -600, charged_at_ms=int(self.NOW * 1000))
+            refunded = limiter.check_and_consume_many(with_cost([lim], 700))[0]
+        with self._at(70):
+            after_window = limiter.check_and_consume_many(with_cost([lim], 300))[0]
+            limiter.adjust([lim], -100, charged_at_ms=int(self.NOW * 1000))  # charge gone: no-op
+
+        assert (charged.allowed, charged.count) == (True, 900)
+        assert (refunded.allowed, refunded.count) == (True, 1000)
+        assert (after_window.allowed, after_window.count) == (True, 1000)  # only the 700 from t=30 is left
+
+    def test_cluster_rollback_undoes_admitted_slots(self, lua_redis):
+        """With cluster=True each slot is its own call; _UNDO_LUA rolls back the slots that admitted."""
+        from rate_limiter import SLIDING_COUNTER
+        limiter = SlidingWindowRateLimiterTx(lua_redis, cluster=True)
+        limits = [
+            self._limit("rl:{user:1}", 1),
+            self._limit("rl:{global}", 100),
+            self._limit("rl:{tenant:1}:swc", 100, algorithm=SLIDING_COUNTER),
+        ]
+
+        with self._at(0):
+            limiter.check_and_consume_many(limits)
+            second = limiter.check_and_consume_many(limits)
+            log_entries = lua_redis.zcard("rl:{global}")
+            counter = {int(v) for v in lua_redis.hvals("rl:{tenant:1}:swc")}
+
+        assert [d.allowed for d in second] == [False, True, True]
+        assert log_entries == 1
+        assert counter == {1}
@@ -0,0 +1,51 @@
+import msgpack
+import pytest
+
+from models import RateLimitResponse
+from stream_protocol import StreamCheck, decode_checks, encode_frames, result_frame
+
+
+class TestStreamProtocol:
+    """Unit tests for the /rate-limit/stream wire format."""
+
+    def test_decode_positional_frames(self):
+        """Optional trailing fields default; the frame id is kept as sent."""
+        message = msgpack.packb([[7, "u", "gpt-4o"], ["a", "u", "gpt-4o", "acme", None, "premium", 900]])
+
+        checks, errors = decode_checks(message, max_frames=10)
+
+        assert errors == []
+        assert checks == [
+            StreamCheck(7, "u", "gpt-4o"),
+            StreamCheck("a", "u", "gpt-4o", "acme", None, "premium", 900),
+        ]
+
+    def test_invalid_frames_get_error_frames(self):
+        """A bad frame is answered with [id, None, detail]; the rest of the message is still checked."""
+        message = msgpack.packb([[1, "", "gpt-4o"], [2, "u", "gpt-4o", None, None, None, 0], [3, "u", "m"], "x"])
+
+        checks, errors = decode_checks(message, max_frames=10)
+
+        assert [c.id for c in checks] == [3]
+        assert [(e[0], e[1]) for e in errors] == [(1, None), (2, None), (None, None)]
+        assert "cost" in errors[1][2]
+
+    def test_unusable_messages_raise(self):
+        """Non-msgpack data, non-array messages and oversized messages are rejected as a whole."""
+        for message in (b"\xc1", msgpack.packb({"userId": "u"}), msgpack.packb([[i, "u", "m"] for i in range(3)])):
+            with pytest.raises(ValueError):
+                decode_checks(message, max_frames=2)
+
+    def test_result_frame_round_trip(self):
+        """Result frames carry the check response fields positionally."""
+        response = RateLimitResponse(allowed=False, limit=10, count=10, windowSeconds=60,
+                                     cause="USER_MODEL exceeded", retryAfterMs=1500, resetAt=1700000000000)
+        charged = RateLimitResponse(allowed=True, limit=100000, count=4000, windowSeconds=60,
+                                    chargedAt=1699999999000)
+
+        decoded = msgpack.unpackb(encode_frames([result_frame(7, response), result_frame(8, charged)]))
+
+        assert decoded == [
+            [7, False, 10, 10, 60, 1500, 1700000000000, "USER_MODEL exceeded", None],
+            [8, True, 100000, 4000, 60, None, None, None, 1699999999000],
+        ]
@@ -0,0 +1,68 @@
+import pytest
+from unittest.mock import patch
+from ttl_cache import TTLCache, MISSING
+
+
+class TestTTLCache:
+    """Unit tests for the bounded LRU/TTL cache."""
+
+    def test_get_miss_returns_sentinel(self):
+        """Missing keys return MISSING, not None."""
+        cache = TTLCache()
+        assert cache.get("nope") is MISSING
+        assert cache.misses == 1
+
+    def test_negative_entry_is_cached(self):
+        """A cached None is a hit, distinct from a miss."""
+        cache = TTLCache()
+        cache.set("unknown", None)
+        assert cache.get("unknown") is None
+        assert cache.hits == 1
+
+    def test_entries_expire(self):
+        """Positive and negative entries use their own TTLs."""
+        cache = TTLCache(ttl_seconds=60, negative_ttl_seconds=5)
+        with patch("ttl_cache.time.monotonic", return_value=100.0):
+            cache.set("found", 1)
+            cache.set("unknown", None)
+        with patch("ttl_cache.time.monotonic", return_value=110.0):
+            assert cache.get("found") == 1
+            assert cache.get("unknown") is MISSING
+
+    def test_lru_eviction(self):
+        """Least recently used entry is evicted when full."""
+        cache = TTLCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is MISSING
+        assert cache.get("a") == 1
+        assert len(cache) == 2
+
+    def test_get_or_load_calls_loader_once(self):
+        """Loader only runs on a miss."""
+        cache = TTLCache()
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return None
+
+        assert cache.get_or_load("k", loader) is None
+        assert cache.get_or_load("k", loader) is None
+        assert len(calls) == 1
+
+    def test_invalidate_where(self):
+        """Predicate invalidation drops matching keys only."""
+        cache = TTLCache()
+        cache.set(("user", 1, "a"), 10)
+        cache.set(("user", 2, "b"), 20)
+        assert cache.invalidate_where(lambda k: k[1] == 1) == 1
+        assert cache.get(("user", 2, "b")) == 20
+
+    def test_zero_size_disables_caching(self):
+        """max_size=0 turns the cache off."""
+        cache = TTLCache(max_size=0)
+        cache.set("a", 1)
+        assert cache.get("a") is MISSING